@@ -0,0 +1,145 @@
+"""
+Account Classifier
+Compiled, memoized keyword rules that assign accounts and categories their report roles
+"""
+
+import re
+from functools import lru_cache
+
+# Each rule set maps to (rules, default). Rules are (role, keywords) pairs in
+# priority order: a name takes the first role with a keyword it contains.
+ACCOUNT_RULES = {
+    'balance_sheet': ([
+        ('current_asset', ['cash', 'bank', 'savings', 'receivable']),
+        ('non_current_asset', ['equipment', 'investment']),
+        ('credit_card', ['credit card']),
+    ], None),
+    'liability': ([(True, ['payable', 'loan', 'debt'])], False),
+    'liquid_asset': ([(True, ['cash', 'bank', 'receivable'])], False),
+    'cash': ([(True, ['cash', 'bank'])], False),
+    'payable': ([(True, ['payable'])], False),
+}
+
+CATEGORY_RULES = {
+    'income_statement': ([
+        ('cost_of_goods_sold', ['cogs', 'cost of goods', 'cost of sales', 'inventory']),
+        ('operating_expense', [
+            'rent', 'salary', 'salaries', 'utilities', 'office', 'marketing',
+            'advertising', 'travel', 'insurance'
+        ]),
+        ('other_income_expense', ['interest', 'tax', 'depreciation', 'amortization']),
+    ], None),
+    'cash_flow': ([
+        ('operating', [
+            'revenue', 'income', 'sale', 'commission', 'fee', 'service',
+            'rent', 'salary', 'utilities', 'office', 'marketing', 'insurance'
+        ]),
+        ('investing', ['equipment', 'investment', 'asset', 'property', 'capital', 'research']),
+        ('financing', ['loan', 'debt', 'dividend', 'equity', 'stock', 'financing']),
+    ], 'operating'),
+    'long_term_liability': ([(True, ['loan', 'debt', 'mortgage'])], False),
+}
+
+# Distinct names remembered per classifier
+CLASSIFIER_CACHE_SIZE = 65536
+
+
+class KeywordClassifier:
+    """
+    Classifies names against several keyword rule sets with a single regex scan.
+
+    All keywords of all rule sets are compiled into one pattern that is tried
+    at every position of the lowercased name, so one pass finds every keyword
+    it contains. Results are memoized per name.
+    """
+
+    def __init__(self, rules):
+        """
+        Compile a classifier
+
+        Args:
+            rules: Dict of rule set name to (rules, default), as in ACCOUNT_RULES
+        """
+        self.rules = rules
+        keywords = sorted(
+            {keyword for role_rules, _ in rules.values() for _, role_keywords in role_rules for keyword in role_keywords},
+            key=len, reverse=True
+        )
+        # A zero-width lookahead reports the longest keyword starting at each
+        # position; shorter keywords matching there are prefixes of it
+        self._pattern = re.compile('(?=(' + '|'.join(re.escape(keyword) for keyword in keywords) + '))')
+        self._prefixes = {
+            keyword: frozenset(other for other in keywords if keyword.startswith(other))
+            for keyword in keywords
+        }
+        self.classify = lru_cache(maxsize=CLASSIFIER_CACHE_SIZE)(self._classify)
+
+    def matched_keywords(self, name):
+        """
+        Find every keyword contained in a name
+
+        Args:
+            name: Account or category name
+
+        Returns:
+            set: Keywords found, case-insensitively
+        """
+        found = set()
+        for match in self._pattern.finditer(name.lower()):
+            found |= self._prefixes[match.group(1)]
+        return found
+
+    def _classify(self, name):
+        """Return the role of a name in every rule set"""
+        found = self.matched_keywords(name)
+        roles = {}
+        for rule_set, (role_rules, default) in self.rules.items():
+            roles[rule_set] = default
+            for role, role_keywords in role_rules:
+                if found.intersection(role_keywords):
+                    roles[rule_set] = role
+                    break
+        return roles
+
+    def classify_many(self, names):
+        """
+        Classify a batch of names, scanning each distinct name once
+
+        Args:
+            names: Iterable of names
+
+        Returns:
+            dict: Name to its roles in every rule set
+        """
+        return {name: self.classify(name) for name in dict.fromkeys(names)}
+
+
+# Shared classifiers used by the report generators
+account_classifier = KeywordClassifier(ACCOUNT_RULES)
+category_classifier = KeywordClassifier(CATEGORY_RULES)
+
+
+def classify_accounts(names):
+    """
+    Classify account names for the balance sheet and liquidity metrics
+
+    Args:
+        names: Iterable of account names
+
+    Returns:
+        dict: Account name to roles ('balance_sheet', 'liability', 'liquid_asset', 'cash', 'payable')
+    """
+    return account_classifier.classify_many(names)
+
+
+def classify_categories(names):
+    """
+    Classify category names for the income statement, cash flow and balance sheet
+
+    Args:
+        names: Iterable of category names
+
+    Returns:
+        dict: Category name to roles ('income_statement', 'cash_flow', 'long_term_liability')
+    """
+    return category_classifier.classify_many(names)
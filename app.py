@@ -81,6 +81,14 @@ with app.app_context():
     from routes import register_routes
     register_routes(app)
 
+    from chunked_upload import register_chunked_upload_routes
+    register_chunked_upload_routes(app)
+
+    from chat_context import build_chat_prompt
+    from chat_fastpath import fast_answer
+    from chat_stream import register_chat_stream_routes
+    register_chat_stream_routes(app, build_prompt=build_chat_prompt, answer_directly=fast_answer)
+
 # Set up login manager callback
 @login_manager.user_loader
 def load_user(user_id):
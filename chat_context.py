@@ -0,0 +1,326 @@
+"""
+Chat Context
+Compact, token-budgeted summaries of an upload's aggregates for chatbot prompts
+"""
+
+import os
+import math
+import hashlib
+import logging
+import threading
+
+# Exact token counts need the optional tiktoken package
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger('fintelligence')
+
+# Most tokens a data summary may add to a prompt
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.environ.get('CHAT_CONTEXT_TOKEN_BUDGET', 600))
+
+# Categories and accounts listed, and most recent months shown, before trimming to the budget
+CHAT_CONTEXT_TOP_N = int(os.environ.get('CHAT_CONTEXT_TOP_N', 8))
+CHAT_CONTEXT_MONTHS = int(os.environ.get('CHAT_CONTEXT_MONTHS', 12))
+
+# Transactions retrieved for each question and added after the summary
+CHAT_CONTEXT_TRANSACTIONS = int(os.environ.get('CHAT_CONTEXT_TRANSACTIONS', 8))
+
+# Result cache kind the summary is stored under
+CHAT_CONTEXT_KIND = 'chat:context'
+
+# Result cache kinds the analyzers store an upload's aggregates under, by file type;
+# Excel workbooks are not cached by their analyzer
+AGGREGATE_KINDS = {'pdf': 'analysis:pdf', 'xlsx': None}
+DEFAULT_AGGREGATE_KIND = 'analysis:totals'
+
+# Characters per token assumed without tiktoken
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+
+# Uploads whose summary is being built in the background
+_precomputing = set()
+_precomputing_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """
+    Count the tokens in a text, exactly with tiktoken or approximately without it
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        int: Number of tokens
+    """
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def build_chat_context(financial_data, label=None, token_budget=CHAT_CONTEXT_TOKEN_BUDGET,
+                       top_n=CHAT_CONTEXT_TOP_N, months=CHAT_CONTEXT_MONTHS):
+    """
+    Summarize financial data for a chatbot prompt within a token budget.
+
+    The summary holds the totals, the top categories and accounts by
+    expenses and income, and the monthly and quarterly series. It is built
+    from the aggregates only, so its size does not depend on the number of
+    transactions. When it does not fit the budget, fewer categories, accounts
+    and months are listed until it does.
+
+    Args:
+        financial_data: Structured financial data from analyze_csv_data and friends
+        label: Name of the upload, shown in the first line
+        token_budget: Most tokens the summary may take
+        top_n: Categories and accounts listed at most
+        months: Most recent months listed at most
+
+    Returns:
+        str: The summary, or an empty string without data
+    """
+    if not financial_data:
+        return ""
+
+    while True:
+        context = _render_context(financial_data, label, top_n, months)
+        if estimate_tokens(context) <= token_budget or (top_n <= 1 and months <= 1):
+            break
+        top_n = max(1, top_n - 1 - top_n // 4)
+        months = max(1, months - 1 - months // 4)
+
+    # Even the smallest summary can exceed a very small budget
+    while estimate_tokens(context) > token_budget and '\n' in context:
+        context = context.rsplit('\n', 1)[0]
+    return context
+
+
+def _render_context(financial_data, label, top_n, months):
+    """Render the summary with the given number of buckets"""
+    lines = []
+    count = len(financial_data.get('transactions') or [])
+    by_month = financial_data.get('by_month') or {}
+    header = f"Ledger: {label}" if label else "Ledger"
+    if count:
+        header += f", {count} transactions"
+    if by_month:
+        month_names = sorted(by_month)
+        header += f", {month_names[0]} to {month_names[-1]}"
+    lines.append(header)
+    lines.append(
+        f"Totals: income {_money(financial_data.get('income'))}, "
+        f"expenses {_money(financial_data.get('expenses'))}, "
+        f"net {_money(financial_data.get('net_income'))}"
+    )
+
+    for title, bucket_key in (('categories', 'by_category'), ('accounts', 'by_account')):
+        buckets = financial_data.get(bucket_key) or {}
+        if not buckets:
+            continue
+        lines.append(f"Top {title} by expenses: " + _ranked(buckets, 'expenses', top_n))
+        lines.append(f"Top {title} by income: " + _ranked(buckets, 'income', top_n))
+        if len(buckets) > top_n:
+            lines.append(f"({len(buckets)} {title} in total)")
+
+    if by_month:
+        recent = sorted(by_month)[-months:]
+        lines.append(
+            "Monthly income/expenses: "
+            + "; ".join(f"{name} {_money(by_month[name]['income'])}/{_money(by_month[name]['expenses'])}"
+                        for name in recent)
+        )
+    quarters = financial_data.get('quarters') or {}
+    if quarters:
+        lines.append(
+            "Quarterly net: "
+            + "; ".join(f"{name} {_money(quarters[name]['net'])}"
+                        for name in sorted(quarters, key=lambda name: name.split()[::-1]))
+        )
+    return "\n".join(lines)
+
+
+def _ranked(buckets, field, top_n):
+    """List the top_n buckets by the magnitude of one field"""
+    ranked = sorted(buckets.items(), key=lambda item: abs(item[1].get(field) or 0.0), reverse=True)
+    ranked = [(name, bucket) for name, bucket in ranked[:top_n] if bucket.get(field)]
+    return "; ".join(f"{name} {_money(bucket[field])}" for name, bucket in ranked) or "none"
+
+
+def _money(value):
+    return f"{float(value or 0.0):.2f}"
+
+
+def precompute_chat_context(file_path, financial_data, label=None):
+    """
+    Build the summary of an upload and store it in the result cache, so
+    chat prompts about the file do not have to analyze it again
+
+    Args:
+        file_path: Path to the uploaded file
+        financial_data: Structured financial data for the file
+        label: Name of the upload
+
+    Returns:
+        str: The summary
+    """
+    from result_cache import result_cache
+
+    context = build_chat_context(financial_data, label=label)
+    try:
+        result_cache.put(result_cache.key_for(file_path, CHAT_CONTEXT_KIND), context)
+    except Exception as e:
+        logger.warning(f"Could not cache chat context of {file_path}: {str(e)}")
+    return context
+
+
+def get_chat_context(file_path, file_type, label=None):
+    """
+    Return the summary of an upload without analyzing the file during the request
+
+    A summary that was not precomputed is built from the upload's cached
+    aggregates when the analyzers already stored them. Otherwise the file is
+    analyzed in a background thread, and until that finishes a one-line
+    note saying the figures are not ready stands in for the summary.
+
+    Args:
+        file_path: Path to the uploaded file
+        file_type: File extension (csv, xlsx, pdf or a compressed CSV type)
+        label: Name of the upload
+
+    Returns:
+        str: The summary or the stand-in note, or an empty string on error
+    """
+    from result_cache import result_cache
+
+    try:
+        context = result_cache.get(result_cache.key_for(file_path, CHAT_CONTEXT_KIND))
+        if context is not None:
+            return context
+        kind = AGGREGATE_KINDS.get(file_type, DEFAULT_AGGREGATE_KIND)
+        financial_data = result_cache.get(result_cache.key_for(file_path, kind)) if kind else None
+    except Exception as e:
+        logger.error(f"Error reading chat context for {file_path}: {str(e)}")
+        return ""
+    if financial_data is not None:
+        return precompute_chat_context(file_path, financial_data, label=label)
+
+    precompute_in_background(file_path, file_type, label=label)
+    return f"{label or os.path.basename(file_path)}: still being analyzed, no figures available yet"
+
+
+def precompute_in_background(file_path, file_type, label=None):
+    """
+    Analyze an upload and store its summary in a background thread, unless
+    that is already under way
+
+    Args:
+        file_path: Path to the uploaded file
+        file_type: File extension (csv, xlsx, pdf or a compressed CSV type)
+        label: Name of the upload
+
+    Returns:
+        bool: True if the work was started
+    """
+    with _precomputing_lock:
+        if file_path in _precomputing:
+            return False
+        _precomputing.add(file_path)
+
+    def precompute():
+        try:
+            financial_data = upload_aggregates(file_path, file_type)
+            if financial_data:
+                precompute_chat_context(file_path, financial_data, label=label)
+        except Exception as e:
+            logger.error(f"Error building chat context for {file_path}: {str(e)}")
+        finally:
+            with _precomputing_lock:
+                _precomputing.discard(file_path)
+
+    threading.Thread(target=precompute, name='chat-context', daemon=True).start()
+    return True
+
+
+def upload_aggregates(file_path, file_type):
+    """
+    Analyze an upload, reusing cached results where the analyzers keep them
+
+    Args:
+        file_path: Path to the uploaded file
+        file_type: File extension (csv, xlsx, pdf or a compressed CSV type)
+
+    Returns:
+        dict: Structured financial data, or None if the file cannot be analyzed
+    """
+    from financial_data_processor import analyze_csv_data, analyze_pdf_data, analyze_xlsx_data
+
+    if file_type == 'xlsx':
+        return analyze_xlsx_data(file_path)
+    if file_type == 'pdf':
+        return analyze_pdf_data(file_path)
+    return analyze_csv_data(file_path, streaming=True)
+
+
+def latest_upload(user):
+    """
+    Find the user's most recent upload that is still on disk
+
+    Args:
+        user: User whose uploads to search
+
+    Returns:
+        tuple: (FileUpload, file path), or (None, None) if there is none
+    """
+    from flask import current_app
+    from models import FileUpload
+
+    upload = (FileUpload.query.filter_by(user_id=user.id)
+              .order_by(FileUpload.upload_date.desc()).first())
+    if upload is None:
+        return None, None
+    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], upload.filename)
+    if not os.path.exists(file_path):
+        return None, None
+    return upload, file_path
+
+
+def build_chat_prompt(user, chat_session, message):
+    """
+    Prefix a chat message with the summary of the user's latest upload and
+    the transactions most relevant to it
+
+    Matches the build_prompt hook of register_chat_stream_routes. The
+    transactions come from the upload's retrieval index (see
+    transaction_index); while the index is being built only the summary is
+    sent. The file is never analyzed during the request (see get_chat_context).
+
+    Args:
+        user: Current user
+        chat_session: ChatSession the message belongs to
+        message: The user's question
+
+    Returns:
+        tuple: (prompt, fingerprint of the summary or None)
+    """
+    from transaction_index import build_index_in_background, relevant_transactions
+
+    upload, file_path = latest_upload(user)
+    if upload is None:
+        return message, None
+    file_type = upload.file_type.lower()
+    context = get_chat_context(file_path, file_type, label=upload.filename)
+    if not context:
+        return message, None
+
+    build_index_in_background(file_path, file_type)
+    transactions = relevant_transactions(file_path, message, k=CHAT_CONTEXT_TRANSACTIONS)
+    if transactions:
+        context += "\nRelevant transactions (Date | Account | Category | Description | Amount | Type):\n" + transactions
+
+    prompt = f"Financial data summary:\n{context}\n\nQuestion: {message}"
+    return prompt, hashlib.sha256(context.encode('utf-8')).hexdigest()
@@ -0,0 +1,315 @@
+"""
+Chat Fast Path
+Answers plain numeric chatbot questions straight from the upload aggregates, without calling the LLM
+"""
+
+import re
+import time
+import logging
+import calendar
+import threading
+from collections import OrderedDict, deque
+
+from latency_metrics import latency_percentiles_ms
+
+logger = logging.getLogger('fintelligence')
+
+# Aggregates kept in memory for fast-path answers, by file path
+FASTPATH_MEMORY_ENTRIES = 16
+
+# Answer times kept per path for the percentile metrics
+ANSWER_PATH_WINDOW = 1000
+
+# Words naming each metric; 'net' is checked first so "net income" is not read as income
+METRIC_WORDS = (
+    ('net', ('net income', 'net profit', 'net loss', 'net', 'profit', 'loss')),
+    ('income', ('income', 'revenue', 'revenues', 'earnings', 'earned', 'sales')),
+    ('expenses', ('expenses', 'expense', 'spending', 'spent', 'spend', 'costs', 'cost')),
+)
+
+# Questions that ask for judgement or a derived figure rather than a total go to the LLM
+OPEN_ENDED_WORDS = (
+    'why', 'should', 'could', 'would', 'recommend', 'advice', 'advise', 'explain', 'improve',
+    'compare', 'comparison', 'versus', 'vs', 'trend', 'forecast', 'predict', 'reduce', 'increase',
+    'average', 'highest', 'lowest', 'most', 'least', 'biggest', 'top', 'each', 'every', 'between',
+    'margin', 'percentage', 'percent', 'ratio', 'rate', 'share', 'worth', 'tax', 'taxes', 'taxable', 'owe'
+)
+
+# Words that only frame the question; any other word must name the metric,
+# the period or a category or account, or the question goes to the LLM
+FILLER_WORDS = (
+    'what', "what's", 'whats', 'how', 'much', 'is', 'was', 'were', 'are', 'did', 'do', 'does',
+    'i', 'we', 'my', 'our', 'the', 'a', 'total', 'overall', 'all', 'in', 'for', 'on', 'from',
+    'at', 'of', 'during', 'me', 'tell', 'show', 'give', 'please', 'have', 'has', 'had'
+)
+
+_MONTH_NUMBERS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+_MONTH_NUMBERS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+_MONTH_NAMES = '|'.join(sorted(_MONTH_NUMBERS, key=len, reverse=True))
+
+_ISO_MONTH = re.compile(r'\b(\d{4})-(0[1-9]|1[0-2])\b')
+_NAMED_MONTH = re.compile(rf'\b({_MONTH_NAMES})\.?,?\s+(\d{{4}})\b', re.IGNORECASE)
+_QUARTER = re.compile(r'\bq([1-4])\s*(?:of\s+)?(\d{4})\b|\b(\d{4})\s*q([1-4])\b', re.IGNORECASE)
+_YEAR = re.compile(r'\b(19\d{2}|20\d{2})\b')
+_WORD = re.compile(r"[a-z0-9']+")
+
+_memory = OrderedDict()
+_memory_lock = threading.Lock()
+_path_counts = {}
+_path_times = {}
+_paths_lock = threading.Lock()
+
+
+def parse_question(question):
+    """
+    Recognize a numeric lookup question
+
+    The shapes understood are a metric (income, expenses or net income),
+    optionally for a period (a month such as 2025-03 or March 2025, a
+    quarter such as Q1 2025, or a year) or a category or account name that
+    appears in the question. The words the metric and period do not account
+    for are kept under 'rest' so the caller can check that the question
+    asks for nothing more.
+
+    Args:
+        question: The user's question
+
+    Returns:
+        dict: Intent with 'metric', 'period_kind' (month, quarter, year or
+            None), 'period' and the 'rest' of the question text, or None if
+            the question is not a plain lookup
+    """
+    text = question.strip().lower()
+    words = set(_WORD.findall(text))
+    if not words or words & set(OPEN_ENDED_WORDS) or len(words) > 20:
+        return None
+
+    metric = None
+    for name, phrases in METRIC_WORDS:
+        for phrase in phrases:
+            match = re.search(rf'\b{re.escape(phrase)}\b', text)
+            if match:
+                metric = name
+                text = _consume(text, match)
+                break
+        if metric is not None:
+            break
+    if metric is None:
+        return None
+
+    period = _parse_period(text)
+    if period is None:
+        return None
+    period_kind, period_name, match = period
+    if match is not None:
+        text = _consume(text, match)
+
+    # A month named without a year is left in the rest and sends the question to the LLM
+    return {'metric': metric, 'period_kind': period_kind, 'period': period_name, 'rest': text}
+
+
+def _parse_period(text):
+    """
+    Find the period a question is about
+
+    Returns:
+        tuple: (kind, period, match), with kind and match None when no
+            period is named, or None if several years are named
+    """
+    match = _ISO_MONTH.search(text)
+    if match:
+        return 'month', f"{match.group(1)}-{match.group(2)}", match
+    match = _NAMED_MONTH.search(text)
+    if match:
+        month = _MONTH_NUMBERS[match.group(1).lower()]
+        return 'month', f"{match.group(2)}-{month:02d}", match
+    match = _QUARTER.search(text)
+    if match:
+        quarter, year = (match.group(1), match.group(2)) if match.group(1) else (match.group(4), match.group(3))
+        return 'quarter', f"Q{quarter} {year}", match
+    matches = list(_YEAR.finditer(text))
+    if len(matches) > 1:
+        return None
+    if matches:
+        return 'year', matches[0].group(1), matches[0]
+    return None, None, None
+
+
+def answer_from_aggregates(question, financial_data):
+    """
+    Answer a numeric lookup question from the aggregates, if it is one
+
+    Every word of the question must be accounted for by the metric, the
+    period, a category or account name, or FILLER_WORDS; anything else
+    ("income tax", "rent in March") may change the answer, so the question
+    goes to the LLM. The aggregates have no per-period totals for a category
+    or account, so a question naming both goes to the LLM as well.
+
+    Args:
+        question: The user's question
+        financial_data: Structured financial data from analyze_csv_data and friends
+
+    Returns:
+        str: The answer, or None if the question needs the LLM
+    """
+    if not financial_data:
+        return None
+    intent = parse_question(question)
+    if intent is None:
+        return None
+
+    # A category or account named in the question; the longest name wins
+    rest = intent['rest']
+    named = _named_bucket(rest, financial_data)
+    if named is not None:
+        rest = _consume(rest, named[3])
+    if not set(_WORD.findall(rest)) <= set(FILLER_WORDS):
+        return None
+
+    metric = intent['metric']
+    if named is not None:
+        if intent['period_kind'] is not None:
+            return None
+        kind, name, bucket, _ = named
+        return _format_answer(metric, f"for {kind} {name}", bucket, name)
+
+    if intent['period_kind'] == 'month':
+        bucket = (financial_data.get('by_month') or {}).get(intent['period'])
+        return _format_answer(metric, f"in {intent['period']}", bucket, intent['period'])
+
+    if intent['period_kind'] == 'quarter':
+        bucket = (financial_data.get('quarters') or {}).get(intent['period'])
+        return _format_answer(metric, f"in {intent['period']}", bucket, intent['period'])
+
+    if intent['period_kind'] == 'year':
+        year = intent['period']
+        months = [bucket for name, bucket in (financial_data.get('by_month') or {}).items()
+                  if name.startswith(f"{year}-")]
+        bucket = None
+        if months:
+            bucket = {key: sum(month[key] for month in months) for key in ('income', 'expenses', 'net')}
+        return _format_answer(metric, f"in {year}", bucket, year)
+
+    # Summed from the category buckets like the answers above: the top-level expense
+    # total only counts rows typed Expense, while buckets count every non-income row
+    categories = list((financial_data.get('by_category') or {}).values())
+    if categories:
+        totals = {key: sum(bucket[key] for bucket in categories) for key in ('income', 'expenses', 'net')}
+    else:
+        totals = {
+            'income': financial_data.get('income', 0.0),
+            'expenses': financial_data.get('expenses', 0.0),
+            'net': financial_data.get('net_income', 0.0)
+        }
+    return _format_answer(metric, "overall", totals, None)
+
+
+def _format_answer(metric, scope, bucket, period):
+    """Phrase the figure for a metric, or report that the period has no data"""
+    label = {'income': 'Total income', 'expenses': 'Total expenses', 'net': 'Net income'}[metric]
+    if bucket is None:
+        return f"There are no transactions {scope} in your data." if period else None
+    value = bucket.get(metric, 0.0) or 0.0
+    return f"{label} {scope}: {value:,.2f}"
+
+
+def _named_bucket(text, financial_data):
+    """Find the category or account whose name appears in the question, with its match"""
+    matches = []
+    for kind, bucket_key in (('category', 'by_category'), ('account', 'by_account')):
+        for name, bucket in (financial_data.get(bucket_key) or {}).items():
+            name_text = str(name).strip().lower()
+            if not name_text or _is_metric_word(name_text):
+                # A category called 'Income' says nothing about the question's subject
+                continue
+            match = re.search(rf'(?<![a-z0-9]){re.escape(name_text)}(?![a-z0-9])', text)
+            if match:
+                matches.append((len(name_text), kind, name, bucket, match))
+    if not matches:
+        return None
+    _, kind, name, bucket, match = max(matches, key=lambda found: found[0])
+    return kind, name, bucket, match
+
+
+def _is_metric_word(name_text):
+    """Whether a bucket name is just a metric word"""
+    return any(name_text in phrases for _, phrases in METRIC_WORDS)
+
+
+def _consume(text, match):
+    """Blank out the part of the text a match accounts for"""
+    return f"{text[:match.start()]} {text[match.end():]}"
+
+
+def record_answer_path(path, seconds):
+    """
+    Count an answer under the path that served it
+
+    Args:
+        path: 'fastpath' for aggregate lookups, 'llm' for model answers
+        seconds: Time taken to produce the answer
+    """
+    with _paths_lock:
+        _path_times.setdefault(path, deque(maxlen=ANSWER_PATH_WINDOW)).append(seconds)
+        _path_counts[path] = _path_counts.get(path, 0) + 1
+
+
+def answer_path_metrics():
+    """
+    Report how chat answers were served
+
+    Returns:
+        dict: For each path, the number of answers and p50/p95 answer time in milliseconds
+    """
+    metrics = {}
+    with _paths_lock:
+        for path, values in _path_times.items():
+            metrics[path] = {'count': _path_counts[path], 'latency_ms': latency_percentiles_ms(values)}
+    return metrics
+
+
+def fast_answer(user, question):
+    """
+    Answer a question about the user's latest upload without the LLM, if possible
+
+    The upload's aggregates are kept in memory after the first lookup, so
+    later answers take microseconds.
+
+    Args:
+        user: Current user
+        question: The user's question
+
+    Returns:
+        str: The answer, or None if the question needs the LLM
+    """
+    if parse_question(question) is None:
+        return None
+
+    from chat_context import latest_upload, upload_aggregates
+
+    upload, file_path = latest_upload(user)
+    if upload is None:
+        return None
+
+    with _memory_lock:
+        financial_data = _memory.get(file_path)
+        if financial_data is not None:
+            _memory.move_to_end(file_path)
+    if financial_data is None:
+        try:
+            financial_data = upload_aggregates(file_path, upload.file_type.lower())
+        except Exception as e:
+            logger.error(f"Error loading aggregates for fast-path answer: {str(e)}")
+            return None
+        if not financial_data:
+            return None
+        with _memory_lock:
+            _memory[file_path] = financial_data
+            while len(_memory) > FASTPATH_MEMORY_ENTRIES:
+                _memory.popitem(last=False)
+
+    start = time.perf_counter()
+    answer = answer_from_aggregates(question, financial_data)
+    if answer is not None:
+        logger.info(f"Fast-path answer in {(time.perf_counter() - start) * 1e6:.0f} µs")
+    return answer
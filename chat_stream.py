@@ -0,0 +1,173 @@
+"""
+Chat Streaming
+Relays chatbot answers to the browser token by token as server-sent events
+"""
+
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+from flask import Response, jsonify, request, stream_with_context
+from flask_login import current_user, login_required
+
+from latency_metrics import latency_percentiles_ms
+
+logger = logging.getLogger('fintelligence')
+
+# Times to first token kept for the percentile metrics
+TTFT_WINDOW = 1000
+
+# Expected quota wait, in seconds, from which the client is sent a 'queued' event
+QUEUED_NOTICE_SECONDS = 1.0
+
+_ttft = deque(maxlen=TTFT_WINDOW)
+_ttft_lock = threading.Lock()
+
+
+def sse_event(event, payload):
+    """
+    Format one server-sent event
+
+    Args:
+        event: Event name
+        payload: JSON-serializable data
+
+    Returns:
+        str: The event, ready to write to the response
+    """
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def stream_metrics():
+    """
+    Report time to first token of streamed answers
+
+    Returns:
+        dict: Number of answers measured and p50/p95 time to first token in milliseconds
+    """
+    with _ttft_lock:
+        values = list(_ttft)
+    return {'count': len(values), 'ttft_ms': latency_percentiles_ms(values)}
+
+
+def register_chat_stream_routes(app, build_prompt=None, answer_directly=None):
+    """
+    Register POST /send_message/stream, the streaming variant of /send_message
+
+    The endpoint takes the same form fields (message, session_id) and answers
+    with a text/event-stream of 'token' events carrying text pieces, then a
+    'done' event once the user message and the complete answer have been
+    saved as ChatMessage rows; 'done' names the path that served the answer
+    ('fastpath' or 'llm'). When the API quota will delay the answer, a
+    'queued' event with the expected wait in seconds comes first. LLM
+    answers go through the shared dispatcher (see dispatch_chat_stream), so
+    the concurrency cap, per-user fairness and coalescing apply. If no
+    answer can be streamed it sends an 'error' event with fallback set, and
+    nothing is saved, so the client can repeat the question through
+    /send_message; a call refused for quota carries wait_seconds instead.
+    A stream that breaks off partway also ends with an 'error' event, and
+    its partial answer is not saved.
+
+    Args:
+        app: Flask application
+        build_prompt: Function (user, chat_session, message) returning the
+            prompt and a data fingerprint; the message alone is used if None
+        answer_directly: Function (user, message) returning an answer without
+            the LLM, or None to ask the LLM; every question goes to the LLM if None
+    """
+
+    @app.route('/send_message/stream', methods=['POST'])
+    @login_required
+    def send_message_stream():
+        from app import db
+        from models import ChatMessage, ChatSession
+        from chat_fastpath import record_answer_path
+        from llm_dispatcher import FutureTimeoutError, dispatch_chat_stream
+        from llm_scheduler import QuotaWaitTooLong, call_tokens, llm_scheduler
+
+        start = time.perf_counter()
+        message = (request.form.get('message') or '').strip()
+        session_id = request.form.get('session_id', type=int)
+        if not message:
+            return jsonify({'success': False, 'error': 'Message is empty'}), 400
+
+        chat_session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first()
+        if chat_session is None:
+            return jsonify({'success': False, 'error': 'Chat session not found'}), 404
+
+        user_id = current_user.id
+        direct_answer = answer_directly(current_user, message) if answer_directly is not None else None
+        prompt, fingerprint = message, None
+        if direct_answer is None and build_prompt is not None:
+            prompt, fingerprint = build_prompt(current_user, chat_session, message)
+
+        def generate():
+            path = 'llm' if direct_answer is None else 'fastpath'
+            pieces = []
+            if direct_answer is not None:
+                pieces.append(direct_answer)
+                yield sse_event('token', {'text': direct_answer})
+            else:
+                # Tell the user up front when the API quota will hold the answer back
+                wait = llm_scheduler.estimate_wait(call_tokens(prompt))
+                if wait >= QUEUED_NOTICE_SECONDS:
+                    yield sse_event('queued', {'wait_seconds': round(wait, 1)})
+
+                try:
+                    for piece in dispatch_chat_stream(prompt, user_id=user_id, data_fingerprint=fingerprint):
+                        if not pieces:
+                            with _ttft_lock:
+                                _ttft.append(time.perf_counter() - start)
+                        pieces.append(piece)
+                        yield sse_event('token', {'text': piece})
+                except QuotaWaitTooLong as e:
+                    yield sse_event('error', {
+                        'error': f'The assistant is busy right now. Please try again in about {e.wait_seconds:.0f} seconds.',
+                        'wait_seconds': round(e.wait_seconds, 1),
+                        'fallback': False
+                    })
+                    return
+                except FutureTimeoutError:
+                    logger.error("Timed out waiting for a streamed chat answer")
+                    yield sse_event('error', {'error': 'The assistant took too long to answer', 'fallback': not pieces})
+                    return
+                except Exception as e:
+                    # Broken off partway: the partial answer is neither saved nor shown as complete
+                    logger.error(f"Error streaming chat answer: {str(e)}")
+                    yield sse_event('error', {'error': 'The response was interrupted', 'fallback': not pieces})
+                    return
+
+            answer = "".join(pieces)
+            if not answer:
+                yield sse_event('error', {'error': 'No response could be streamed', 'fallback': True})
+                return
+
+            try:
+                db.session.add(ChatMessage(session_id=chat_session.id, is_user=True, message=message))
+                ai_message = ChatMessage(session_id=chat_session.id, is_user=False, message=answer)
+                db.session.add(ai_message)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error saving streamed chat message: {str(e)}")
+                yield sse_event('error', {'error': 'The answer could not be saved', 'fallback': False})
+                return
+
+            record_answer_path(path, time.perf_counter() - start)
+            yield sse_event('done', {
+                'success': True,
+                'path': path,
+                'ai_message': {
+                    'id': ai_message.id,
+                    'content': answer,
+                    'timestamp': ai_message.timestamp.strftime('%H:%M') if ai_message.timestamp else None
+                }
+            })
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
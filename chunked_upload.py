@@ -0,0 +1,480 @@
+"""
+Chunked Uploads
+Resumable uploads written to UPLOAD_FOLDER chunk by chunk, hashed and parsed while they arrive
+"""
+
+import os
+import re
+import json
+import uuid
+import time
+import hashlib
+import logging
+import threading
+
+from flask import jsonify, request
+from flask_login import current_user, login_required
+from werkzeug.utils import secure_filename
+
+from compressed_files import COMPRESSED_TYPES
+
+logger = logging.getLogger('fintelligence')
+
+# Largest chunk accepted per request; must stay under MAX_CONTENT_LENGTH
+UPLOAD_CHUNK_BYTES = int(os.environ.get('UPLOAD_CHUNK_MB', 8)) * 1024 * 1024
+
+# Largest file accepted through chunked uploads
+MAX_CHUNKED_UPLOAD_BYTES = int(os.environ.get('MAX_CHUNKED_UPLOAD_GB', 10)) * 1024 * 1024 * 1024
+
+# File types accepted, as for the upload form
+CHUNKED_UPLOAD_TYPES = ('csv', 'xlsx', 'pdf') + COMPRESSED_TYPES
+
+# Bytes read from the request body at a time
+COPY_BLOCK_BYTES = 1024 * 1024
+
+# Hours an upload may go without a chunk before its files are removed
+CHUNKED_UPLOAD_TTL_HOURS = float(os.environ.get('CHUNKED_UPLOAD_TTL_HOURS', 24))
+
+# Seconds between sweeps for abandoned uploads
+CHUNKED_UPLOAD_SWEEP_SECONDS = 3600
+
+_UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ChunkedUpload:
+    """
+    An upload in progress.
+
+    Chunks must arrive in order: each one starts at the number of bytes
+    received so far. Bytes are appended to a '.part' file, added to a running
+    SHA-256 and, for CSV files, fed to a CsvStreamAggregator. The upload's
+    metadata is kept in a JSON file next to the data, so an interrupted
+    upload can resume from the bytes already on disk, even after a restart.
+    """
+
+    def __init__(self, upload_id, user_id, filename, file_type, size, directory, parent_file_id=None):
+        """
+        Describe an upload
+
+        Args:
+            upload_id: Hex identifier of the upload
+            user_id: Owner of the upload
+            filename: Original file name
+            file_type: File extension (csv, xlsx, pdf)
+            size: Total size announced by the client
+            directory: Folder the upload is written to
+            parent_file_id: Earlier CSV upload this one extends with appended rows, if any
+        """
+        self.upload_id = upload_id
+        self.user_id = user_id
+        self.filename = filename
+        self.file_type = file_type
+        self.size = size
+        self.directory = directory
+        self.parent_file_id = parent_file_id
+        self.received = 0
+        self.lock = threading.Lock()
+        self._digest = hashlib.sha256()
+        self._aggregator = None
+        if file_type == 'csv':
+            from ingestion import CsvStreamAggregator
+            self._aggregator = CsvStreamAggregator()
+
+    @property
+    def content_hash(self):
+        """Hex SHA-256 of the bytes received so far"""
+        return self._digest.hexdigest()
+
+    @property
+    def data_path(self):
+        return os.path.join(self.directory, f"{self.upload_id}.part")
+
+    @property
+    def state_path(self):
+        return os.path.join(self.directory, f"{self.upload_id}.json")
+
+    @classmethod
+    def create(cls, user_id, filename, file_type, size, directory, parent_file_id=None):
+        """
+        Start a new upload with an empty data file
+
+        Returns:
+            ChunkedUpload: The new upload
+        """
+        upload = cls(uuid.uuid4().hex, user_id, filename, file_type, size, directory, parent_file_id)
+        open(upload.data_path, 'wb').close()
+        with open(upload.state_path, 'w', encoding='utf-8') as state_file:
+            json.dump({
+                'user_id': user_id,
+                'filename': filename,
+                'file_type': file_type,
+                'size': size,
+                'parent_file_id': parent_file_id
+            }, state_file)
+        return upload
+
+    @classmethod
+    def load(cls, upload_id, directory):
+        """
+        Reopen an upload left by an earlier process, replaying the bytes
+        already received through the hash and the parser
+
+        Returns:
+            ChunkedUpload: The upload, or None if it does not exist
+        """
+        state_path = os.path.join(directory, f"{upload_id}.json")
+        try:
+            with open(state_path, 'r', encoding='utf-8') as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return None
+
+        upload = cls(upload_id, state['user_id'], state['filename'], state['file_type'], state['size'], directory,
+                     state.get('parent_file_id'))
+        if not os.path.exists(upload.data_path):
+            return None
+        with open(upload.data_path, 'rb') as data_file:
+            for block in iter(lambda: data_file.read(COPY_BLOCK_BYTES), b''):
+                upload._consume(block)
+        logger.info(f"Resumed chunked upload {upload_id} at {upload.received} bytes")
+        return upload
+
+    def append(self, offset, stream, length, limit=None):
+        """
+        Append a chunk read from a stream
+
+        Bytes are kept as they are read, so a dropped connection loses only
+        the part of the chunk that never arrived. Without a length (chunked
+        transfer encoding) the stream is read to its end, keeping at most
+        limit bytes and no more than the file has left; a longer chunk is
+        refused after those bytes, and the client resumes from received.
+
+        Args:
+            offset: Position of the chunk in the file; must equal received
+            stream: Readable stream with the chunk bytes
+            length: Number of bytes in the chunk, or None if it is not known
+            limit: Most bytes accepted from a chunk of unknown length
+
+        Returns:
+            int: Bytes received so far
+
+        Raises:
+            ValueError: If the offset is wrong or the chunk overruns the file or the limit
+        """
+        if offset != self.received:
+            raise ValueError(f"Expected offset {self.received}, got {offset}")
+        if length is not None and self.received + length > self.size:
+            raise ValueError("Chunk extends past the announced file size")
+
+        remaining = length
+        if remaining is None:
+            remaining = self.size - self.received if limit is None else min(limit, self.size - self.received)
+        with open(self.data_path, 'ab') as data_file:
+            while remaining > 0:
+                block = stream.read(min(COPY_BLOCK_BYTES, remaining))
+                if not block:
+                    break
+                data_file.write(block)
+                data_file.flush()
+                self._consume(block)
+                remaining -= len(block)
+        if length is None and remaining == 0 and stream.read(1):
+            raise ValueError(f"Chunk is longer than allowed; resume from offset {self.received}")
+        return self.received
+
+    def finish(self, upload_folder):
+        """
+        Move the completed file into the upload folder
+
+        Args:
+            upload_folder: Folder holding processed uploads
+
+        Returns:
+            tuple: (stored file name, path, hex SHA-256, streamed aggregates or None)
+        """
+        stored_name = f"{self.upload_id}_{secure_filename(self.filename)}"
+        file_path = os.path.join(upload_folder, stored_name)
+        os.replace(self.data_path, file_path)
+        self.discard()
+
+        financial_data = None
+        if self._aggregator is not None:
+            try:
+                financial_data = self._aggregator.finish()
+            except Exception as e:
+                logger.error(f"Error parsing chunked upload {self.upload_id}: {str(e)}")
+        return stored_name, file_path, self.content_hash, financial_data
+
+    def discard(self):
+        """Remove the upload's data and state files"""
+        for path in (self.data_path, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def status(self):
+        """
+        Describe the upload for the client
+
+        Returns:
+            dict: Identifier, bytes received and total size
+        """
+        return {
+            'upload_id': self.upload_id,
+            'received': self.received,
+            'size': self.size
+        }
+
+    def _consume(self, block):
+        """Hash and parse bytes that were written"""
+        self._digest.update(block)
+        if self._aggregator is not None:
+            try:
+                self._aggregator.feed(block)
+            except Exception as e:
+                # Keep receiving; the file is analyzed normally after upload
+                logger.error(f"Error parsing chunked upload {self.upload_id}: {str(e)}")
+                self._aggregator = None
+        self.received += len(block)
+
+
+# Uploads in progress in this process, by identifier
+_uploads = {}
+_uploads_lock = threading.Lock()
+
+
+def get_upload(upload_id, directory):
+    """
+    Find an upload in progress, reopening it from disk if needed
+
+    Args:
+        upload_id: Hex identifier of the upload
+        directory: Folder the upload is written to
+
+    Returns:
+        ChunkedUpload: The upload, or None if it does not exist
+    """
+    if not _UPLOAD_ID_PATTERN.match(upload_id):
+        return None
+    with _uploads_lock:
+        upload = _uploads.get(upload_id)
+    if upload is not None:
+        return upload
+
+    # Replaying a large upload takes a while; do it outside the lock
+    upload = ChunkedUpload.load(upload_id, directory)
+    if upload is None:
+        return None
+    with _uploads_lock:
+        return _uploads.setdefault(upload_id, upload)
+
+
+def sweep_abandoned_uploads(directory, max_age_hours=CHUNKED_UPLOAD_TTL_HOURS):
+    """
+    Remove the files of uploads that have not received a chunk for a while
+
+    Args:
+        directory: Folder the uploads are written to
+        max_age_hours: Hours without a chunk after which an upload is abandoned
+
+    Returns:
+        int: Number of uploads removed
+    """
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for name in os.listdir(directory):
+        upload_id, extension = os.path.splitext(name)
+        if extension != '.json' or not _UPLOAD_ID_PATTERN.match(upload_id):
+            continue
+        paths = [os.path.join(directory, name), os.path.join(directory, f"{upload_id}.part")]
+        try:
+            last_write = max(os.path.getmtime(path) for path in paths if os.path.exists(path))
+            if last_write >= cutoff:
+                continue
+            with _uploads_lock:
+                _uploads.pop(upload_id, None)
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+        except OSError as e:
+            logger.warning(f"Could not remove abandoned upload {upload_id}: {str(e)}")
+            continue
+        removed += 1
+    if removed:
+        logger.info(f"Removed {removed} abandoned chunked uploads")
+    return removed
+
+
+def register_chunked_upload_routes(app):
+    """
+    Register the chunked upload endpoints
+
+    A client starts an upload with POST /upload/chunked, sends chunks with
+    PUT /upload/chunked/<id> and an Upload-Offset header, asks
+    GET /upload/chunked/<id> for the offset to resume from after a dropped
+    connection, and ends with POST /upload/chunked/<id>/complete. A CSV
+    upload started with 'append_to' set to the id of an earlier CSV upload
+    is treated as that ledger with rows appended: only the new rows are
+    parsed when the earlier upload's snapshot still matches. Uploads left
+    without a chunk for CHUNKED_UPLOAD_TTL_HOURS are removed by a sweep
+    that runs at most hourly when uploads start.
+
+    Args:
+        app: Flask application
+    """
+    upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'chunked')
+    os.makedirs(upload_dir, exist_ok=True)
+    chunk_limit = min(UPLOAD_CHUNK_BYTES, app.config.get('MAX_CONTENT_LENGTH') or UPLOAD_CHUNK_BYTES)
+    last_sweep = {'at': 0.0}
+
+    def sweep_if_due():
+        now = time.time()
+        if now - last_sweep['at'] >= CHUNKED_UPLOAD_SWEEP_SECONDS:
+            last_sweep['at'] = now
+            sweep_abandoned_uploads(upload_dir)
+
+    def owned_upload(upload_id):
+        upload = get_upload(upload_id, upload_dir)
+        if upload is None or upload.user_id != current_user.id:
+            return None
+        return upload
+
+    @app.route('/upload/chunked', methods=['POST'])
+    @login_required
+    def start_chunked_upload():
+        payload = request.get_json(silent=True) or {}
+        filename = str(payload.get('filename', ''))
+        file_type = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+        try:
+            size = int(payload.get('size', -1))
+        except (TypeError, ValueError):
+            size = -1
+
+        if file_type not in CHUNKED_UPLOAD_TYPES:
+            return jsonify({'error': 'Only CSV, XLSX or PDF files, or CSV compressed as .gz, .zip or .zst, are allowed!'}), 400
+        if not 0 < size <= MAX_CHUNKED_UPLOAD_BYTES:
+            return jsonify({'error': 'Invalid file size'}), 400
+
+        # A CSV ledger re-exported with new rows can name the upload it extends
+        parent_file_id = payload.get('append_to')
+        if parent_file_id is not None:
+            from models import FileUpload
+            try:
+                parent = FileUpload.query.filter_by(id=int(parent_file_id), user_id=current_user.id).first()
+            except (TypeError, ValueError):
+                parent = None
+            if file_type != 'csv' or parent is None or parent.file_type.lower() != 'csv':
+                return jsonify({'error': 'Only a CSV upload can extend an earlier CSV upload'}), 400
+            parent_file_id = parent.id
+
+        sweep_if_due()
+        upload = ChunkedUpload.create(current_user.id, filename, file_type, size, upload_dir, parent_file_id)
+        with _uploads_lock:
+            _uploads[upload.upload_id] = upload
+        logger.info(f"Started chunked upload {upload.upload_id} for {filename} ({size} bytes)")
+        return jsonify(dict(upload.status(), chunk_size=chunk_limit)), 201
+
+    @app.route('/upload/chunked/<upload_id>', methods=['GET'])
+    @login_required
+    def chunked_upload_status(upload_id):
+        upload = owned_upload(upload_id)
+        if upload is None:
+            return jsonify({'error': 'Upload not found'}), 404
+        return jsonify(dict(upload.status(), chunk_size=chunk_limit))
+
+    @app.route('/upload/chunked/<upload_id>', methods=['PUT'])
+    @login_required
+    def append_chunked_upload(upload_id):
+        upload = owned_upload(upload_id)
+        if upload is None:
+            return jsonify({'error': 'Upload not found'}), 404
+
+        # None with chunked transfer encoding; append then counts the bytes it reads
+        length = request.content_length
+        if length is not None and length > chunk_limit:
+            return jsonify({'error': f'Chunks may be at most {chunk_limit} bytes'}), 413
+        try:
+            offset = int(request.headers.get('Upload-Offset', -1))
+        except ValueError:
+            offset = -1
+
+        with upload.lock:
+            try:
+                received = upload.append(offset, request.stream, length, limit=chunk_limit)
+            except ValueError as e:
+                return jsonify(dict(upload.status(), error=str(e))), 409
+        return jsonify(dict(upload.status(), received=received))
+
+    @app.route('/upload/chunked/<upload_id>/complete', methods=['POST'])
+    @login_required
+    def complete_chunked_upload(upload_id):
+        from app import db
+        from chat_context import precompute_chat_context
+        from models import FileUpload
+        from result_cache import result_cache
+        from transaction_index import build_index_in_background
+
+        upload = owned_upload(upload_id)
+        if upload is None:
+            return jsonify({'error': 'Upload not found'}), 404
+
+        with upload.lock:
+            if upload.received != upload.size:
+                return jsonify(dict(upload.status(), error='Upload is incomplete')), 409
+            expected_hash = (request.get_json(silent=True) or {}).get('sha256')
+            if expected_hash and expected_hash.lower() != upload.content_hash:
+                return jsonify(dict(upload.status(), error='Checksum mismatch')), 422
+
+            stored_name, file_path, content_hash, financial_data = upload.finish(app.config['UPLOAD_FOLDER'])
+            with _uploads_lock:
+                _uploads.pop(upload_id, None)
+
+        file_upload = FileUpload(filename=stored_name, file_type=upload.file_type, user_id=current_user.id)
+        db.session.add(file_upload)
+        db.session.commit()
+
+        # CSV ledgers keep a snapshot of their aggregates, so a later
+        # re-export with appended rows only parses the new rows
+        if upload.file_type == 'csv':
+            from ledger_snapshots import analyze_appended_upload, save_snapshot
+            try:
+                parent = FileUpload.query.get(upload.parent_file_id) if upload.parent_file_id else None
+                if parent is not None:
+                    financial_data = analyze_appended_upload(file_upload, parent, file_path)
+                elif financial_data is not None:
+                    save_snapshot(file_upload, file_path, financial_data)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error saving ledger snapshot of {file_path}: {str(e)}")
+
+        # The file was hashed and parsed while it arrived; store the streamed
+        # aggregates where analyze_csv_data(streaming=True) will find them,
+        # along with the chat summary built from them; the transaction index
+        # for chat retrieval is built in the background
+        result_cache.remember_hash(file_path, content_hash)
+        if financial_data is not None:
+            try:
+                result_cache.put(result_cache.key_for(file_path, 'analysis:totals'), financial_data)
+            except Exception as e:
+                logger.warning(f"Could not cache streamed aggregates of {file_path}: {str(e)}")
+            precompute_chat_context(file_path, financial_data, label=stored_name)
+        build_index_in_background(file_path, upload.file_type)
+
+        logger.info(f"Completed chunked upload {upload_id} as file {file_upload.id}")
+        return jsonify({
+            'file_id': file_upload.id,
+            'filename': stored_name,
+            'sha256': content_hash,
+            'analyzed': financial_data is not None
+        })
+
+    @app.route('/upload/chunked/<upload_id>', methods=['DELETE'])
+    @login_required
+    def cancel_chunked_upload(upload_id):
+        upload = owned_upload(upload_id)
+        if upload is None:
+            return jsonify({'error': 'Upload not found'}), 404
+        with upload.lock:
+            upload.discard()
+            with _uploads_lock:
+                _uploads.pop(upload_id, None)
+        return jsonify({'cancelled': True})
@@ -0,0 +1,86 @@
+"""
+Compressed Files
+Opens plain, gzip, zip or zstd compressed CSV uploads as one decompressed byte stream
+"""
+
+import gzip
+import zipfile
+
+# zstd support is optional and needs the zstandard package
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Upload extensions holding a compressed CSV
+COMPRESSED_TYPES = ('gz', 'zip', 'zst')
+
+# Leading bytes of each supported compression format
+_MAGIC_NUMBERS = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'PK\x03\x04', 'zip'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+)
+
+
+def detect_compression(file_path):
+    """
+    Detect the compression of a file from its leading bytes
+
+    Args:
+        file_path: Path to the file
+
+    Returns:
+        str: 'gzip', 'zip' or 'zstd', or None for an uncompressed file
+    """
+    with open(file_path, 'rb') as source:
+        head = source.read(4)
+    for magic, compression in _MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def open_csv_source(file_path):
+    """
+    Open a CSV upload for reading, decompressing it on the fly.
+
+    Nothing is extracted to disk: the returned stream decompresses as it is
+    read. A zip archive must hold one CSV file; other members such as
+    __MACOSX metadata are ignored.
+
+    Args:
+        file_path: Path to a plain or compressed CSV file
+
+    Returns:
+        file: Binary stream of the CSV bytes, to be closed by the caller
+
+    Raises:
+        ValueError: If the archive holds no single CSV or zstd support is missing
+    """
+    compression = detect_compression(file_path)
+    if compression is None:
+        return open(file_path, 'rb')
+
+    if compression == 'gzip':
+        return gzip.open(file_path, 'rb')
+
+    if compression == 'zip':
+        with zipfile.ZipFile(file_path) as archive:
+            members = [
+                info for info in archive.infolist()
+                if not info.is_dir() and not info.filename.startswith('__MACOSX/')
+            ]
+            csv_members = [info for info in members if info.filename.lower().endswith('.csv')]
+            if len(csv_members) == 1:
+                member = csv_members[0]
+            elif len(members) == 1:
+                member = members[0]
+            else:
+                raise ValueError("Zip archive must contain exactly one CSV file")
+            # The member stream keeps the archive file open after the with block
+            return archive.open(member)
+
+    if zstandard is None:
+        raise ValueError("Reading .zst files requires the zstandard package")
+    return zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True)
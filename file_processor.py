@@ -3,24 +3,54 @@ import numpy as np
 import io
 import csv
 import json
-import PyPDF2
+import openpyxl
 
-def process_uploaded_file(file_path, file_type):
+from compressed_files import COMPRESSED_TYPES
+from financial_data_processor import typed_ledger_frame
+from ingestion import ingest_csv, preview_records
+from ledger_table import TypedLedger
+from pdf_pages import iter_pdf_pages
+from pdf_statements import STATEMENT_COLUMNS, StatementParser
+from result_cache import result_cache
+
+# Rows held in memory at a time while streaming an Excel sheet
+XLSX_CHUNK_ROWS = 50000
+
+def process_uploaded_file(file_path, file_type, use_cache=True, sheets=None, columnar=False):
     """
     Process an uploaded financial data file
     
+    Results are cached by file content, so a byte-identical re-upload
+    returns the stored result without parsing the file again.
+    
     Args:
         file_path (str): Path to the uploaded file
-        file_type (str): File extension (csv, xlsx, pdf)
+        file_type (str): File extension (csv, xlsx, pdf, or gz, zip, zst for a compressed CSV)
+        use_cache (bool): Look the result up in the content-hash result cache
+        sheets (list, optional): Excel sheets to load. Defaults to all sheets.
+        columnar (bool): Return CSV and Excel rows as a TypedLedger instead of
+            a list of dicts
         
     Returns:
         dict: Extracted and structured financial data
     """
     try:
-        if file_type == 'csv':
-            return process_csv(file_path)
-        elif file_type == 'xlsx':
-            return process_xlsx(file_path)
+        if file_type == 'csv' or file_type in COMPRESSED_TYPES:
+            # CSV results are cached by the shared ingestion, which also
+            # decompresses gzip, zip and zstd uploads as it reads them
+            return process_csv(file_path, use_cache=use_cache, columnar=columnar)
+        
+        if use_cache:
+            kind = f'upload:{file_type}' + (f":{','.join(sorted(sheets))}" if sheets else '')
+            if columnar and file_type == 'xlsx':
+                kind += ':columnar'
+            return result_cache.get_or_compute(
+                file_path, kind,
+                lambda: process_uploaded_file(file_path, file_type, use_cache=False, sheets=sheets, columnar=columnar)
+            )
+        
+        if file_type == 'xlsx':
+            return process_xlsx(file_path, sheets=sheets, columnar=columnar)
         elif file_type == 'pdf':
             return process_pdf(file_path)
         else:
@@ -28,63 +58,95 @@ def process_uploaded_file(file_path, file_type):
     except Exception as e:
         raise Exception(f"Error processing file: {str(e)}")
 
-def process_csv(file_path):
-    """Process CSV financial data file"""
+def process_csv(file_path, use_cache=True, columnar=False):
+    """
+    Process CSV financial data file
+    
+    With columnar=True, 'data' is a TypedLedger of categorical, cents and
+    datetime columns whose row dicts are only built when it is indexed or
+    iterated.
+    """
     try:
-        # Read CSV file
-        df = pd.read_csv(file_path)
+        # Parse once through the shared ingestion, which also builds the aggregates
+        ingestion = ingest_csv(file_path, use_cache=use_cache)
         
         # Basic validation
-        if df.empty:
+        if ingestion is None:
             raise ValueError("CSV file is empty")
         
-        # Convert DataFrame to dict
-        data = df.to_dict(orient='records')
-        
-        # Extract column names
-        columns = df.columns.tolist()
+        if columnar:
+            data = TypedLedger(typed_ledger_frame(ingestion['table'].frame))
+        else:
+            data = preview_records(ingestion['table'])
         
         return {
             'data': data,
-            'columns': columns,
+            'columns': ingestion['columns'],
             'format': 'csv',
-            'rows': len(data)
+            'rows': ingestion['rows']
         }
     except Exception as e:
         raise Exception(f"Error processing CSV file: {str(e)}")
 
-def process_xlsx(file_path):
-    """Process Excel financial data file"""
-    try:
-        # Read Excel file (first sheet by default)
-        df = pd.read_excel(file_path)
-        
-        # Basic validation
-        if df.empty:
-            raise ValueError("Excel file is empty")
-        
-        # Convert DataFrame to dict
-        data = df.to_dict(orient='records')
+def process_xlsx(file_path, sheets=None, columnar=False):
+    """
+    Process Excel financial data file
+    
+    The workbook is opened once in read-only streaming mode and every
+    selected sheet is parsed a single time. Each sheet is converted to its
+    output rows as soon as it is read and its DataFrame dropped, so only
+    one sheet is held as a DataFrame at a time.
+    
+    Args:
+        file_path (str): Path to the Excel file
+        sheets (list, optional): Names of the sheets to load. Defaults to all sheets.
+        columnar (bool): Return each sheet's rows as a TypedLedger instead of
+            a list of dicts
         
-        # Extract column names
-        columns = df.columns.tolist()
+    Returns:
+        dict: Records of the first selected sheet, plus per-sheet records when
+            the workbook has several sheets
+    """
+    try:
+        if columnar:
+            to_rows = lambda frame: TypedLedger(typed_ledger_frame(frame))
+        else:
+            to_rows = lambda frame: frame.to_dict(orient='records')
         
-        # Check if there are multiple sheets
-        xl = pd.ExcelFile(file_path)
-        sheets = xl.sheet_names
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            sheet_names = workbook.sheetnames
+            selected = [name for name in sheet_names if sheets is None or name in sheets]
+            if not selected:
+                raise ValueError("None of the selected sheets exist in the Excel file")
+            
+            sheet_rows = {}
+            columns = None
+            for name in selected:
+                chunks = list(iter_sheet_frames(workbook[name]))
+                df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+                del chunks
+                
+                if columns is None:
+                    # The first selected sheet is the main data set
+                    if df.empty:
+                        raise ValueError("Excel file is empty")
+                    columns = df.columns.tolist()
+                
+                sheet_rows[name] = to_rows(df)
+                del df
+        finally:
+            workbook.close()
         
-        sheet_data = {}
-        if len(sheets) > 1:
-            for sheet in sheets:
-                sheet_df = pd.read_excel(file_path, sheet_name=sheet)
-                sheet_data[sheet] = sheet_df.to_dict(orient='records')
+        data = sheet_rows[selected[0]]
+        sheet_data = sheet_rows if len(sheet_names) > 1 else {}
         
         result = {
             'data': data,
             'columns': columns,
             'format': 'xlsx',
             'rows': len(data),
-            'sheets': sheets
+            'sheets': sheet_names
         }
         
         if sheet_data:
@@ -95,39 +157,126 @@ def process_xlsx(file_path):
     except Exception as e:
         raise Exception(f"Error processing Excel file: {str(e)}")
 
-def process_pdf(file_path):
+def iter_xlsx_frames(file_path, sheet_name=None, chunk_size=XLSX_CHUNK_ROWS):
+    """
+    Stream one sheet of an Excel file as DataFrames of at most chunk_size rows
+    
+    Args:
+        file_path (str): Path to the Excel file
+        sheet_name (str, optional): Sheet to read. Defaults to the first sheet.
+        chunk_size (int): Rows per DataFrame
+        
+    Yields:
+        DataFrame: Consecutive rows of the sheet, with its first row as header
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet_name] if sheet_name else workbook[workbook.sheetnames[0]]
+        yield from iter_sheet_frames(worksheet, chunk_size)
+    finally:
+        workbook.close()
+
+def iter_sheet_frames(worksheet, chunk_size=XLSX_CHUNK_ROWS):
+    """
+    Stream the rows of an open worksheet as DataFrames, keeping at most
+    chunk_size rows in memory
+    
+    Column names follow pd.read_excel: blank headers become 'Unnamed: N' and
+    repeated headers get a '.N' suffix. Trailing blank rows are dropped.
+    
+    Args:
+        worksheet: openpyxl worksheet, ideally from a read-only workbook
+        chunk_size (int): Rows per DataFrame
+        
+    Yields:
+        DataFrame: Consecutive rows of the sheet; a single empty DataFrame
+            if the sheet has no data rows
+    """
+    rows = worksheet.iter_rows(values_only=True)
+    header = next(rows, None)
+    columns = _sheet_columns(header or ())
+    
+    chunk = []
+    blank_rows = 0
+    emitted = False
+    for row in rows:
+        values = list(row[:len(columns)]) + [None] * (len(columns) - len(row))
+        if all(value is None for value in values):
+            # Hold blank rows back until a later row shows they are not trailing
+            blank_rows += 1
+            continue
+        chunk.extend([[None] * len(columns)] * blank_rows)
+        blank_rows = 0
+        chunk.append(values)
+        if len(chunk) >= chunk_size:
+            yield _sheet_frame(chunk, columns)
+            emitted = True
+            chunk = []
+    
+    if chunk or not emitted:
+        yield _sheet_frame(chunk, columns)
+
+def _sheet_columns(header):
+    """Name sheet columns the way pd.read_excel does"""
+    columns = []
+    seen = {}
+    for index, value in enumerate(header):
+        name = f"Unnamed: {index}" if value is None else value
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    
+    # Drop trailing unnamed columns with no header
+    while columns and header[len(columns) - 1] is None:
+        columns.pop()
+    return columns
+
+def _sheet_frame(rows, columns):
+    """Build a DataFrame from sheet rows, with NaN for empty cells"""
+    df = pd.DataFrame(rows, columns=columns)
+    return df.infer_objects().fillna(np.nan)
+
+def process_pdf(file_path, workers=None):
     """
     Process PDF financial data file
     This function attempts to extract tabular data from PDF
+    
+    Pages are extracted in parallel and cached by file content; use
+    pdf_pages.iter_pdf_pages directly to consume them one page at a time.
+    Statement transactions found on the pages are returned as ledger rows.
     """
     try:
-        # Open the PDF file
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            num_pages = len(pdf_reader.pages)
-            
-            if num_pages == 0:
-                raise ValueError("PDF file is empty")
-            
-            # Extract text from each page
-            extracted_text = []
-            for page_num in range(num_pages):
-                page = pdf_reader.pages[page_num]
-                text = page.extract_text()
-                extracted_text.append(text)
-            
-            # Join all text
-            full_text = "\n".join(extracted_text)
-            
-            # Basic structure for the extracted data
-            result = {
-                'format': 'pdf',
-                'pages': num_pages,
-                'text': full_text,
-                'raw_content': True
-            }
-            
-            return result
+        parser = StatementParser()
+        extracted_text = []
+        records = []
+        for _, text in iter_pdf_pages(file_path, workers=workers):
+            extracted_text.append(text)
+            records.extend(parser.parse_page(text))
+        num_pages = len(extracted_text)
+        
+        if num_pages == 0:
+            raise ValueError("PDF file is empty")
+        
+        # Join all text
+        full_text = "\n".join(extracted_text)
+        
+        # Basic structure for the extracted data
+        result = {
+            'format': 'pdf',
+            'pages': num_pages,
+            'text': full_text,
+            'raw_content': True
+        }
+        
+        if records:
+            result['data'] = records
+            result['columns'] = list(STATEMENT_COLUMNS)
+            result['rows'] = len(records)
+        
+        return result
             
     except Exception as e:
         raise Exception(f"Error processing PDF file: {str(e)}")
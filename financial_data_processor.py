@@ -3,183 +3,599 @@ Financial Data Processor
 This module analyzes CSV financial data to generate accurate financial reports
 """
 
-import csv
+import io
 import json
 import logging
 from datetime import datetime
 
+import numpy as np
+import pandas as pd
+
+from account_classifier import classify_accounts, classify_categories
+from compressed_files import open_csv_source
+from ledger_table import CATEGORICAL_COLUMNS, TransactionTable, frame_records
+from result_cache import result_cache
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('fintelligence')
 
-def analyze_csv_data(file_path):
+# Date formats accepted in the Date column, in order of preference
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y')
+
+# Non-empty Date values sampled to detect a file's date format
+DATE_SAMPLE_SIZE = 1000
+
+# Rows read per chunk when a CSV is analyzed in streaming mode
+STREAMING_CHUNK_ROWS = 100000
+
+# Aggregation buckets keyed by category, account, month and quarter
+BUCKET_KEYS = ('by_category', 'by_account', 'by_month', 'quarters')
+
+def analyze_csv_data(file_path, streaming=False, chunk_size=STREAMING_CHUNK_ROWS, parallel=False, workers=None,
+                     use_cache=True):
     """
     Analyze CSV financial data to extract structured information.
     
+    The file is parsed once into a DataFrame and every aggregate is computed
+    with grouped column reductions instead of a per-row Python loop.
+    
+    In streaming mode the file is read in chunks of chunk_size rows and each
+    chunk is folded into running totals, so peak memory does not grow with
+    the file. No transaction table is kept: 'transactions' is empty and
+    'transactions_path' points at the CSV, which iter_transactions reads back.
+    
+    In parallel mode the file is split on line boundaries and the pieces are
+    aggregated in a process pool (see parallel_ingest), again without keeping
+    transactions.
+    
+    The default mode shares one parse with the upload preview through
+    ingestion.ingest_csv. Gzip, zip and zstd compressed CSVs are decompressed
+    as they are read in every mode. Results are cached by file content (see
+    result_cache), so uploading byte-identical files again skips parsing and
+    aggregation.
+    
     Args:
         file_path: Path to the CSV file
+        streaming: Aggregate chunk by chunk without keeping transactions
+        chunk_size: Rows per chunk in streaming mode
+        parallel: Aggregate line-aligned byte ranges in worker processes
+        workers: Worker processes in parallel mode, one per CPU core if None
+        use_cache: Look the result up in the content-hash result cache
         
     Returns:
         dict: Structured financial data for reports
     """
     try:
-        # Read the CSV file
-        with open(file_path, 'r', encoding='utf-8') as csv_file:
-            reader = csv.DictReader(csv_file)
-            rows = list(reader)
-            
-        if not rows:
-            logger.error(f"No data found in CSV file: {file_path}")
-            return None
-            
-        # Initialize financial data structure
-        financial_data = {
-            'transactions': rows,
-            'income': 0,
-            'expenses': 0,
-            'net_income': 0,
-            'by_category': {},
-            'by_account': {},
-            'by_month': {},
-            'quarters': {}
-        }
+        if use_cache and (streaming or parallel):
+            financial_data = result_cache.get_or_compute(
+                file_path, 'analysis:totals',
+                lambda: analyze_csv_data(file_path, streaming, chunk_size, parallel, workers, use_cache=False)
+            )
+            if financial_data:
+                financial_data['transactions_path'] = file_path
+            return financial_data
         
-        # Process each transaction
-        for row in rows:
-            try:
-                # Extract key fields
-                amount = float(row.get('Amount', 0))
-                transaction_type = row.get('Type', '')
-                category = row.get('Category', 'Uncategorized')
-                account = row.get('Account', 'Unknown')
-                date_str = row.get('Date', '')
-                
-                # Track income vs expenses
-                if transaction_type.lower() == 'income':
-                    financial_data['income'] += amount
-                elif transaction_type.lower() == 'expense':
-                    financial_data['expenses'] += amount
-                
-                # Track by category
-                if category not in financial_data['by_category']:
-                    financial_data['by_category'][category] = {
-                        'income': 0,
-                        'expenses': 0,
-                        'net': 0,
-                        'transactions': []
-                    }
-                
-                if transaction_type.lower() == 'income':
-                    financial_data['by_category'][category]['income'] += amount
-                else:
-                    financial_data['by_category'][category]['expenses'] += amount
-                
-                financial_data['by_category'][category]['net'] = (
-                    financial_data['by_category'][category]['income'] - 
-                    financial_data['by_category'][category]['expenses']
-                )
-                
-                financial_data['by_category'][category]['transactions'].append(row)
-                
-                # Track by account
-                if account not in financial_data['by_account']:
-                    financial_data['by_account'][account] = {
-                        'income': 0,
-                        'expenses': 0,
-                        'net': 0,
-                        'transactions': []
-                    }
-                
-                if transaction_type.lower() == 'income':
-                    financial_data['by_account'][account]['income'] += amount
-                else:
-                    financial_data['by_account'][account]['expenses'] += amount
-                
-                financial_data['by_account'][account]['net'] = (
-                    financial_data['by_account'][account]['income'] - 
-                    financial_data['by_account'][account]['expenses']
-                )
-                
-                financial_data['by_account'][account]['transactions'].append(row)
-                
-                # Process by date/month for time series analysis
-                if date_str:
-                    try:
-                        # Try different date formats
-                        try:
-                            date = datetime.strptime(date_str, '%Y-%m-%d')
-                        except ValueError:
-                            try:
-                                date = datetime.strptime(date_str, '%m/%d/%Y')
-                            except ValueError:
-                                date = datetime.strptime(date_str, '%d/%m/%Y')
-                                
-                        month_key = date.strftime('%Y-%m')
-                        quarter_key = f"Q{(date.month-1)//3+1} {date.year}"
-                        
-                        # Track by month
-                        if month_key not in financial_data['by_month']:
-                            financial_data['by_month'][month_key] = {
-                                'income': 0,
-                                'expenses': 0,
-                                'net': 0,
-                                'transactions': []
-                            }
-                        
-                        if transaction_type.lower() == 'income':
-                            financial_data['by_month'][month_key]['income'] += amount
-                        else:
-                            financial_data['by_month'][month_key]['expenses'] += amount
-                        
-                        financial_data['by_month'][month_key]['net'] = (
-                            financial_data['by_month'][month_key]['income'] - 
-                            financial_data['by_month'][month_key]['expenses']
-                        )
-                        
-                        financial_data['by_month'][month_key]['transactions'].append(row)
-                        
-                        # Track by quarter
-                        if quarter_key not in financial_data['quarters']:
-                            financial_data['quarters'][quarter_key] = {
-                                'income': 0,
-                                'expenses': 0,
-                                'net': 0,
-                                'transactions': []
-                            }
-                        
-                        if transaction_type.lower() == 'income':
-                            financial_data['quarters'][quarter_key]['income'] += amount
-                        else:
-                            financial_data['quarters'][quarter_key]['expenses'] += amount
-                        
-                        financial_data['quarters'][quarter_key]['net'] = (
-                            financial_data['quarters'][quarter_key]['income'] - 
-                            financial_data['quarters'][quarter_key]['expenses']
-                        )
-                        
-                        financial_data['quarters'][quarter_key]['transactions'].append(row)
-                    except ValueError:
-                        logger.warning(f"Could not parse date: {date_str}")
-            except Exception as row_error:
-                logger.warning(f"Error processing row: {row} - {str(row_error)}")
-                continue
+        if parallel:
+            from parallel_ingest import analyze_csv_parallel
+            return analyze_csv_parallel(file_path, workers=workers)
         
-        # Calculate net income
-        financial_data['net_income'] = financial_data['income'] - financial_data['expenses']
+        if streaming:
+            return _analyze_csv_stream(file_path, chunk_size)
         
-        return financial_data
+        # Share the single parse made for the upload preview
+        from ingestion import ingest_csv
+        ingestion = ingest_csv(file_path, use_cache=use_cache)
+        return ingestion['financial_data'] if ingestion else None
     
     except Exception as e:
         logger.error(f"Error analyzing CSV data: {str(e)}")
         return None
 
-def generate_balance_sheet(financial_data):
+def _analyze_csv_stream(file_path, chunk_size):
+    """Aggregate a CSV file chunk by chunk, keeping only running totals"""
+    financial_data = None
+    try:
+        with open_csv_source(file_path) as source:
+            chunks = pd.read_csv(source, dtype=str, keep_default_na=False, encoding='utf-8',
+                                 chunksize=chunk_size)
+            financial_data = aggregate_frames(chunks)
+    except pd.errors.EmptyDataError:
+        pass
+    
+    if financial_data is None:
+        logger.error(f"No data found in CSV file: {file_path}")
+        return None
+    
+    financial_data['transactions_path'] = file_path
+    return financial_data
+
+def analyze_xlsx_data(file_path, sheet_name=None):
+    """
+    Analyze one sheet of an Excel ledger with bounded memory.
+    
+    The sheet is streamed from a read-only workbook in fixed-size frames that
+    are folded into running totals, so no transaction table is kept.
+    
+    Args:
+        file_path: Path to the Excel file
+        sheet_name: Sheet holding the ledger, the first sheet if None
+        
+    Returns:
+        dict: Structured financial data for reports
+    """
+    try:
+        from file_processor import iter_xlsx_frames
+        financial_data = aggregate_frames(iter_xlsx_frames(file_path, sheet_name))
+        if financial_data is None:
+            logger.error(f"No data found in Excel file: {file_path}")
+        return financial_data
+    
+    except Exception as e:
+        logger.error(f"Error analyzing Excel data: {str(e)}")
+        return None
+
+def analyze_pdf_data(file_path, use_cache=True):
+    """
+    Analyze the transactions printed in a PDF statement.
+    
+    Statement rows are extracted page by page and aggregated like a CSV
+    ledger, so PDFs get the same deterministic reports.
+    
+    Args:
+        file_path: Path to the PDF file
+        use_cache: Look the result up in the content-hash result cache
+        
+    Returns:
+        dict: Structured financial data for reports, or None if no
+            transactions were found
+    """
+    if use_cache:
+        return result_cache.get_or_compute(file_path, 'analysis:pdf',
+                                           lambda: analyze_pdf_data(file_path, use_cache=False))
+    
+    try:
+        from pdf_statements import iter_pdf_frames
+        financial_data = aggregate_frames(iter_pdf_frames(file_path), keep_transactions=True)
+        if financial_data is None:
+            logger.error(f"No transactions found in PDF file: {file_path}")
+        return financial_data
+    
+    except Exception as e:
+        logger.error(f"Error analyzing PDF data: {str(e)}")
+        return None
+
+def aggregate_frames(frames, keep_transactions=False, date_format=None):
+    """
+    Fold a sequence of ledger DataFrames into one aggregate, one frame at a time.
+    
+    Args:
+        frames: Iterable of DataFrames with the same columns
+        keep_transactions: Keep the rows in a TransactionTable
+        date_format: Format of the Date column, detected from the first frame if None
+        
+    Returns:
+        dict: Structured financial data, or None if every frame is empty
+    """
+    financial_data = None
+    for frame in frames:
+        if frame.empty:
+            continue
+        # Detect the date format once, from the first frame
+        if date_format is None and 'Date' in frame.columns:
+            date_format = detect_date_format(_text_column(frame, 'Date', ''))
+        partial = aggregate_ledger_frame(frame, keep_transactions=keep_transactions, date_format=date_format)
+        if financial_data is None:
+            financial_data = partial
+        else:
+            merge_financial_data(financial_data, partial)
+    return financial_data
+
+def analyze_csv_append(file_path, financial_data, start_offset, date_format=None,
+                       chunk_size=STREAMING_CHUNK_ROWS):
+    """
+    Fold the rows appended to a CSV file since an earlier analysis into its aggregates.
+    
+    Only the bytes from start_offset onwards are parsed, using the header line
+    of the file, so the cost depends on the size of the appended rows rather
+    than on the whole ledger.
+    
+    Args:
+        file_path: Path to the extended CSV file
+        financial_data: Aggregates of the first start_offset bytes, updated in place
+        start_offset: Byte offset where the appended rows begin
+        date_format: Date format of the earlier analysis, detected if None
+        chunk_size: Rows per chunk
+        
+    Returns:
+        dict: The updated financial_data
+    """
+    with open(file_path, 'rb') as csv_file:
+        header = csv_file.readline()
+        columns = list(pd.read_csv(io.BytesIO(header), dtype=str, encoding='utf-8').columns)
+        csv_file.seek(max(start_offset, len(header)))
+        try:
+            chunks = pd.read_csv(csv_file, header=None, names=columns, dtype=str, keep_default_na=False,
+                                 encoding='utf-8', chunksize=chunk_size)
+            for chunk in chunks:
+                if date_format is None and 'Date' in chunk.columns:
+                    date_format = detect_date_format(chunk['Date'])
+                merge_financial_data(
+                    financial_data,
+                    aggregate_ledger_frame(chunk, keep_transactions=False, date_format=date_format)
+                )
+        except pd.errors.EmptyDataError:
+            logger.info(f"No appended rows found in CSV file: {file_path}")
+    
+    financial_data['transactions_path'] = file_path
+    return financial_data
+
+def detect_file_date_format(file_path):
+    """
+    Detect the date format of a CSV file from its first rows.
+    
+    Args:
+        file_path: Path to the CSV file
+        
+    Returns:
+        str: Detected date format, or None if the file has no Date column
+    """
+    try:
+        with open_csv_source(file_path) as source:
+            head = pd.read_csv(source, dtype=str, keep_default_na=False, encoding='utf-8',
+                               nrows=DATE_SAMPLE_SIZE)
+    except pd.errors.EmptyDataError:
+        return None
+    return detect_date_format(head['Date']) if 'Date' in head.columns else None
+
+def iter_transactions(financial_data, chunk_size=STREAMING_CHUNK_ROWS):
+    """
+    Yield transaction dicts from analyzed data, reading them back from disk
+    when the data was produced in streaming mode.
+    
+    Args:
+        financial_data: Structured financial data
+        chunk_size: Rows read at a time from the source CSV
+        
+    Yields:
+        dict: One transaction row
+    """
+    if financial_data.get('transactions'):
+        yield from financial_data['transactions']
+        return
+    
+    file_path = financial_data.get('transactions_path')
+    if not file_path:
+        return
+    with open_csv_source(file_path) as source:
+        for chunk in pd.read_csv(source, dtype=str, keep_default_na=False, encoding='utf-8',
+                                 chunksize=chunk_size):
+            yield from frame_records(chunk)
+
+def bucket_transactions(financial_data, bucket):
+    """
+    Return the transaction dicts behind one aggregation bucket.
+    
+    Args:
+        financial_data: Structured financial data
+        bucket: A bucket from by_category, by_account, by_month or quarters
+        
+    Returns:
+        list: Transaction rows in the bucket, empty if rows were not kept
+    """
+    if 'rows' not in bucket or not len(financial_data.get('transactions', [])):
+        return []
+    return financial_data['transactions'].take(bucket['rows'])
+
+class FinancialDataEncoder(json.JSONEncoder):
+    """JSON encoder for financial data holding a TransactionTable and NumPy row arrays"""
+    
+    def default(self, obj):
+        if isinstance(obj, TransactionTable):
+            return obj.to_dict()
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        return super().default(obj)
+
+def load_financial_data(payload):
+    """
+    Restore financial data serialized with FinancialDataEncoder.
+    
+    Args:
+        payload: JSON string
+        
+    Returns:
+        dict: Structured financial data with its TransactionTable and row arrays
+    """
+    financial_data = json.loads(payload)
+    if isinstance(financial_data.get('transactions'), dict):
+        financial_data['transactions'] = TransactionTable.from_dict(financial_data['transactions'])
+    for bucket_key in BUCKET_KEYS:
+        for bucket in financial_data.get(bucket_key, {}).values():
+            if 'rows' in bucket:
+                bucket['rows'] = np.asarray(bucket['rows'], dtype=np.int64)
+    return financial_data
+
+def merge_financial_data(financial_data, partial):
+    """
+    Add the totals of a partial aggregate into financial_data in place.
+    
+    Bucket keys keep their first-seen order, so merging the aggregates of
+    consecutive chunks gives the same structure as aggregating them together.
+    
+    Args:
+        financial_data: Structured financial data to update
+        partial: Structured financial data for additional rows
+        
+    Returns:
+        dict: The updated financial_data
+    """
+    financial_data['income'] += partial['income']
+    financial_data['expenses'] += partial['expenses']
+    financial_data['net_income'] = financial_data['income'] - financial_data['expenses']
+    
+    # Row positions in the partial table shift by the rows already held
+    row_offset = len(financial_data['transactions'])
+    if len(partial['transactions']):
+        financial_data['transactions'] = TransactionTable.concat(
+            [financial_data['transactions'], partial['transactions']]
+        ) if row_offset else partial['transactions']
+    
+    for bucket_key in BUCKET_KEYS:
+        buckets = financial_data[bucket_key]
+        for name, bucket in partial[bucket_key].items():
+            if name not in buckets:
+                buckets[name] = {'income': 0.0, 'expenses': 0.0, 'net': 0.0}
+                if 'rows' in bucket:
+                    buckets[name]['rows'] = np.empty(0, dtype=np.int64)
+            target = buckets[name]
+            target['income'] += bucket['income']
+            target['expenses'] += bucket['expenses']
+            target['net'] = target['income'] - target['expenses']
+            if 'rows' in bucket:
+                target['rows'] = np.concatenate([target['rows'], bucket['rows'] + row_offset])
+    
+    return financial_data
+
+def aggregate_ledger_frame(df, keep_transactions=True, date_format=None):
+    """
+    Aggregate a ledger DataFrame into the structure consumed by the report generators.
+    
+    Args:
+        df: DataFrame with Date, Account, Category, Amount and Type columns
+        keep_transactions: Keep the rows in a TransactionTable and give every
+            bucket a 'rows' array of positions into it
+        date_format: Format of the Date column, detected from the frame if None
+        
+    Returns:
+        dict: Structured financial data for reports
+    """
+    
+    # Rows whose Amount cannot be parsed are left out of every aggregate
+    amounts = _amount_column(df)
+    valid = amounts.notna().to_numpy()
+    skipped = int((~valid).sum())
+    if skipped:
+        logger.warning(f"Skipped {skipped} rows with a missing or invalid Amount")
+    
+    type_lower = _text_column(df, 'Type', '').str.lower().to_numpy()
+    is_income = type_lower == 'income'
+    is_expense = type_lower == 'expense'
+    values = amounts.fillna(0.0).to_numpy(dtype=float)
+    
+    # Buckets count every non-income row as an expense, while the overall
+    # expense total only includes rows explicitly typed as Expense
+    rows = np.flatnonzero(valid)
+    income = np.where(is_income, values, 0.0)[rows]
+    expenses = np.where(is_income, 0.0, values)[rows]
+    
+    financial_data = {
+        'transactions': TransactionTable(df) if keep_transactions else [],
+        'income': float(income.sum()),
+        'expenses': float(values[valid & is_expense].sum()),
+        'net_income': 0,
+        'by_category': _group_buckets(
+            _text_column(df, 'Category', 'Uncategorized').to_numpy()[rows], rows, income, expenses, keep_transactions
+        ),
+        'by_account': _group_buckets(
+            _text_column(df, 'Account', 'Unknown').to_numpy()[rows], rows, income, expenses, keep_transactions
+        ),
+        'by_month': {},
+        'quarters': {}
+    }
+    
+    # Process by date/month for time series analysis
+    dates = _date_values(df, rows, date_format)
+    dated = ~np.isnat(dates)
+    if dated.any():
+        dated_dates = pd.DatetimeIndex(dates[dated])
+        years = dated_dates.year.to_numpy()
+        months = dated_dates.month.to_numpy()
+        dated_rows = rows[dated]
+        financial_data['by_month'] = _group_buckets(
+            years * 100 + months, dated_rows, income[dated], expenses[dated], keep_transactions,
+            label=lambda code: f"{code // 100:04d}-{code % 100:02d}"
+        )
+        financial_data['quarters'] = _group_buckets(
+            years * 10 + (months - 1) // 3 + 1, dated_rows, income[dated], expenses[dated], keep_transactions,
+            label=lambda code: f"Q{code % 10} {code // 10}"
+        )
+    
+    # Calculate net income
+    financial_data['net_income'] = financial_data['income'] - financial_data['expenses']
+    
+    return financial_data
+
+def typed_ledger_frame(df, date_format=None):
+    """
+    Convert a ledger DataFrame to compact typed columns.
+    
+    Account, Category and Type become categoricals, Amount becomes integer
+    cents (nullable where it cannot be parsed) and Date becomes datetime64.
+    Other columns are kept as they are.
+    
+    Args:
+        df: DataFrame read from an upload
+        date_format: Format of the Date column, detected if None
+        
+    Returns:
+        DataFrame: The typed columns, in the original order
+    """
+    typed = {}
+    for column in df.columns:
+        if column in CATEGORICAL_COLUMNS:
+            # Empty cells become missing values, as in the record preview
+            typed[column] = df[column].replace('', np.nan).astype('category')
+        elif column == 'Amount':
+            cents = (_amount_column(df) * 100).round()
+            typed[column] = cents.astype('Int64' if cents.isna().any() else 'int64')
+        elif column == 'Date':
+            dates = _date_values(df, np.arange(len(df)), date_format)
+            typed[column] = pd.Series(dates, index=df.index)
+        else:
+            typed[column] = df[column]
+    return pd.DataFrame(typed, columns=df.columns)
+
+def _text_column(df, column, default):
+    """Return a column as strings, or a constant column if it is missing"""
+    if column not in df.columns:
+        return pd.Series(default, index=df.index, dtype=object)
+    return df[column].fillna('').astype(str)
+
+def _amount_column(df):
+    """Return the Amount column as floats, with NaN for unparseable values"""
+    if 'Amount' not in df.columns:
+        return pd.Series(0.0, index=df.index)
+    amounts = df['Amount']
+    if not pd.api.types.is_numeric_dtype(amounts):
+        amounts = amounts.fillna('').astype(str).str.strip()
+    return pd.to_numeric(amounts, errors='coerce').astype(float)
+
+def _date_values(df, rows, date_format):
+    """Return datetime64 values of the Date column for the given rows"""
+    if 'Date' in df.columns and pd.api.types.is_datetime64_any_dtype(df['Date']):
+        # Spreadsheet cells already hold dates
+        return df['Date'].iloc[rows].to_numpy(dtype='datetime64[ns]')
+    return _parse_date_column(_text_column(df, 'Date', '').iloc[rows], date_format).to_numpy()
+
+def detect_date_format(date_strings):
+    """
+    Pick the date format of a Date column from a sample of its values.
+    
+    Args:
+        date_strings: Series of date strings
+        
+    Returns:
+        str: The first entry of DATE_FORMATS that parses the whole sample,
+            otherwise the one that parses most of it
+    """
+    sample = date_strings[date_strings != ''].head(DATE_SAMPLE_SIZE)
+    best_format, best_count = DATE_FORMATS[0], -1
+    for date_format in DATE_FORMATS:
+        count = int(pd.to_datetime(sample, format=date_format, errors='coerce').notna().sum())
+        if count > best_count:
+            best_format, best_count = date_format, count
+        if count == len(sample):
+            break
+    return best_format
+
+def _parse_date_column(date_strings, date_format=None):
+    """
+    Parse a Date column in one vectorized pass with the file's date format.
+    
+    Values the detected format rejects are retried with the other formats, so
+    files mixing formats still parse, and the ones left are logged as a
+    single counted warning.
+    
+    Args:
+        date_strings: Series of date strings, '' where there is no date
+        date_format: Format detected for the file, or None to detect it here
+        
+    Returns:
+        Series: datetime64 values, NaT where there is no parseable date
+    """
+    present = (date_strings != '').to_numpy()
+    if not present.any():
+        return pd.Series(pd.NaT, index=date_strings.index, dtype='datetime64[ns]')
+    
+    date_format = date_format or detect_date_format(date_strings)
+    parsed = pd.to_datetime(date_strings, format=date_format, errors='coerce').astype('datetime64[ns]')
+    pending = present & parsed.isna().to_numpy()
+    for fallback_format in DATE_FORMATS:
+        if not pending.any():
+            break
+        if fallback_format == date_format:
+            continue
+        parsed[pending] = pd.to_datetime(date_strings[pending], format=fallback_format, errors='coerce')
+        pending = pending & parsed.isna().to_numpy()
+    
+    unparsed = int(pending.sum())
+    if unparsed:
+        examples = ', '.join(repr(value) for value in date_strings[pending].unique()[:5])
+        logger.warning(f"Could not parse {unparsed} dates (for example {examples})")
+    
+    return parsed
+
+def _group_buckets(keys, rows, income, expenses, keep_rows, label=None):
+    """
+    Sum income and expenses per key, keeping keys in first-seen order.
+    
+    Args:
+        keys: Group key for each aggregated row
+        rows: Position of each aggregated row in the transaction table
+        income: Income amount for each aggregated row
+        expenses: Expense amount for each aggregated row
+        keep_rows: Store each bucket's row positions under 'rows'
+        label: Optional function turning a group key into its bucket name
+        
+    Returns:
+        dict: Buckets with income, expenses, net and optionally rows
+    """
+    grouped = pd.DataFrame({'key': keys, 'income': income, 'expenses': expenses}).groupby('key', sort=False)
+    totals = grouped[['income', 'expenses']].sum()
+    positions = grouped.indices
+    
+    buckets = {}
+    for key, key_income, key_expenses in zip(totals.index, totals['income'].to_numpy(), totals['expenses'].to_numpy()):
+        bucket = {
+            'income': float(key_income),
+            'expenses': float(key_expenses),
+            'net': float(key_income - key_expenses)
+        }
+        if keep_rows:
+            bucket['rows'] = rows[positions[key]]
+        buckets[label(key) if label else key] = bucket
+    return buckets
+
+def classify_ledger(financial_data):
+    """
+    Classify every account and category once for all report generators.
+    
+    The keyword rules live in account_classifier, which memoizes the roles
+    of each name across calls.
+    
+    Args:
+        financial_data: Structured financial data
+        
+    Returns:
+        dict: 'accounts' and 'categories', mapping each name to its roles in
+            the balance sheet, income statement, cash flow and liquidity metrics
+    """
+    return {
+        'accounts': classify_accounts(financial_data.get('by_account', {})),
+        'categories': classify_categories(financial_data.get('by_category', {}))
+    }
+
+def generate_balance_sheet(financial_data, classification=None):
     """
     Generate a balance sheet from the analyzed financial data
     
     Args:
         financial_data: Structured financial data
+        classification: Result of classify_ledger, computed here if None
         
     Returns:
         dict: Balance sheet report
@@ -193,6 +609,8 @@ def generate_balance_sheet(financial_data):
         
         # Extract data for balance sheet calculation
         accounts = financial_data.get('by_account', {})
+        classification = classification or classify_ledger(financial_data)
+        account_roles = classification['accounts']
         
         # Calculate assets and liabilities
         current_assets = {}
@@ -217,13 +635,12 @@ def generate_balance_sheet(financial_data):
                     net_value = 0
             
             # Now categorize the account based on its name
-            if 'cash' in account_name.lower() or 'bank' in account_name.lower() or 'savings' in account_name.lower():
+            balance_sheet_role = account_roles[account_name]['balance_sheet']
+            if balance_sheet_role == 'current_asset':
                 current_assets[account_name] = max(0, net_value)  # Only consider positive values as assets
-            elif 'receivable' in account_name.lower():
-                current_assets[account_name] = max(0, net_value)
-            elif 'equipment' in account_name.lower() or 'investment' in account_name.lower():
+            elif balance_sheet_role == 'non_current_asset':
                 non_current_assets[account_name] = max(0, net_value)
-            elif 'credit card' in account_name.lower():
+            elif balance_sheet_role == 'credit_card':
                 # Credit cards typically have negative balances when there's debt
                 if net_value < 0:
                     current_liabilities[account_name] = -net_value  # Convert to positive for liabilities
@@ -257,7 +674,7 @@ def generate_balance_sheet(financial_data):
                     net_value = 0
                 
             # Only add to liabilities if the name suggests a liability and the value is negative
-            if 'payable' in account_name.lower() or 'loan' in account_name.lower() or 'debt' in account_name.lower():
+            if account_roles[account_name]['liability']:
                 if net_value < 0:
                     current_liabilities[account_name] = -net_value  # Convert to positive for liabilities
                     
@@ -281,7 +698,7 @@ def generate_balance_sheet(financial_data):
                     logger.warning(f"Category {category_name} net value is not a number: {type(category_net)}")
                     category_net = 0
                 
-            if any(term in category_name.lower() for term in ['loan', 'debt', 'mortgage']):
+            if classification['categories'][category_name]['long_term_liability']:
                 # Assume it's a long-term liability
                 if category_net < 0:
                     long_term_liabilities[category_name] = -category_net  # Convert to positive for liabilities
@@ -469,12 +886,13 @@ def generate_balance_sheet_insights(assets, liabilities, equity, current_assets,
     
     return insights
 
-def generate_income_statement(financial_data):
+def generate_income_statement(financial_data, classification=None):
     """
     Generate an income statement from the analyzed financial data
     
     Args:
         financial_data: Structured financial data
+        classification: Result of classify_ledger, computed here if None
         
     Returns:
         dict: Income statement report
@@ -487,6 +905,7 @@ def generate_income_statement(financial_data):
         # Extract data for income statement
         categories = financial_data.get('by_category', {})
         total_revenue = financial_data.get('income', 0)
+        classification = classification or classify_ledger(financial_data)
         
         # Initialize income statement components
         cost_of_goods_sold = 0
@@ -495,21 +914,18 @@ def generate_income_statement(financial_data):
         
         # Calculate COGS
         for category_name, category_data in categories.items():
-            category_lower = category_name.lower()
+            income_statement_role = classification['categories'][category_name]['income_statement']
             
             # Identify COGS related categories
-            if any(term in category_lower for term in ['cogs', 'cost of goods', 'cost of sales', 'inventory']):
+            if income_statement_role == 'cost_of_goods_sold':
                 cost_of_goods_sold += category_data['expenses']
             
             # Identify operating expenses
-            elif any(term in category_lower for term in [
-                'rent', 'salary', 'salaries', 'utilities', 'office', 'marketing', 
-                'advertising', 'travel', 'insurance'
-            ]):
+            elif income_statement_role == 'operating_expense':
                 operating_expenses[category_name] = category_data['expenses']
             
             # Identify other income/expenses
-            elif any(term in category_lower for term in ['interest', 'tax', 'depreciation', 'amortization']):
+            elif income_statement_role == 'other_income_expense':
                 other_income_expenses[category_name] = category_data['expenses']
         
         # Calculate totals
@@ -685,12 +1101,13 @@ def generate_income_statement_insights(revenue, gross_profit, operating_income,
     
     return insights
 
-def generate_cash_flow(financial_data):
+def generate_cash_flow(financial_data, classification=None):
     """
     Generate a cash flow statement from the analyzed financial data
     
     Args:
         financial_data: Structured financial data
+        classification: Result of classify_ledger, computed here if None
         
     Returns:
         dict: Cash flow statement report
@@ -701,10 +1118,10 @@ def generate_cash_flow(financial_data):
             return None
         
         # Extract data for cash flow calculation
-        transactions = financial_data.get('transactions', [])
         categories = financial_data.get('by_category', {})
         accounts = financial_data.get('by_account', {})
         months = financial_data.get('by_month', {})
+        classification = classification or classify_ledger(financial_data)
         
         # Determine beginning and ending cash
         # Use the first and last months in sorted order
@@ -715,17 +1132,11 @@ def generate_cash_flow(financial_data):
         if sorted_months:
             # For simplicity, use the first month's income as beginning cash
             first_month = sorted_months[0]
-            beginning_cash = sum(
-                float(t.get('Amount', 0)) for t in months[first_month]['transactions']
-                if t.get('Type', '').lower() == 'income'
-            )
+            beginning_cash = months[first_month]['income']
             
             # Use the last month's net as ending cash
             last_month = sorted_months[-1]
-            ending_cash = beginning_cash + sum(
-                float(t.get('Amount', 0)) if t.get('Type', '').lower() == 'income' else -float(t.get('Amount', 0))
-                for t in months[last_month]['transactions']
-            )
+            ending_cash = beginning_cash + months[last_month]['net']
         
         # Initialize cash flow components
         operating_activities = {}
@@ -734,28 +1145,17 @@ def generate_cash_flow(financial_data):
         
         # Categorize transactions into cash flow components
         for category_name, category_data in categories.items():
-            category_lower = category_name.lower()
-            
-            # Operating activities
-            if any(term in category_lower for term in [
-                'revenue', 'income', 'sale', 'commission', 'fee', 'service',
-                'rent', 'salary', 'utilities', 'office', 'marketing', 'insurance'
-            ]):
-                operating_activities[category_name] = category_data['net']
+            cash_flow_role = classification['categories'][category_name]['cash_flow']
             
             # Investing activities
-            elif any(term in category_lower for term in [
-                'equipment', 'investment', 'asset', 'property', 'capital', 'research'
-            ]):
+            if cash_flow_role == 'investing':
                 investing_activities[category_name] = category_data['net']
             
             # Financing activities
-            elif any(term in category_lower for term in [
-                'loan', 'debt', 'dividend', 'equity', 'stock', 'financing'
-            ]):
+            elif cash_flow_role == 'financing':
                 financing_activities[category_name] = category_data['net']
             
-            # Default to operating if we can't determine
+            # Operating activities, including anything we can't otherwise determine
             else:
                 operating_activities[category_name] = category_data['net']
         
@@ -919,12 +1319,13 @@ def generate_cash_flow_insights(operating, investing, financing, net_change):
     
     return insights
 
-def generate_financial_analysis(financial_data):
+def generate_financial_analysis(financial_data, classification=None):
     """
     Generate a comprehensive financial analysis from the analyzed financial data
     
     Args:
         financial_data: Structured financial data
+        classification: Result of classify_ledger, computed here if None
         
     Returns:
         dict: Financial analysis report
@@ -942,11 +1343,12 @@ def generate_financial_analysis(financial_data):
         accounts = financial_data.get('by_account', {})
         months = financial_data.get('by_month', {})
         quarters = financial_data.get('quarters', {})
+        classification = classification or classify_ledger(financial_data)
         
         # Generate financial metrics
         metrics = {
             'profitability': calculate_profitability_metrics(total_revenue, total_expenses, net_income),
-            'liquidity': calculate_liquidity_metrics(accounts),
+            'liquidity': calculate_liquidity_metrics(accounts, classification['accounts']),
             'efficiency': calculate_efficiency_metrics(total_revenue, accounts, categories)
         }
         
@@ -1006,25 +1408,27 @@ def calculate_profitability_metrics(revenue, expenses, net_income):
     
     return metrics
 
-def calculate_liquidity_metrics(accounts):
+def calculate_liquidity_metrics(accounts, account_roles=None):
     """Calculate liquidity metrics"""
     metrics = {}
+    if account_roles is None:
+        account_roles = classify_ledger({'by_account': accounts})['accounts']
     
     # Extract current assets and liabilities
     current_assets = sum(
         account_data['net'] for account_name, account_data in accounts.items()
-        if any(term in account_name.lower() for term in ['cash', 'bank', 'receivable'])
+        if account_roles[account_name]['liquid_asset']
     )
     
     current_liabilities = sum(
         -account_data['net'] for account_name, account_data in accounts.items()
-        if any(term in account_name.lower() for term in ['payable']) and account_data['net'] < 0
+        if account_roles[account_name]['payable'] and account_data['net'] < 0
     )
     
     # Cash and cash equivalents
     cash = sum(
         account_data['net'] for account_name, account_data in accounts.items()
-        if any(term in account_name.lower() for term in ['cash', 'bank'])
+        if account_roles[account_name]['cash']
     )
     
     # Calculate ratios
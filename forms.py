@@ -33,7 +33,8 @@ class LoginForm(FlaskForm):
 class UploadFileForm(FlaskForm):
     file = FileField('Financial Data File', validators=[
         FileRequired(),
-        FileAllowed(['csv', 'xlsx', 'pdf'], 'Only CSV, XLSX or PDF files are allowed!')
+        FileAllowed(['csv', 'xlsx', 'pdf', 'gz', 'zip', 'zst'],
+                    'Only CSV, XLSX or PDF files, or CSV compressed as .gz, .zip or .zst, are allowed!')
     ])
     submit = SubmitField('Upload & Process')
 
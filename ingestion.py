@@ -0,0 +1,189 @@
+"""
+Ingestion
+Single-pass CSV ingestion shared by the upload preview and the financial aggregates
+"""
+
+import io
+import logging
+
+import numpy as np
+import pandas as pd
+
+from compressed_files import open_csv_source
+from financial_data_processor import aggregate_ledger_frame, detect_date_format, merge_financial_data
+from ledger_table import TransactionTable, frame_records
+from result_cache import result_cache
+
+logger = logging.getLogger('fintelligence')
+
+# Bytes of complete lines buffered before CsvStreamAggregator parses them
+STREAM_PARSE_BYTES = 4 * 1024 * 1024
+
+# Cells pd.read_csv reads as missing by default (its na_values list)
+DEFAULT_NA_VALUES = frozenset((
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+))
+
+# Cells pd.read_csv reads as booleans by default, when a whole column consists of them
+DEFAULT_BOOL_VALUES = {'True': True, 'TRUE': True, 'true': True, 'False': False, 'FALSE': False, 'false': False}
+
+
+def ingest_csv(file_path, use_cache=True):
+    """
+    Parse a CSV upload exactly once and derive everything needed from it.
+
+    The file is read into a single string-typed table. The preview metadata
+    (columns and row count) and the financial aggregates both come from that
+    table, and the whole ingestion is cached by file content, so
+    process_csv and analyze_csv_data on the same upload share one parse.
+
+    Args:
+        file_path: Path to the CSV file
+        use_cache: Look the ingestion up in the content-hash result cache
+
+    Returns:
+        dict: 'format', 'columns', 'rows', the shared 'table' and
+            'financial_data', or None if the file holds no rows
+    """
+    if use_cache:
+        return result_cache.get_or_compute(file_path, 'ingest:csv', lambda: ingest_csv(file_path, use_cache=False))
+
+    # Read the CSV file as text so values match what csv.DictReader produced;
+    # compressed uploads are decompressed while pandas reads them
+    try:
+        with open_csv_source(file_path) as source:
+            df = pd.read_csv(source, dtype=str, keep_default_na=False, encoding='utf-8')
+    except pd.errors.EmptyDataError:
+        df = pd.DataFrame()
+
+    if df.empty:
+        logger.error(f"No data found in CSV file: {file_path}")
+        return None
+
+    try:
+        financial_data = aggregate_ledger_frame(df)
+        table = financial_data['transactions']
+    except Exception as e:
+        logger.error(f"Error analyzing CSV data: {str(e)}")
+        financial_data = None
+        table = TransactionTable(df)
+
+    return {
+        'format': 'csv',
+        'columns': table.columns,
+        'rows': len(table),
+        'table': table,
+        'financial_data': financial_data
+    }
+
+
+def preview_records(table):
+    """
+    Build preview row dicts from the shared table, typing columns the way
+    pd.read_csv infers them
+
+    Cells pandas treats as missing by default (empty, 'NA', 'null', 'nan'
+    and so on) become NaN, columns whose other values are all numeric
+    become numbers, and columns whose other values are all true/false
+    spellings become booleans.
+
+    Args:
+        table: TransactionTable from ingest_csv
+
+    Returns:
+        list: One dict per row
+    """
+    typed = {}
+    for column in table.frame.columns:
+        values = table.frame[column]
+        present = (~values.isin(DEFAULT_NA_VALUES)).to_numpy()
+        numbers = pd.to_numeric(values.where(present, None), errors='coerce')
+        if present.any() and numbers[present].notna().all():
+            typed[column] = numbers
+        elif present.any() and values[present].isin(DEFAULT_BOOL_VALUES).all():
+            flags = values.map(DEFAULT_BOOL_VALUES)
+            typed[column] = flags.astype(bool) if present.all() else flags.astype(object).where(present, np.nan)
+        else:
+            typed[column] = values.astype(object).where(present, np.nan)
+    return frame_records(pd.DataFrame(typed, columns=table.frame.columns))
+
+
+class CsvStreamAggregator:
+    """
+    Aggregates a CSV ledger from blocks of bytes as they arrive.
+
+    Complete lines are parsed once STREAM_PARSE_BYTES of them are buffered
+    and folded into running totals, so parsing overlaps with the transfer
+    and memory stays bounded. A partial last line waits for the next block.
+    As in parallel ingestion, quoted fields must not contain line breaks.
+    """
+
+    def __init__(self, parse_bytes=STREAM_PARSE_BYTES):
+        """
+        Start an empty aggregate
+
+        Args:
+            parse_bytes: Complete-line bytes buffered before a parse
+        """
+        self.parse_bytes = parse_bytes
+        self.columns = None
+        self.date_format = None
+        self.financial_data = None
+        self.rows = 0
+        self._pending = bytearray()
+
+    def feed(self, data):
+        """
+        Add the next block of the file
+
+        Args:
+            data: Bytes following those already fed
+        """
+        self._pending += data
+        if len(self._pending) < self.parse_bytes:
+            return
+        end = self._pending.rfind(b'\n') + 1
+        if end:
+            self._parse(bytes(self._pending[:end]))
+            del self._pending[:end]
+
+    def finish(self):
+        """
+        Parse whatever is still buffered and return the aggregates
+
+        Returns:
+            dict: Structured financial data without transactions, or None if
+                the file holds no rows
+        """
+        if self._pending:
+            self._parse(bytes(self._pending))
+            self._pending.clear()
+        return self.financial_data
+
+    def _parse(self, data):
+        """Aggregate a run of complete lines"""
+        if self.columns is None:
+            header_end = data.find(b'\n') + 1 or len(data)
+            try:
+                self.columns = list(pd.read_csv(io.BytesIO(data[:header_end]), nrows=0, encoding='utf-8').columns)
+            except pd.errors.EmptyDataError:
+                return
+            data = data[header_end:]
+
+        try:
+            frame = pd.read_csv(io.BytesIO(data), header=None, names=self.columns, dtype=str,
+                                keep_default_na=False, encoding='utf-8')
+        except pd.errors.EmptyDataError:
+            return
+        if frame.empty:
+            return
+
+        if self.date_format is None and 'Date' in frame.columns:
+            self.date_format = detect_date_format(frame['Date'])
+        partial = aggregate_ledger_frame(frame, keep_transactions=False, date_format=self.date_format)
+        self.rows += len(frame)
+        if self.financial_data is None:
+            self.financial_data = partial
+        else:
+            merge_financial_data(self.financial_data, partial)
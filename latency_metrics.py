@@ -0,0 +1,41 @@
+"""
+Latency Metrics
+Percentiles over the rolling latency samples kept by the caches, the LLM clients and the chat endpoints
+"""
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a sample
+
+    Args:
+        values: Sorted numbers
+        fraction: Percentile as a fraction, e.g. 0.95
+
+    Returns:
+        float: The percentile, or None without samples
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def latency_percentiles_ms(seconds):
+    """
+    Summarize latency samples as p50 and p95 in milliseconds
+
+    Args:
+        seconds: Latencies in seconds, in any order
+
+    Returns:
+        dict: 'p50' and 'p95' in milliseconds, None without samples
+    """
+    values = sorted(seconds)
+    return {
+        'p50': _to_ms(percentile(values, 0.5)),
+        'p95': _to_ms(percentile(values, 0.95))
+    }
+
+
+def _to_ms(value):
+    return value * 1000 if value is not None else None
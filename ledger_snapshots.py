@@ -0,0 +1,139 @@
+"""
+Ledger Snapshots
+Stored CSV aggregates that let a recurring upload be refreshed from only its appended rows
+"""
+
+import os
+import json
+import hashlib
+import logging
+
+from app import db
+from compressed_files import detect_compression
+from models import LedgerSnapshot
+from financial_data_processor import (
+    BUCKET_KEYS,
+    FinancialDataEncoder,
+    analyze_csv_append,
+    analyze_csv_data,
+    detect_file_date_format,
+    load_financial_data,
+)
+
+logger = logging.getLogger('fintelligence')
+
+# Bytes read at a time while hashing the covered region of a file
+SNAPSHOT_HASH_BLOCK_BYTES = 1024 * 1024
+
+
+def save_snapshot(upload, file_path, financial_data, parent_upload=None, date_format=None):
+    """
+    Store the aggregates of an analyzed CSV upload
+
+    Args:
+        upload: FileUpload the aggregates belong to
+        file_path: Path to the analyzed CSV file
+        financial_data: Structured financial data for the whole file
+        parent_upload: FileUpload this upload appends to, if any
+        date_format: Date format of the file, detected if None
+
+    Returns:
+        LedgerSnapshot: The saved snapshot
+    """
+    byte_length = os.path.getsize(file_path)
+    snapshot = LedgerSnapshot.query.filter_by(file_id=upload.id).first() or LedgerSnapshot(file_id=upload.id)
+    snapshot.parent_file_id = parent_upload.id if parent_upload else None
+    snapshot.byte_length = byte_length
+    snapshot.prefix_hash = _prefix_hash(file_path, byte_length)
+    snapshot.date_format = date_format or detect_file_date_format(file_path)
+    snapshot.data = json.dumps(_aggregates_only(financial_data), cls=FinancialDataEncoder)
+    db.session.add(snapshot)
+    db.session.commit()
+    return snapshot
+
+
+def analyze_appended_upload(upload, parent_upload, file_path):
+    """
+    Analyze a CSV upload marked as an append to an earlier upload.
+
+    When the file starts with exactly the bytes the parent snapshot covered,
+    and those end on a line break, only the rows after them are parsed and merged into the stored
+    aggregates. Otherwise the file is analyzed from scratch. Either way a
+    snapshot is saved for the new upload, so the next month can append to it.
+    The report generators can be run on the returned data as usual.
+
+    Args:
+        upload: New FileUpload holding the extended ledger
+        parent_upload: Earlier FileUpload the new one extends
+        file_path: Path to the new CSV file
+
+    Returns:
+        dict: Structured financial data for the whole ledger
+    """
+    parent_snapshot = LedgerSnapshot.query.filter_by(file_id=parent_upload.id).first()
+    date_format = parent_snapshot.date_format if parent_snapshot else None
+
+    # Byte offsets only line up with rows in uncompressed files
+    if parent_snapshot and not detect_compression(file_path) and _extends_snapshot(file_path, parent_snapshot):
+        logger.info(f"Upload {upload.id} extends upload {parent_upload.id}; "
+                    f"parsing from byte {parent_snapshot.byte_length}")
+        financial_data = analyze_csv_append(
+            file_path, load_financial_data(parent_snapshot.data), parent_snapshot.byte_length, date_format
+        )
+    else:
+        logger.info(f"Upload {upload.id} does not extend upload {parent_upload.id}; analyzing it in full")
+        financial_data = analyze_csv_data(file_path, streaming=True)
+        date_format = None
+
+    if financial_data:
+        save_snapshot(upload, file_path, financial_data, parent_upload=parent_upload, date_format=date_format)
+    return financial_data
+
+
+def _extends_snapshot(file_path, snapshot):
+    """
+    Check that a file begins with the bytes a snapshot was built from, and
+    that those bytes end on a line break
+
+    A covered region ending mid-line may have had its last row extended
+    ("5" re-exported as "50"), so it cannot be appended to.
+    """
+    if snapshot.byte_length <= 0 or os.path.getsize(file_path) < snapshot.byte_length:
+        return False
+    with open(file_path, 'rb') as csv_file:
+        csv_file.seek(snapshot.byte_length - 1)
+        if csv_file.read(1) != b'\n':
+            return False
+    return _prefix_hash(file_path, snapshot.byte_length) == snapshot.prefix_hash
+
+
+def _prefix_hash(file_path, byte_length):
+    """
+    SHA-256 of the first byte_length bytes of a file
+
+    Every covered byte is hashed, so a row corrected anywhere in a re-export
+    forces a full analysis. Hashing is I/O-bound and far cheaper than
+    parsing, so the refresh time is still driven by the appended rows.
+    """
+    digest = hashlib.sha256()
+    remaining = byte_length
+    with open(file_path, 'rb') as csv_file:
+        while remaining > 0:
+            block = csv_file.read(min(SNAPSHOT_HASH_BLOCK_BYTES, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+
+def _aggregates_only(financial_data):
+    """Copy financial data without its transaction table or bucket row positions"""
+    aggregates = {key: value for key, value in financial_data.items() if key not in BUCKET_KEYS}
+    aggregates['transactions'] = []
+    for bucket_key in BUCKET_KEYS:
+        aggregates[bucket_key] = {
+            name: {key: value for key, value in bucket.items() if key != 'rows'}
+            for name, bucket in financial_data.get(bucket_key, {}).items()
+        }
+    return aggregates
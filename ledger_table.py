@@ -0,0 +1,203 @@
+"""
+Ledger Table
+Compact columnar storage for transaction rows shared by all aggregation buckets
+"""
+
+import numpy as np
+import pandas as pd
+
+# Rows converted to dicts at a time while iterating over a table
+ITER_CHUNK_ROWS = 10000
+
+# Ledger columns stored as categoricals by TypedLedger
+CATEGORICAL_COLUMNS = ('Account', 'Category', 'Type')
+
+
+def frame_records(df):
+    """
+    Build one dict per DataFrame row, as csv.DictReader would have returned them
+
+    Args:
+        df: DataFrame to convert
+
+    Returns:
+        list: Row dicts keyed by column name
+    """
+    columns = [str(column) for column in df.columns]
+    values = [df[column].tolist() for column in df.columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+class TransactionTable:
+    """
+    Transaction rows stored once as columns.
+
+    Aggregation buckets keep integer row positions into this table instead of
+    their own copies of the rows. Row dicts are only built when the table is
+    indexed, iterated or asked for a set of rows, so existing code that loops
+    over financial_data['transactions'] keeps working.
+    """
+
+    __slots__ = ('frame',)
+
+    def __init__(self, frame):
+        """
+        Wrap a DataFrame of transactions
+
+        Args:
+            frame: DataFrame with one row per transaction
+        """
+        self.frame = frame.reset_index(drop=True)
+
+    @property
+    def columns(self):
+        """Column names of the table"""
+        return [str(column) for column in self.frame.columns]
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._records(self.frame.iloc[index])
+        if index < 0:
+            index += len(self.frame)
+        if not 0 <= index < len(self.frame):
+            raise IndexError("transaction index out of range")
+        return self._records(self.frame.iloc[index:index + 1])[0]
+
+    def __iter__(self):
+        for start in range(0, len(self.frame), ITER_CHUNK_ROWS):
+            yield from self._records(self.frame.iloc[start:start + ITER_CHUNK_ROWS])
+
+    def take(self, rows):
+        """
+        Build the row dicts for a set of row positions
+
+        Args:
+            rows: Integer row positions, such as a bucket's 'rows' array
+
+        Returns:
+            list: Row dicts in the order given
+        """
+        return self._records(self.frame.take(np.asarray(rows, dtype=np.int64)))
+
+    def to_dict(self):
+        """
+        Return a JSON-serializable form storing each column name once
+
+        Returns:
+            dict: Column names and per-column value lists
+        """
+        return {
+            'columns': self.columns,
+            'data': [self.frame[column].tolist() for column in self.frame.columns]
+        }
+
+    @classmethod
+    def from_dict(cls, payload):
+        """
+        Rebuild a table from the output of to_dict
+
+        Args:
+            payload: Dict with 'columns' and 'data'
+
+        Returns:
+            TransactionTable: The restored table
+        """
+        return cls(pd.DataFrame(dict(zip(payload['columns'], payload['data'])), columns=payload['columns']))
+
+    @classmethod
+    def concat(cls, tables):
+        """
+        Join tables end to end; row positions of later tables shift by the
+        lengths of the tables before them
+
+        Args:
+            tables: TransactionTable instances in order
+
+        Returns:
+            TransactionTable: The combined table
+        """
+        frames = [table.frame for table in tables if len(table)]
+        if not frames:
+            return cls(pd.DataFrame())
+        return cls(pd.concat(frames, ignore_index=True))
+
+    def _records(self, frame):
+        """Build the row dicts for a slice of the table"""
+        return frame_records(frame)
+
+
+class TypedLedger(TransactionTable):
+    """
+    Ledger rows held as typed columns instead of row dicts.
+
+    Account, Category and Type are categoricals, Amount is int64 cents and
+    Date is datetime64, which takes a fraction of the memory of one dict per
+    row. Indexing and iterating build dicts on demand, with Amount in
+    currency units and Date as a YYYY-MM-DD string, so templates that loop
+    over the rows keep working.
+    """
+
+    __slots__ = ()
+
+    def memory_usage(self):
+        """
+        Return the bytes held by the table's columns
+
+        Returns:
+            int: Deep memory usage of the underlying DataFrame
+        """
+        return int(self.frame.memory_usage(deep=True).sum())
+
+    def to_dict(self):
+        """
+        Return a JSON-serializable form storing each column name once, with
+        Amount in cents and Date as YYYY-MM-DD strings
+
+        Returns:
+            dict: Column names and per-column value lists
+        """
+        data = []
+        for column in self.frame.columns:
+            values = self.frame[column]
+            if pd.api.types.is_datetime64_any_dtype(values):
+                values = values.dt.strftime('%Y-%m-%d')
+            data.append(values.astype(object).where(values.notna(), None).tolist())
+        return {'columns': self.columns, 'data': data}
+
+    @classmethod
+    def from_dict(cls, payload):
+        """
+        Rebuild a typed ledger from the output of to_dict
+
+        Args:
+            payload: Dict with 'columns' and 'data'
+
+        Returns:
+            TypedLedger: The restored ledger
+        """
+        frame = pd.DataFrame(dict(zip(payload['columns'], payload['data'])), columns=payload['columns'])
+        for column in frame.columns:
+            if column in CATEGORICAL_COLUMNS:
+                frame[column] = frame[column].astype('category')
+            elif column == 'Amount':
+                frame[column] = frame[column].astype('Int64' if frame[column].isna().any() else 'int64')
+            elif column == 'Date':
+                frame[column] = pd.to_datetime(frame[column], format='%Y-%m-%d').astype('datetime64[ns]')
+        return cls(frame)
+
+    def _records(self, frame):
+        """Build row dicts, converting cents and dates back to plain values"""
+        decoded = {}
+        for column in frame.columns:
+            values = frame[column]
+            if column == 'Amount' and pd.api.types.is_integer_dtype(values):
+                values = pd.Series(values.to_numpy(dtype=float, na_value=np.nan) / 100, index=values.index)
+            elif pd.api.types.is_datetime64_any_dtype(values):
+                values = values.dt.strftime('%Y-%m-%d').astype(object).where(values.notna(), np.nan)
+            elif isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype(object)
+            decoded[column] = values
+        return frame_records(pd.DataFrame(decoded, columns=frame.columns))
@@ -0,0 +1,267 @@
+"""
+LLM Cache
+Persistent cache of chatbot answers keyed on the normalized prompt, model settings and the user's data
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import deque
+
+from latency_metrics import latency_percentiles_ms
+
+logger = logging.getLogger('fintelligence')
+
+# SQLite file holding cached answers, how long they stay valid and how many are kept
+LLM_CACHE_PATH = os.environ.get(
+    'LLM_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'llm_cache.sqlite3')
+)
+LLM_CACHE_TTL_SECONDS = int(os.environ.get('LLM_CACHE_TTL_HOURS', 24)) * 3600
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 5000))
+
+# Lookup latencies kept for the hit percentiles
+HIT_LATENCY_WINDOW = 1000
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_prompt(prompt):
+    """
+    Normalize a prompt so trivially different phrasings share a cache entry
+
+    Case, runs of whitespace and trailing punctuation are ignored.
+
+    Args:
+        prompt: Prompt text
+
+    Returns:
+        str: Normalized prompt
+    """
+    return _WHITESPACE.sub(' ', prompt).strip().rstrip('?.! ').lower()
+
+
+def data_fingerprint(financial_data):
+    """
+    Fingerprint the financial data an answer is about, so cached answers are
+    not reused once the data changes
+
+    Args:
+        financial_data: Structured financial data or any JSON-serializable value
+
+    Returns:
+        str: Hex SHA-256 of the data's totals and buckets
+    """
+    from financial_data_processor import BUCKET_KEYS
+
+    if isinstance(financial_data, dict):
+        summary = {key: financial_data.get(key) for key in ('income', 'expenses', 'net_income')}
+        for bucket_key in BUCKET_KEYS:
+            summary[bucket_key] = {
+                name: [bucket.get('income'), bucket.get('expenses')]
+                for name, bucket in financial_data.get(bucket_key, {}).items()
+            }
+    else:
+        summary = financial_data
+    payload = json.dumps(summary, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Size-bounded LRU cache of LLM answers with a time-to-live, stored in SQLite.
+
+    Entries are keyed on the normalized prompt, the model, the temperature
+    and an optional fingerprint of the user's data. Answers older than the
+    TTL are treated as misses, and once there are more than max_entries the
+    least recently used are evicted.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL_SECONDS, max_entries=LLM_CACHE_MAX_ENTRIES):
+        """
+        Open or create a cache database
+
+        Args:
+            path: SQLite file for the cache
+            ttl: Seconds an answer stays valid
+            max_entries: Answers kept before the least recently used are evicted
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._saved_ms = 0.0
+        self._hit_latencies = deque(maxlen=HIT_LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_response ("
+                " key TEXT PRIMARY KEY,"
+                " response TEXT NOT NULL,"
+                " model TEXT,"
+                " created REAL NOT NULL,"
+                " last_used REAL NOT NULL,"
+                " compute_ms REAL,"
+                " hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS llm_response_last_used ON llm_response (last_used)")
+
+    def key_for(self, prompt, model, temperature, data_fingerprint=None):
+        """
+        Build the cache key for a request
+
+        Args:
+            prompt: Prompt text
+            model: Model name
+            temperature: Sampling temperature
+            data_fingerprint: Fingerprint of the data the prompt is about, if any
+
+        Returns:
+            str: Cache key
+        """
+        parts = [normalize_prompt(prompt), model or '', f"{float(temperature):.3f}", data_fingerprint or '']
+        return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Return a cached answer, or None on a miss or an expired entry
+
+        Args:
+            key: Cache key from key_for
+
+        Returns:
+            str: The cached answer, or None
+        """
+        start = time.perf_counter()
+        now = time.time()
+        connection = self._connect()
+        row = connection.execute(
+            "SELECT response, created, compute_ms FROM llm_response WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None and now - row[1] > self.ttl:
+            with connection:
+                connection.execute("DELETE FROM llm_response WHERE key = ?", (key,))
+            row = None
+
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with connection:
+            connection.execute(
+                "UPDATE llm_response SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key)
+            )
+        with self._lock:
+            self.hits += 1
+            self._saved_ms += row[2] or 0.0
+            self._hit_latencies.append(time.perf_counter() - start)
+        return row[0]
+
+    def put(self, key, response, model=None, compute_ms=None):
+        """
+        Store an answer, dropping expired entries and the least recently used
+        beyond max_entries
+
+        Args:
+            key: Cache key from key_for
+            response: Answer text
+            model: Model that produced it
+            compute_ms: Milliseconds the answer took to produce
+        """
+        now = time.time()
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO llm_response (key, response, model, created, last_used, compute_ms, hits)"
+                " VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (key, response, model, now, now, compute_ms)
+            )
+            connection.execute("DELETE FROM llm_response WHERE created < ?", (now - self.ttl,))
+            connection.execute(
+                "DELETE FROM llm_response WHERE key IN ("
+                " SELECT key FROM llm_response ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def get_or_compute(self, prompt, model, temperature, compute, data_fingerprint=None):
+        """
+        Return the cached answer to a prompt, calling compute on a miss
+
+        Args:
+            prompt: Prompt text
+            model: Model name
+            temperature: Sampling temperature
+            compute: Function producing the answer when it is not cached
+            data_fingerprint: Fingerprint of the data the prompt is about, if any
+
+        Returns:
+            str: The cached or fresh answer; empty answers are not stored
+        """
+        key = self.key_for(prompt, model, temperature, data_fingerprint)
+        try:
+            response = self.get(key)
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache lookup failed: {str(e)}")
+            response = None
+        if response is not None:
+            logger.info("LLM cache hit")
+            return response
+
+        start = time.perf_counter()
+        response = compute()
+        if response:
+            try:
+                self.put(key, response, model, (time.perf_counter() - start) * 1000)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not cache LLM response: {str(e)}")
+        return response
+
+    def stats(self):
+        """
+        Return cache counters
+
+        Returns:
+            dict: Hits, misses, stored entries, hit lookup latency
+                percentiles in milliseconds and model time saved by hits
+        """
+        entries = self._connect().execute("SELECT COUNT(*) FROM llm_response").fetchone()[0]
+        with self._lock:
+            latencies = list(self._hit_latencies)
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': entries,
+                'saved_ms': self._saved_ms
+            }
+        stats['hit_latency_ms'] = latency_percentiles_ms(latencies)
+        return stats
+
+    def clear(self):
+        """Remove every cached answer"""
+        with self._connect() as connection:
+            connection.execute("DELETE FROM llm_response")
+
+    def _connect(self):
+        """Return this thread's connection to the cache database"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+
+# Shared cache used by both chatbot back ends
+llm_cache = LLMResponseCache()
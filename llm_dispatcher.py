@@ -0,0 +1,535 @@
+"""
+LLM Dispatcher
+Runs chatbot completions and streams on a shared asyncio loop with a concurrency cap, per-user fairness and in-flight coalescing
+"""
+
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import partial
+
+from llm_cache import llm_cache
+
+logger = logging.getLogger('fintelligence')
+
+# Completions running upstream at once, across all users
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 4))
+
+# Seconds a caller waits for an answer before giving up
+LLM_DISPATCH_TIMEOUT = float(os.environ.get('LLM_DISPATCH_TIMEOUT', 120))
+
+# Provider used by the shared dispatcher: 'router', 'openai', 'processor' or 'fake'
+LLM_PROVIDER = os.environ.get('LLM_PROVIDER', 'router')
+
+# Marks the end of a relayed stream
+_STREAM_END = object()
+
+
+class FakeLLMProvider:
+    """
+    Local stand-in for an LLM endpoint, for tests and development.
+
+    Answers after a fixed delay without any network access and counts the
+    calls it receives, so coalescing and concurrency can be checked.
+    """
+
+    model = 'fake'
+
+    def __init__(self, latency=0.05, respond=None):
+        """
+        Create a fake provider
+
+        Args:
+            latency: Seconds each completion takes, or a function returning them
+            respond: Function prompt -> answer, echoing the prompt if None;
+                it may raise to simulate a failing endpoint
+        """
+        self.latency = latency
+        self.respond = respond or (lambda prompt: f"Echo: {prompt}")
+        self.calls = 0
+        self.active = 0
+        self.peak_active = 0
+
+    async def complete(self, prompt, **settings):
+        """Answer a prompt after the configured latency"""
+        self.calls += 1
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+        try:
+            await asyncio.sleep(self.latency() if callable(self.latency) else self.latency)
+            return self.respond(prompt)
+        finally:
+            self.active -= 1
+
+
+class BlockingProvider:
+    """Adapts a blocking completion function to the dispatcher by running it in a thread pool"""
+
+    def __init__(self, function, model='', max_workers=LLM_MAX_CONCURRENCY):
+        """
+        Wrap a blocking function
+
+        Args:
+            function: Function (prompt, **settings) -> answer
+            model: Model name, used in coalescing keys
+            max_workers: Threads available for concurrent calls
+        """
+        self.function = function
+        self.model = model
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm')
+
+    async def complete(self, prompt, **settings):
+        """Run the blocking function without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(self.function, prompt, **settings))
+
+
+class _StreamRelay:
+    """
+    Fans the pieces of one streamed answer out to every request waiting for it.
+
+    Only used on the dispatcher's loop. A request that joins late first gets
+    the pieces already produced.
+    """
+
+    def __init__(self):
+        self.pieces = []
+        self.listeners = []
+        self.finished = False
+        self.error = None
+
+    def subscribe(self, listener):
+        """Send the pieces so far, and every later one, to a queue.Queue"""
+        for piece in self.pieces:
+            listener.put(piece)
+        if self.finished:
+            listener.put(self.error or _STREAM_END)
+        else:
+            self.listeners.append(listener)
+
+    def publish(self, piece):
+        self.pieces.append(piece)
+        for listener in self.listeners:
+            listener.put(piece)
+
+    def finish(self, error=None):
+        self.finished, self.error = True, error
+        for listener in self.listeners:
+            listener.put(error or _STREAM_END)
+        self.listeners = []
+
+
+class LLMDispatcher:
+    """
+    Schedules LLM completions and streams on a background asyncio loop.
+
+    At most max_concurrency completions or streams run upstream at once.
+    Waiting requests are queued per user and served round-robin, so one
+    user's burst does not hold back everyone else. A request identical to
+    one already queued or running (same coalescing key) does not go upstream
+    again: it waits for the same answer, or joins the same stream.
+    """
+
+    def __init__(self, provider, max_concurrency=LLM_MAX_CONCURRENCY):
+        """
+        Create a dispatcher; its loop starts on first use
+
+        Args:
+            provider: Object with an async complete(prompt, **settings) method
+            max_concurrency: Completions running upstream at once
+        """
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self._loop = None
+        self._start_lock = threading.Lock()
+        self._queues = OrderedDict()
+        self._in_flight = {}
+        self._ready = None
+        self._running = 0
+        self._stats = {'requests': 0, 'coalesced': 0, 'completed': 0, 'failed': 0}
+
+    def dispatch(self, prompt, user_id=None, key=None, timeout=LLM_DISPATCH_TIMEOUT, **settings):
+        """
+        Get a completion from synchronous code, waiting for the answer
+
+        Args:
+            prompt: Prompt text
+            user_id: User the request is made for; requests are shared fairly between users
+            key: Coalescing key, derived from the prompt and settings if None
+            timeout: Seconds to wait for the answer
+            **settings: Passed to the provider
+
+        Returns:
+            str: The answer
+
+        Raises:
+            TimeoutError: If no answer arrives in time
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self.dispatch_async(prompt, user_id=user_id, key=key, **settings), self._ensure_loop()
+        )
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    async def dispatch_async(self, prompt, user_id=None, key=None, **settings):
+        """
+        Get a completion from a coroutine running on the dispatcher's loop
+
+        Args:
+            prompt: Prompt text
+            user_id: User the request is made for
+            key: Coalescing key, derived from the prompt and settings if None
+            **settings: Passed to the provider
+
+        Returns:
+            str: The answer
+        """
+        from openai_setup import OPENAI_TEMPERATURE
+
+        # Keyed like the chat helpers below, so identical requests coalesce whichever way they come in
+        key = key or llm_cache.key_for(prompt, getattr(self.provider, 'model', ''),
+                                       settings.get('temperature', OPENAI_TEMPERATURE), settings.get('data_fingerprint'))
+        self._stats['requests'] += 1
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self._stats['coalesced'] += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            # Mark the error as seen even if every waiter gave up
+            future.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self._in_flight[key] = future
+            settings = {name: value for name, value in settings.items() if name != 'data_fingerprint'}
+            self._queues.setdefault(user_id, deque()).append(
+                (key, partial(self.provider.complete, prompt, **settings), future)
+            )
+            async with self._ready:
+                self._ready.notify()
+
+        # Shielded so a waiter that times out does not cancel the shared call
+        return await asyncio.shield(future)
+
+    def stream(self, prompt, stream_function, user_id=None, key=None, timeout=LLM_DISPATCH_TIMEOUT):
+        """
+        Stream an answer from synchronous code, taking a dispatcher slot for
+        the whole stream
+
+        Args:
+            prompt: Prompt text
+            stream_function: Blocking function prompt -> iterator of answer
+                pieces; it runs in a worker thread once a slot is free
+            user_id: User the request is made for; requests are shared fairly between users
+            key: Coalescing key, derived from the prompt if None
+            timeout: Seconds to wait for the whole answer
+
+        Yields:
+            str: Consecutive pieces of the answer
+
+        Raises:
+            TimeoutError: If the answer does not finish in time
+            Exception: Whatever stream_function raised
+        """
+        from openai_setup import OPENAI_TEMPERATURE
+
+        key = ('stream', key or llm_cache.key_for(prompt, getattr(self.provider, 'model', ''), OPENAI_TEMPERATURE, None))
+        listener = queue.Queue()
+        asyncio.run_coroutine_threadsafe(
+            self._join_stream(prompt, stream_function, user_id, key, listener), self._ensure_loop()
+        ).result()
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                item = listener.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise FutureTimeoutError() from None
+            if item is _STREAM_END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    async def _join_stream(self, prompt, stream_function, user_id, key, listener):
+        """Attach a listener to the stream in flight for key, queueing the stream if there is none"""
+        self._stats['requests'] += 1
+        relay = self._in_flight.get(key)
+        if relay is not None:
+            self._stats['coalesced'] += 1
+        else:
+            relay = _StreamRelay()
+            future = asyncio.get_running_loop().create_future()
+            future.add_done_callback(lambda done: done.cancelled() or done.exception())
+            # Streams are kept apart from completions by their ('stream', key) keys
+            self._in_flight[key] = relay
+            self._queues.setdefault(user_id, deque()).append(
+                (key, partial(self._relay, relay, stream_function, prompt), future)
+            )
+            async with self._ready:
+                self._ready.notify()
+        relay.subscribe(listener)
+
+    async def _relay(self, relay, stream_function, prompt):
+        """Run a blocking stream in a thread, publishing its pieces on the loop"""
+        loop = asyncio.get_running_loop()
+
+        def pump():
+            for piece in stream_function(prompt):
+                loop.call_soon_threadsafe(relay.publish, piece)
+
+        try:
+            # Pieces are published before the executor's result reaches the loop
+            await loop.run_in_executor(None, pump)
+        except Exception as e:
+            relay.finish(e)
+            raise
+        relay.finish()
+        return "".join(relay.pieces)
+
+    def stats(self):
+        """
+        Report dispatcher counters
+
+        Returns:
+            dict: Requests, coalesced requests, completed and failed calls,
+                calls running and waiting, and the concurrency cap
+        """
+        stats = dict(self._stats)
+        stats['running'] = self._running
+        stats['queued'] = sum(len(queue) for queue in list(self._queues.values()))
+        stats['max_concurrency'] = self.max_concurrency
+        return stats
+
+    def close(self):
+        """Stop the workers and the background loop; waiting requests are cancelled"""
+        with self._start_lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+
+        async def stop():
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+
+        asyncio.run_coroutine_threadsafe(stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    def _ensure_loop(self):
+        """Start the background loop and its workers if needed"""
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='llm-dispatcher', daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._start_workers(), loop).result()
+                self._loop = loop
+        return self._loop
+
+    async def _start_workers(self):
+        self._ready = asyncio.Condition()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrency)]
+
+    async def _worker(self):
+        """Take the next user's oldest request and run it, forever"""
+        while True:
+            async with self._ready:
+                await self._ready.wait_for(lambda: self._queues)
+                key, call, future = self._next_job()
+
+            self._running += 1
+            start = time.perf_counter()
+            try:
+                result = await call()
+                if not future.done():
+                    future.set_result(result)
+                self._stats['completed'] += 1
+            except Exception as e:
+                logger.error(f"LLM completion failed: {str(e)}")
+                if not future.done():
+                    future.set_exception(e)
+                self._stats['failed'] += 1
+            finally:
+                self._running -= 1
+                self._in_flight.pop(key, None)
+                logger.debug(f"LLM completion took {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def _next_job(self):
+        """Pop the oldest request of the user at the front of the rotation"""
+        user_id, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        del self._queues[user_id]
+        if queue:
+            # The user goes to the back of the rotation
+            self._queues[user_id] = queue
+        return job
+
+
+def default_provider(name=LLM_PROVIDER):
+    """
+    Build the provider named by LLM_PROVIDER
+
+    Every upstream provider charges the shared quota scheduler for each
+    request it sends, so a router's hedged copies and failovers are charged
+    as well.
+
+    Args:
+        name: 'openai' for the official client, 'processor' for
+            OpenAIProcessor, 'router' for an LLMRouter over both (the
+            official client only when an API key is configured) or 'fake'
+            for FakeLLMProvider
+
+    Returns:
+        object: Provider for LLMDispatcher
+    """
+    if name == 'fake':
+        return FakeLLMProvider()
+    if name == 'router':
+        from llm_router import LLMRouter
+        from openai_setup import client
+        providers = {'openai': default_provider('openai')} if client is not None else {}
+        providers['processor'] = default_provider('processor')
+        return LLMRouter(providers)
+    if name == 'processor':
+        # request_completion charges the quota scheduler for each of its attempts
+        from openai_processor import openai_processor
+        return BlockingProvider(
+            lambda prompt, **settings: openai_processor.request_completion(prompt, priority=settings.get('priority')),
+            model=openai_processor.model
+        )
+
+    from llm_scheduler import ScheduledProvider, llm_scheduler
+    from openai_setup import OPENAI_MODEL, get_openai_response
+    return ScheduledProvider(
+        BlockingProvider(lambda prompt, **settings: get_openai_response(prompt, use_cache=False), model=OPENAI_MODEL),
+        llm_scheduler
+    )
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """
+    Return the shared dispatcher, creating it on first use
+
+    Returns:
+        LLMDispatcher: Dispatcher using default_provider()
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = LLMDispatcher(default_provider())
+        return _dispatcher
+
+
+def dispatch_chat_response(prompt, user_id=None, data_fingerprint=None, timeout=LLM_DISPATCH_TIMEOUT,
+                           priority='interactive'):
+    """
+    Answer a chatbot prompt through the shared dispatcher and the LLM cache
+
+    Args:
+        prompt (str): The prompt to send
+        user_id (int, optional): User asking, for fair scheduling
+        data_fingerprint (str, optional): Fingerprint of the data the question is about
+        timeout (float): Seconds to wait for the answer
+        priority (str): 'interactive' for chat, 'background' for work nobody is waiting on
+
+    Returns:
+        str: The answer, or None if it could not be produced
+
+    Raises:
+        QuotaWaitTooLong: If the upstream quota would keep the call waiting
+            too long; its wait_seconds says when to try again
+    """
+    from llm_scheduler import QuotaWaitTooLong
+    from openai_setup import OPENAI_TEMPERATURE
+
+    dispatcher = get_dispatcher()
+    model = getattr(dispatcher.provider, 'model', '')
+    # The providers answer at OPENAI_TEMPERATURE, so the key says so, like every other LLM cache key
+    key = llm_cache.key_for(prompt, model, OPENAI_TEMPERATURE, data_fingerprint)
+    try:
+        cached = llm_cache.get(key)
+    except Exception as e:
+        logger.warning(f"LLM cache lookup failed: {str(e)}")
+        cached = None
+    if cached is not None:
+        return cached
+
+    start = time.perf_counter()
+    try:
+        response = dispatcher.dispatch(prompt, user_id=user_id, key=key, timeout=timeout, priority=priority)
+    except QuotaWaitTooLong:
+        raise
+    except Exception as e:
+        logger.error(f"Error dispatching LLM request: {str(e)}")
+        return None
+
+    if response:
+        try:
+            llm_cache.put(key, response, model, (time.perf_counter() - start) * 1000)
+        except Exception as e:
+            logger.warning(f"Could not cache LLM response: {str(e)}")
+    return response
+
+
+def dispatch_chat_stream(prompt, user_id=None, data_fingerprint=None, timeout=LLM_DISPATCH_TIMEOUT):
+    """
+    Stream a chatbot answer through the shared dispatcher and the LLM cache
+
+    A cached answer is yielded whole without queueing. Otherwise the OpenAI
+    stream takes a dispatcher slot like any other call, in the user's turn,
+    and an identical question already streaming is joined rather than sent
+    again. If nothing can be streamed (no API key or the stream failed), a
+    whole answer is requested through dispatch_chat_response, whose provider
+    fails over between the configured endpoints.
+
+    Args:
+        prompt (str): The prompt to send
+        user_id (int, optional): User asking, for fair scheduling
+        data_fingerprint (str, optional): Fingerprint of the data the question is about
+        timeout (float): Seconds to wait for the whole answer
+
+    Yields:
+        str: Consecutive pieces of the answer; nothing if none could be produced
+
+    Raises:
+        QuotaWaitTooLong: If the upstream quota would keep the call waiting
+            too long; its wait_seconds says when to try again
+        TimeoutError: If the stream does not finish in time
+        Exception: The API error, if the stream breaks off partway
+    """
+    from openai_setup import OPENAI_MODEL, OPENAI_TEMPERATURE, stream_openai_response
+
+    key = llm_cache.key_for(prompt, OPENAI_MODEL, OPENAI_TEMPERATURE, data_fingerprint)
+    try:
+        cached = llm_cache.get(key)
+    except Exception as e:
+        logger.warning(f"LLM cache lookup failed: {str(e)}")
+        cached = None
+    if cached is not None:
+        yield cached
+        return
+
+    streamed = False
+    pieces = get_dispatcher().stream(
+        prompt, lambda text: stream_openai_response(text, data_fingerprint=data_fingerprint),
+        user_id=user_id, key=key, timeout=timeout
+    )
+    for piece in pieces:
+        streamed = True
+        yield piece
+    if streamed:
+        return
+
+    response = dispatch_chat_response(prompt, user_id=user_id, data_fingerprint=data_fingerprint, timeout=timeout)
+    if response:
+        yield response
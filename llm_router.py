@@ -0,0 +1,296 @@
+"""
+LLM Router
+Sends each completion to the fastest healthy LLM provider, hedging slow requests and failing over on errors
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+
+from latency_metrics import percentile
+
+logger = logging.getLogger('fintelligence')
+
+# Outcomes kept per provider for the latency percentiles and the error rate
+ROUTER_WINDOW = int(os.environ.get('LLM_ROUTER_WINDOW', 200))
+
+# Error rate above which a provider is skipped, once it has this many outcomes
+ROUTER_MAX_ERROR_RATE = float(os.environ.get('LLM_ROUTER_MAX_ERROR_RATE', 0.5))
+ROUTER_MIN_SAMPLES = int(os.environ.get('LLM_ROUTER_MIN_SAMPLES', 5))
+
+# Seconds an unhealthy provider is skipped before it is tried again
+ROUTER_RETRY_AFTER = float(os.environ.get('LLM_ROUTER_RETRY_AFTER', 30))
+
+# Hedge deadline in seconds before a provider has latency samples, and its lower bound
+ROUTER_DEFAULT_HEDGE_DELAY = float(os.environ.get('LLM_ROUTER_HEDGE_DELAY', 10))
+ROUTER_MIN_HEDGE_DELAY = float(os.environ.get('LLM_ROUTER_MIN_HEDGE_DELAY', 0.05))
+
+
+class ProviderHealth:
+    """
+    Rolling latency and error record of one provider.
+
+    Latencies of finished requests are kept apart from the lower bounds of
+    requests abandoned after their hedge deadline, so the percentiles only
+    reflect real answers while the ranking still sees a provider slowing down.
+    """
+
+    def __init__(self, window=ROUTER_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.abandoned = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.last_failure = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        """
+        Record one finished request
+
+        Args:
+            seconds: How long the request took
+            ok: Whether it produced an answer
+        """
+        with self._lock:
+            self.outcomes.append(ok)
+            if ok:
+                self.latencies.append(seconds)
+            else:
+                self.last_failure = time.monotonic()
+
+    def record_abandoned(self, seconds):
+        """
+        Record a lower bound on latency for a request abandoned before it answered
+
+        Args:
+            seconds: How long the request had been running
+        """
+        with self._lock:
+            self.abandoned.append(seconds)
+
+    def percentile(self, fraction):
+        """
+        Latency percentile of successful requests; abandoned requests are left out
+
+        Args:
+            fraction: Percentile as a fraction, e.g. 0.95
+
+        Returns:
+            float: Seconds, or None without samples
+        """
+        with self._lock:
+            values = sorted(self.latencies)
+        return percentile(values, fraction)
+
+    def expected_latency(self):
+        """
+        Median latency used to rank the provider
+
+        Abandoned requests count at their lower bound, so a provider that
+        keeps losing to hedges ranks lower even though it never answers.
+
+        Returns:
+            float: Seconds, or None without samples
+        """
+        with self._lock:
+            values = sorted(list(self.latencies) + list(self.abandoned))
+        return percentile(values, 0.5)
+
+    @property
+    def error_rate(self):
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+    def healthy(self, max_error_rate=ROUTER_MAX_ERROR_RATE, min_samples=ROUTER_MIN_SAMPLES,
+                retry_after=ROUTER_RETRY_AFTER):
+        """
+        Whether the provider should get traffic.
+
+        A provider failing too often is skipped, but is tried again once
+        retry_after seconds have passed since its last failure, so it can
+        recover.
+
+        Returns:
+            bool: True if requests may be sent to it first
+        """
+        if len(self.outcomes) < min_samples or self.error_rate <= max_error_rate:
+            return True
+        return time.monotonic() - (self.last_failure or 0) >= retry_after
+
+
+class LLMRouter:
+    """
+    Routes completions across several providers.
+
+    Providers are ranked by health, then by rolling p50 latency; providers
+    without samples rank first so they get measured. A request goes to the
+    best provider. If it has not answered by that provider's p95 latency, a
+    hedged copy goes to the next provider and the first answer wins. A
+    provider that fails is recorded and the request fails over to the next
+    one. The router has the same async complete method as a single provider,
+    so it can be handed to LLMDispatcher.
+    """
+
+    def __init__(self, providers, hedge=True, default_hedge_delay=ROUTER_DEFAULT_HEDGE_DELAY,
+                 min_hedge_delay=ROUTER_MIN_HEDGE_DELAY):
+        """
+        Create a router
+
+        Args:
+            providers: Dict of provider name -> provider with an async complete method
+            hedge: Send a hedged request when the first provider is slow
+            default_hedge_delay: Hedge deadline in seconds for a provider without samples
+            min_hedge_delay: Shortest hedge deadline in seconds
+        """
+        if not providers:
+            raise ValueError("LLMRouter needs at least one provider")
+        self.providers = dict(providers)
+        self.health = {name: ProviderHealth() for name in self.providers}
+        self.hedge = hedge
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self._stats = {'requests': 0, 'hedged': 0, 'hedge_wins': 0, 'failovers': 0, 'failed': 0}
+
+        models = {getattr(provider, 'model', '') for provider in self.providers.values()}
+        self.model = models.pop() if len(models) == 1 else 'router'
+
+    def ranked(self):
+        """
+        Order the providers for the next request
+
+        Returns:
+            list: Provider names, healthy and fastest first
+        """
+        def rank(name):
+            health = self.health[name]
+            p50 = health.expected_latency()
+            return (not health.healthy(), p50 is not None, p50 or 0.0)
+        return sorted(self.providers, key=rank)
+
+    async def complete(self, prompt, **settings):
+        """
+        Get a completion from the best provider
+
+        Args:
+            prompt: Prompt text
+            **settings: Passed to the providers
+
+        Returns:
+            str: The first answer produced
+
+        Raises:
+            Exception: The last provider error if every provider failed
+        """
+        self._stats['requests'] += 1
+        order = self.ranked()
+        primary = order[0]
+        waiting = deque(order[1:])
+        tasks = {self._start(primary, prompt, settings, primary=True): primary}
+        last_error = None
+        hedged_to = None
+
+        hedge_delay = self.hedge_delay(primary)
+        try:
+            while tasks:
+                timeout = hedge_delay if self.hedge and hedged_to is None and waiting and len(tasks) == 1 else None
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # The request is slow: race a hedged copy on the next provider
+                    name = waiting.popleft()
+                    self._stats['hedged'] += 1
+                    logger.info(f"Hedging LLM request to {name} after {hedge_delay:.2f}s")
+                    tasks[self._start(name, prompt, settings)] = name
+                    hedged_to = name
+                    continue
+
+                for task in done:
+                    name = tasks.pop(task)
+                    if task.exception() is None:
+                        if name == hedged_to:
+                            self._stats['hedge_wins'] += 1
+                        return task.result()
+                    last_error = task.exception()
+                    logger.warning(f"LLM provider {name} failed: {str(last_error)}")
+
+                if not tasks and waiting:
+                    name = waiting.popleft()
+                    self._stats['failovers'] += 1
+                    logger.info(f"Failing over LLM request to {name}")
+                    tasks[self._start(name, prompt, settings)] = name
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        self._stats['failed'] += 1
+        raise last_error
+
+    def hedge_delay(self, name):
+        """
+        Seconds to wait for a provider before hedging
+
+        Args:
+            name: Provider name
+
+        Returns:
+            float: The provider's p95 latency, or the default without samples
+        """
+        p95 = self.health[name].percentile(0.95)
+        if p95 is None:
+            return self.default_hedge_delay
+        return max(self.min_hedge_delay, p95)
+
+    def stats(self):
+        """
+        Report router counters and per-provider health
+
+        Returns:
+            dict: Requests, hedged requests, hedges that won, failovers and
+                failed requests, plus p50/p95 latency in milliseconds, error
+                rate and health for each provider
+        """
+        stats = dict(self._stats)
+        providers = {}
+        for name, health in self.health.items():
+            p50, p95 = health.percentile(0.5), health.percentile(0.95)
+            providers[name] = {
+                'latency_ms': {
+                    'p50': p50 * 1000 if p50 is not None else None,
+                    'p95': p95 * 1000 if p95 is not None else None
+                },
+                'error_rate': health.error_rate,
+                'healthy': health.healthy()
+            }
+        stats['providers'] = providers
+        return stats
+
+    def _start(self, name, prompt, settings, primary=False):
+        """
+        Start a request to one provider, recording its latency and outcome
+
+        Only the primary request is recorded when cancelled: it lost after
+        running past its hedge deadline, which says the provider is slow. A
+        hedged copy that loses was cut short by a faster answer and says
+        nothing about its provider.
+        """
+        async def attempt():
+            start = time.perf_counter()
+            try:
+                response = await self.providers[name].complete(prompt, **settings)
+                if not response:
+                    raise RuntimeError(f"{name} returned no response")
+            except asyncio.CancelledError:
+                if primary:
+                    self.health[name].record_abandoned(time.perf_counter() - start)
+                raise
+            except Exception:
+                self.health[name].record(time.perf_counter() - start, False)
+                raise
+            self.health[name].record(time.perf_counter() - start, True)
+            return response
+
+        return asyncio.ensure_future(attempt())
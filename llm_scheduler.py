@@ -0,0 +1,430 @@
+"""
+LLM Scheduler
+Keeps LLM calls under the upstream requests-per-minute and tokens-per-minute quotas, interactive chat first
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+import threading
+import itertools
+
+logger = logging.getLogger('fintelligence')
+
+# Upstream quota: requests and tokens (prompt plus completion) per minute
+LLM_RATE_RPM = int(os.environ.get('LLM_RATE_RPM', 60))
+LLM_RATE_TPM = int(os.environ.get('LLM_RATE_TPM', 90000))
+
+# Longest a caller is kept waiting for quota before it is told to come back later
+LLM_MAX_QUOTA_WAIT = float(os.environ.get('LLM_MAX_QUOTA_WAIT', 60))
+
+# Seconds to pause all calls after a quota error without a Retry-After
+LLM_QUOTA_PENALTY = float(os.environ.get('LLM_QUOTA_PENALTY', 20))
+
+# Completion tokens reserved per call when the caller does not say
+DEFAULT_COMPLETION_TOKENS = 1000
+
+# Call priorities; lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# Longest an async waiter sleeps before checking the queue again
+ASYNC_POLL_SECONDS = 0.25
+
+
+class QuotaWaitTooLong(Exception):
+    """Raised when a call would wait longer than allowed for quota"""
+
+    def __init__(self, wait_seconds):
+        super().__init__(f"LLM quota exhausted; retry in about {wait_seconds:.0f} seconds")
+        self.wait_seconds = wait_seconds
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously up to its capacity.
+
+    Not thread-safe on its own; QuotaScheduler guards it with its lock.
+    """
+
+    def __init__(self, capacity, per_second, now):
+        """
+        Create a full bucket
+
+        Args:
+            capacity: Most tokens the bucket holds
+            per_second: Tokens added per second
+            now: Current clock reading
+        """
+        self.capacity = float(capacity)
+        self.per_second = float(per_second)
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def refill(self, now):
+        """Add the tokens accrued since the last update"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def time_until(self, amount, now, single=True):
+        """
+        Seconds until the bucket has supplied amount tokens
+
+        For a single call, amounts above the capacity are treated as the
+        full capacity, so an oversized call still goes through once the
+        bucket is full. For several queued calls the amount is not capped:
+        they are admitted one after another as the bucket refills.
+
+        Args:
+            amount: Tokens needed
+            now: Current clock reading
+            single: Whether amount is for one call
+
+        Returns:
+            float: Seconds to wait, 0 if they are available now
+        """
+        self.refill(now)
+        missing = (min(amount, self.capacity) if single else amount) - self.tokens
+        return max(0.0, missing / self.per_second)
+
+    def take(self, amount):
+        """Remove tokens; the balance may go negative for oversized calls"""
+        self.tokens -= amount
+
+
+class QuotaScheduler:
+    """
+    Admits LLM calls at the rate the upstream quotas allow.
+
+    Requests per minute and tokens per minute are each modelled as a token
+    bucket. Waiting calls are served strictly in priority order, then in
+    arrival order, so interactive chat overtakes background work. A call is
+    admitted as soon as both buckets hold enough for it. Instead of failing,
+    a caller can ask how long it would wait, and a call that would wait
+    longer than max_wait raises QuotaWaitTooLong with the estimate.
+    """
+
+    def __init__(self, rpm=LLM_RATE_RPM, tpm=LLM_RATE_TPM, max_wait=LLM_MAX_QUOTA_WAIT, clock=time.monotonic):
+        """
+        Create a scheduler with full buckets
+
+        Args:
+            rpm: Requests allowed per minute
+            tpm: Tokens allowed per minute
+            max_wait: Longest wait in seconds before a call is refused
+            clock: Function returning the current time in seconds
+        """
+        self.clock = clock
+        self.max_wait = max_wait
+        now = clock()
+        self.requests = TokenBucket(rpm, rpm / 60.0, now)
+        self.tokens = TokenBucket(tpm, tpm / 60.0, now)
+        self.paused_until = now
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stats = {'admitted': 0, 'refused': 0, 'penalties': 0, 'waited_seconds': 0.0}
+
+    def estimate_wait(self, tokens, priority=PRIORITY_INTERACTIVE):
+        """
+        Estimate how long a new call would wait for quota
+
+        Args:
+            tokens: Tokens the call will use
+            priority: Call priority
+
+        Returns:
+            float: Seconds until the call would be admitted
+        """
+        with self._condition:
+            ahead = [ticket for ticket in self._queue if ticket[0] <= priority]
+            return self._wait_for(len(ahead) + 1, sum(ticket[2] for ticket in ahead) + tokens, single=not ahead)
+
+    def acquire(self, tokens, priority=PRIORITY_INTERACTIVE, max_wait=None):
+        """
+        Block until a call may be made, then charge it to the quotas
+
+        Args:
+            tokens: Tokens the call will use
+            priority: Call priority
+            max_wait: Longest wait in seconds, max_wait of the scheduler if None
+
+        Returns:
+            float: Seconds spent waiting
+
+        Raises:
+            QuotaWaitTooLong: If the estimated wait exceeds max_wait
+        """
+        start = self.clock()
+        with self._condition:
+            ticket = self._enqueue(tokens, priority, max_wait)
+            try:
+                while True:
+                    wait = self._admit(ticket)
+                    if wait is None:
+                        break
+                    self._condition.wait(wait)
+            except BaseException:
+                self._remove(ticket)
+                raise
+        return self._waited(start)
+
+    async def acquire_async(self, tokens, priority=PRIORITY_INTERACTIVE, max_wait=None):
+        """
+        Wait without blocking the event loop until a call may be made, then
+        charge it to the quotas
+
+        Args:
+            tokens: Tokens the call will use
+            priority: Call priority
+            max_wait: Longest wait in seconds, max_wait of the scheduler if None
+
+        Returns:
+            float: Seconds spent waiting
+
+        Raises:
+            QuotaWaitTooLong: If the estimated wait exceeds max_wait
+        """
+        start = self.clock()
+        with self._condition:
+            ticket = self._enqueue(tokens, priority, max_wait)
+        try:
+            while True:
+                with self._condition:
+                    wait = self._admit(ticket)
+                if wait is None:
+                    break
+                await asyncio.sleep(min(wait, ASYNC_POLL_SECONDS))
+        except BaseException:
+            with self._condition:
+                self._remove(ticket)
+            raise
+        return self._waited(start)
+
+    def run(self, prompt, call, priority=None, completion_tokens=DEFAULT_COMPLETION_TOKENS):
+        """
+        Make a blocking LLM call once the quota allows it
+
+        Args:
+            prompt: Prompt text, used to estimate the tokens charged
+            call: Function making the upstream call
+            priority: 'interactive' (default), 'background' or a number
+            completion_tokens: Tokens reserved for the answer
+
+        Returns:
+            object: Whatever call returns
+
+        Raises:
+            QuotaWaitTooLong: If the estimated wait exceeds max_wait
+        """
+        self.acquire(call_tokens(prompt, completion_tokens), priority_value(priority))
+        try:
+            return call()
+        except Exception as e:
+            if is_quota_error(e):
+                self.penalize(retry_after_seconds(e))
+            raise
+
+    def penalize(self, retry_after=None):
+        """
+        Pause every call after the upstream reported a quota error
+
+        Args:
+            retry_after: Seconds the upstream asked to wait, LLM_QUOTA_PENALTY if None
+        """
+        with self._condition:
+            self.paused_until = max(self.paused_until, self.clock() + (retry_after or LLM_QUOTA_PENALTY))
+            self._stats['penalties'] += 1
+            self._condition.notify_all()
+        logger.warning(f"LLM quota error; pausing calls for {retry_after or LLM_QUOTA_PENALTY:.0f}s")
+
+    def stats(self):
+        """
+        Report scheduler counters
+
+        Returns:
+            dict: Admitted and refused calls, quota penalties, total seconds
+                waited, calls queued and the tokens currently available
+        """
+        with self._condition:
+            now = self.clock()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            stats = dict(self._stats)
+            stats['queued'] = len(self._queue)
+            stats['requests_available'] = self.requests.tokens
+            stats['tokens_available'] = self.tokens.tokens
+            stats['paused_for'] = max(0.0, self.paused_until - now)
+        return stats
+
+    def _enqueue(self, tokens, priority, max_wait):
+        """Queue a call, refusing it if it would wait too long; caller holds the lock"""
+        max_wait = self.max_wait if max_wait is None else max_wait
+        ahead = [ticket for ticket in self._queue if ticket[0] <= priority]
+        wait = self._wait_for(len(ahead) + 1, sum(ticket[2] for ticket in ahead) + tokens, single=not ahead)
+        if wait > max_wait:
+            self._stats['refused'] += 1
+            raise QuotaWaitTooLong(wait)
+        ticket = (priority, next(self._sequence), tokens)
+        heapq.heappush(self._queue, ticket)
+        return ticket
+
+    def _admit(self, ticket):
+        """
+        Admit the ticket if it is first in line and the quota allows; caller holds the lock
+
+        Returns:
+            float: None once admitted, otherwise seconds worth waiting before trying again
+        """
+        if self._queue[0] is not ticket:
+            # Woken when the calls ahead are admitted; the timeout guards against missed wakeups
+            return self._wait_for(1, self._queue[0][2]) or ASYNC_POLL_SECONDS
+        wait = self._wait_for(1, ticket[2])
+        if wait > 0:
+            return wait
+        heapq.heappop(self._queue)
+        self.requests.take(1)
+        self.tokens.take(ticket[2])
+        self._stats['admitted'] += 1
+        self._condition.notify_all()
+        return None
+
+    def _remove(self, ticket):
+        """Drop an abandoned ticket; caller holds the lock"""
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self._condition.notify_all()
+
+    def _wait_for(self, requests, tokens, single=True):
+        """
+        Seconds until the buckets have supplied this many requests and tokens; caller holds the lock
+
+        single is False when the amounts cover the calls queued ahead as well,
+        so the estimate grows with the queue instead of stopping at one refill.
+        """
+        now = self.clock()
+        return max(
+            self.paused_until - now,
+            self.requests.time_until(requests, now, single),
+            self.tokens.time_until(tokens, now, single)
+        )
+
+    def _waited(self, start):
+        waited = self.clock() - start
+        with self._condition:
+            self._stats['waited_seconds'] += waited
+        return waited
+
+
+class ScheduledProvider:
+    """
+    Wraps an LLM provider so every call first waits for quota.
+
+    The priority setting picks the queue position ('interactive' by default,
+    or 'background'). Quota errors from the upstream pause the scheduler.
+    Wrap each upstream provider rather than a router over several, so that
+    hedged copies and failovers are charged too; the wrapped provider must
+    make one upstream request per call.
+    """
+
+    def __init__(self, provider, scheduler, completion_tokens=DEFAULT_COMPLETION_TOKENS):
+        """
+        Wrap a provider
+
+        Args:
+            provider: Object with an async complete(prompt, **settings) method
+            scheduler: QuotaScheduler shared by every caller of the upstream
+            completion_tokens: Tokens reserved for each answer
+        """
+        self.provider = provider
+        self.scheduler = scheduler
+        self.completion_tokens = completion_tokens
+        self.model = getattr(provider, 'model', '')
+
+    async def complete(self, prompt, priority=None, **settings):
+        """Wait for quota, then call the wrapped provider"""
+        await self.scheduler.acquire_async(call_tokens(prompt, self.completion_tokens), priority_value(priority))
+        try:
+            return await self.provider.complete(prompt, **settings)
+        except Exception as e:
+            if is_quota_error(e):
+                self.scheduler.penalize(retry_after_seconds(e))
+            raise
+
+
+def call_tokens(prompt, completion_tokens=DEFAULT_COMPLETION_TOKENS):
+    """
+    Tokens a call is charged: the prompt plus the completion reserved
+
+    Args:
+        prompt: Prompt text, including any data summary
+        completion_tokens: Longest answer requested
+
+    Returns:
+        int: Tokens to charge against the per-minute quota
+    """
+    from chat_context import estimate_tokens
+    from openai_setup import SYSTEM_PROMPT
+
+    return estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(prompt) + completion_tokens
+
+
+def priority_value(priority):
+    """
+    Resolve a priority name to its value
+
+    Args:
+        priority: 'interactive', 'background', a number or None for interactive
+
+    Returns:
+        int: Priority value; lower is served first
+    """
+    if priority is None or priority == 'interactive':
+        return PRIORITY_INTERACTIVE
+    if priority == 'background':
+        return PRIORITY_BACKGROUND
+    return int(priority)
+
+
+def is_quota_error(error):
+    """
+    Whether an upstream error reports an exhausted quota
+
+    Args:
+        error: Exception raised by a provider
+
+    Returns:
+        bool: True for HTTP 429 and quota or rate limit messages
+    """
+    if getattr(error, 'status_code', None) == 429:
+        return True
+    message = str(error).lower()
+    return '429' in message or 'quota' in message or 'rate limit' in message
+
+
+def retry_after_seconds(error):
+    """
+    Seconds an upstream error asked the caller to wait
+
+    Args:
+        error: Exception raised by a provider, with a retry_after attribute
+            or an HTTP response carrying a Retry-After header
+
+    Returns:
+        float: Seconds, or None if the error does not say
+    """
+    value = getattr(error, 'retry_after', None)
+    if value is None:
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+        value = headers.get('Retry-After')
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+# Shared scheduler for every call to the upstream LLM
+llm_scheduler = QuotaScheduler()
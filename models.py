@@ -68,3 +68,14 @@ class ChatMessage(db.Model):
     is_user = db.Column(db.Boolean, default=True)  # True if message from user, False if from AI
     message = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class LedgerSnapshot(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('file_upload.id'), unique=True, nullable=False)
+    parent_file_id = db.Column(db.Integer, db.ForeignKey('file_upload.id'), nullable=True)  # Upload this one appends to
+    byte_length = db.Column(db.BigInteger, nullable=False)  # Bytes of the CSV covered by the aggregates
+    prefix_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of all the bytes covered
+    date_format = db.Column(db.String(20), nullable=True)
+    data = db.Column(db.Text, nullable=False)  # JSON aggregates without transaction rows
+    updated_date = db.Column(db.DateTime, default=datetime.utcnow)
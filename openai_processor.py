@@ -5,93 +5,285 @@ Alternative API for financial question answering
 
 import os
 import json
+import time
+import random
 import logging
-import requests
+import threading
+from collections import deque
 from datetime import datetime
 
+import requests
+from requests.adapters import HTTPAdapter
+
+from latency_metrics import latency_percentiles_ms
+from llm_cache import llm_cache
+from llm_scheduler import QuotaWaitTooLong, call_tokens, llm_scheduler, priority_value, retry_after_seconds
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('fintelligence.openai')
 
+# Endpoint and HTTP client settings; override with environment variables
+OPENAI_PROCESSOR_URL = os.environ.get('OPENAI_PROCESSOR_URL', "https://replit.com/.openai/v1/chat/completions")
+OPENAI_POOL_SIZE = int(os.environ.get('OPENAI_POOL_SIZE', 10))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get('OPENAI_CONNECT_TIMEOUT', 5))
+OPENAI_READ_TIMEOUT = float(os.environ.get('OPENAI_READ_TIMEOUT', 60))
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 3))
+OPENAI_BACKOFF_BASE = float(os.environ.get('OPENAI_BACKOFF_BASE', 0.5))
+OPENAI_BACKOFF_MAX = float(os.environ.get('OPENAI_BACKOFF_MAX', 8))
+
+# Responses worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Request latencies kept for the percentile metrics
+LATENCY_WINDOW = 1000
+
+# Sampling temperature used for chat answers
+DEFAULT_TEMPERATURE = 0.2
+
+SYSTEM_PROMPT = "You are a financial expert assistant. Provide clear, concise explanations about financial concepts and analysis. Always be accurate and helpful."
+
+
+class OpenAIRequestError(Exception):
+    """Raised when a chat completion fails after every retry"""
+    
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
 class OpenAIProcessor:
     """
     Class to handle OpenAI API calls as an alternative to Gemini
     This uses the free public Replit AI API endpoint, which doesn't require payment
+    
+    Requests go through one pooled keep-alive session, so consecutive
+    questions reuse open connections instead of repeating the TCP and TLS
+    handshakes. Every request has connect and read timeouts, and failed
+    attempts are retried a bounded number of times with jittered
+    exponential backoff. Each attempt, retries included, is admitted and
+    charged by the quota scheduler first.
     """
     
-    def __init__(self):
-        """Initialize the OpenAI processor"""
-        self.api_url = "https://replit.com/.openai/v1/chat/completions"
-        self.model = "gpt-3.5-turbo"  # Default model available in Replit
+    def __init__(self, api_url=None, model="gpt-3.5-turbo", pool_size=OPENAI_POOL_SIZE,
+                 connect_timeout=OPENAI_CONNECT_TIMEOUT, read_timeout=OPENAI_READ_TIMEOUT,
+                 max_retries=OPENAI_MAX_RETRIES, backoff_base=OPENAI_BACKOFF_BASE,
+                 backoff_max=OPENAI_BACKOFF_MAX, scheduler=llm_scheduler):
+        """
+        Initialize the OpenAI processor
+        
+        Args:
+            api_url (str, optional): Chat completions endpoint. Defaults to OPENAI_PROCESSOR_URL.
+            model (str): Model requested from the endpoint
+            pool_size (int): Connections kept open to the endpoint
+            connect_timeout (float): Seconds allowed to open a connection
+            read_timeout (float): Seconds allowed between bytes of the response
+            max_retries (int): Extra attempts after a failed request
+            backoff_base (float): Backoff before the first retry, doubled for each one
+            backoff_max (float): Longest backoff between attempts
+            scheduler (QuotaScheduler): Quota scheduler charged for every attempt
+        """
+        self.api_url = api_url or OPENAI_PROCESSOR_URL
+        self.model = model  # Default model available in Replit
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.scheduler = scheduler
+        
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+        
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._counters = {'requests': 0, 'attempts': 0, 'retries': 0, 'failures': 0}
         logger.info(f"Initialized OpenAI processor with model: {self.model}")
         
-    def get_response(self, prompt):
+    def get_response(self, prompt, data_fingerprint=None, use_cache=True):
         """
         Get a response from the OpenAI API
         
         Args:
             prompt (str): The prompt to send to the API
+            data_fingerprint (str, optional): Fingerprint of the financial data
+                the question is about, from llm_cache.data_fingerprint
+            use_cache (bool): Look the answer up in the LLM response cache
             
         Returns:
             str: The response from the API
         """
         try:
-            # Prepare the request
-            headers = {
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": self.model,
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are a financial expert assistant. Provide clear, concise explanations about financial concepts and analysis. Always be accurate and helpful."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "max_tokens": 1000,
-                "temperature": 0.2
-            }
-            
-            # Make the request
-            logger.info(f"Sending request to OpenAI API with prompt length: {len(prompt)}")
-            response = requests.post(self.api_url, headers=headers, json=data)
-            
-            # Check if the request was successful
-            if response.status_code == 200:
-                # Parse the response
-                response_data = response.json()
-                
-                # Extract the response text
-                if 'choices' in response_data and len(response_data['choices']) > 0:
-                    return response_data['choices'][0]['message']['content']
-                else:
-                    logger.error(f"No choices in response: {response_data}")
-                    return "I'm sorry, but I couldn't generate a response at this time."
-            else:
-                logger.error(f"Error calling OpenAI API: {response.status_code} - {response.text}")
-                return f"I encountered an error processing your question. Please try again later."
-                
+            if use_cache:
+                # Only successful answers reach the cache; errors raise past it
+                return llm_cache.get_or_compute(
+                    prompt, self.model, DEFAULT_TEMPERATURE,
+                    lambda: self.request_completion(prompt),
+                    data_fingerprint=data_fingerprint
+                )
+            return self.request_completion(prompt)
+        except QuotaWaitTooLong as e:
+            logger.warning(f"OpenAI API request not sent: {str(e)}")
+            return f"The assistant is busy right now. Please try again in about {e.wait_seconds:.0f} seconds."
+        except OpenAIRequestError as e:
+            logger.error(f"Error calling OpenAI API: {str(e)}")
+            if e.status_code == 200:
+                return "I'm sorry, but I couldn't generate a response at this time."
+            return f"I encountered an error processing your question. Please try again later."
         except Exception as e:
             logger.error(f"Exception when calling OpenAI API: {str(e)}")
             return f"I'm sorry, but I encountered a technical issue. Please try again later."
+    
+    def request_completion(self, prompt, max_tokens=1000, temperature=DEFAULT_TEMPERATURE, priority=None):
+        """
+        Request a chat completion, retrying transient failures
+        
+        Every attempt waits for the quota scheduler first. A 429 response
+        pauses the scheduler for the Retry-After the endpoint sent, so its
+        retry waits for quota instead of a backoff of its own.
+        
+        Args:
+            prompt (str): The prompt to send to the API
+            max_tokens (int): Longest response requested
+            temperature (float): Sampling temperature
+            priority (str, optional): Quota priority, 'interactive' (default) or 'background'
+            
+        Returns:
+            str: The response text
+            
+        Raises:
+            OpenAIRequestError: If every attempt fails or the response has no choices
+            QuotaWaitTooLong: If an attempt would wait too long for quota
+        """
+        data = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+        
+        logger.info(f"Sending request to OpenAI API with prompt length: {len(prompt)}")
+        self._count('requests')
+        tokens = call_tokens(prompt, max_tokens)
+        attempt = 0
+        while True:
+            self.scheduler.acquire(tokens, priority_value(priority))
+            self._count('attempts')
+            start = time.perf_counter()
+            retry_after = None
+            try:
+                response = self.session.post(self.api_url, json=data, timeout=self.timeout)
+                error = None
+                if response.status_code != 200:
+                    error = OpenAIRequestError(
+                        f"{response.status_code} - {response.text[:500]}", status_code=response.status_code
+                    )
+                    retryable = response.status_code in RETRY_STATUS_CODES
+                    retry_after = response.headers.get('Retry-After')
+                    error.retry_after = retry_after
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = OpenAIRequestError(f"{type(e).__name__}: {str(e)}")
+                retryable = True
+            finally:
+                self._record_latency(time.perf_counter() - start)
+            
+            if error is None:
+                break
+            if error.status_code == 429:
+                # The scheduler holds every caller, this retry included, until the quota is back
+                self.scheduler.penalize(retry_after_seconds(error))
+            if not retryable or attempt >= self.max_retries:
+                self._count('failures')
+                raise error
+            
+            delay = 0.0 if error.status_code == 429 else self._backoff(attempt, retry_after)
+            attempt += 1
+            self._count('retries')
+            logger.warning(f"OpenAI API attempt {attempt} failed ({str(error)[:100]}); retrying in {delay:.2f}s")
+            time.sleep(delay)
+        
+        # Parse the response
+        try:
+            response_data = response.json()
+        except ValueError:
+            self._count('failures')
+            raise OpenAIRequestError("Response is not valid JSON", status_code=200)
+        
+        # Extract the response text
+        if 'choices' in response_data and len(response_data['choices']) > 0:
+            return response_data['choices'][0]['message']['content']
+        self._count('failures')
+        raise OpenAIRequestError(f"No choices in response: {response_data}", status_code=200)
+    
+    def metrics(self):
+        """
+        Report request counters, latency percentiles and connection pool usage
+        
+        Returns:
+            dict: Counters, latency in milliseconds over the last
+                LATENCY_WINDOW attempts, and pool size and connections
+        """
+        with self._lock:
+            metrics = dict(self._counters)
+            latencies = list(self._latencies)
+        
+        metrics['latency_ms'] = latency_percentiles_ms(latencies)
+        metrics['latency_ms']['max'] = max(latencies) * 1000 if latencies else None
+        
+        opened = idle = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                # The queue holds None placeholders for connections not yet opened
+                idle += sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0
+        metrics['pool'] = {'size': self.pool_size, 'connections_opened': opened, 'idle': idle}
+        return metrics
+    
+    def close(self):
+        """Close the pooled connections"""
+        self.session.close()
+    
+    def _backoff(self, attempt, retry_after=None):
+        """Seconds to wait before the next attempt: full jitter, or the server's Retry-After"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+    
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+    
+    def _record_latency(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
             
 # Create an instance of the OpenAI processor
 openai_processor = OpenAIProcessor()
 
-def get_openai_response(prompt):
+def get_openai_response(prompt, data_fingerprint=None, use_cache=True):
     """
     Get a response from the OpenAI API
     
     Args:
         prompt (str): The prompt to send to the API
+        data_fingerprint (str, optional): Fingerprint of the financial data the
+            question is about
+        use_cache (bool): Look the answer up in the LLM response cache
         
     Returns:
         str: The response from the API
     """
-    return openai_processor.get_response(prompt)
\ No newline at end of file
+    return openai_processor.get_response(prompt, data_fingerprint=data_fingerprint, use_cache=use_cache)
\ No newline at end of file
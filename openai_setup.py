@@ -5,52 +5,79 @@ Uses the official OpenAI API for more reliable responses
 
 import os
 import json
+import time
 import logging
 from openai import OpenAI
 
+from llm_cache import llm_cache
+from llm_scheduler import call_tokens, is_quota_error, llm_scheduler, retry_after_seconds
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('fintelligence.openai_official')
 
+# Model settings; answers are cached per model and temperature
+OPENAI_MODEL = "gpt-3.5-turbo"  # Using 3.5 for cost efficiency, can be upgraded to gpt-4
+OPENAI_TEMPERATURE = 0.2
+
+SYSTEM_PROMPT = "You are a financial expert assistant. Provide clear, concise explanations about financial concepts and analysis. Always be accurate and helpful."
+
 # Initialize the OpenAI client with the API key
 openai_api_key = os.environ.get("OPENAI_API_KEY")
 if openai_api_key:
     # Only show first 4 and last 4 characters for security
     visible_key = f"{openai_api_key[:4]}...{openai_api_key[-4:]}" if len(openai_api_key) > 8 else "****"
     logger.info(f"Using OpenAI API key: {visible_key} (length: {len(openai_api_key)})")
-    client = OpenAI(api_key=openai_api_key)
+    # Retries are left to the quota scheduler, which charges every attempt
+    client = OpenAI(api_key=openai_api_key, max_retries=0)
     logger.info("Successfully initialized OpenAI client")
 else:
     logger.warning("OPENAI_API_KEY environment variable not set")
     client = None
 
-def get_openai_response(prompt):
+def get_openai_response(prompt, data_fingerprint=None, use_cache=True):
     """
     Get a response from the OpenAI API using the official client
     
+    Answers are cached by normalized prompt, model, temperature and data
+    fingerprint (see llm_cache), so repeated questions skip the API.
+    
     Args:
         prompt (str): The prompt to send to the API
+        data_fingerprint (str, optional): Fingerprint of the financial data the
+            question is about, from llm_cache.data_fingerprint
+        use_cache (bool): Look the answer up in the LLM response cache
         
     Returns:
         str: The response from the API
+        
+    Raises:
+        QuotaWaitTooLong: If a cache miss would wait too long for the API quota
     """
     if not client:
         logger.warning("OpenAI client not initialized. Check your API key.")
         return None
+    
+    if use_cache:
+        return llm_cache.get_or_compute(
+            prompt, OPENAI_MODEL, OPENAI_TEMPERATURE,
+            lambda: llm_scheduler.run(prompt, lambda: get_openai_response(prompt, use_cache=False)),
+            data_fingerprint=data_fingerprint
+        )
         
     try:
         # Call the OpenAI API
         logger.info(f"Sending request to OpenAI API with prompt length: {len(prompt)}")
         
         response = client.chat.completions.create(
-            model="gpt-3.5-turbo",  # Using 3.5 for cost efficiency, can be upgraded to gpt-4
+            model=OPENAI_MODEL,
             messages=[
-                {"role": "system", "content": "You are a financial expert assistant. Provide clear, concise explanations about financial concepts and analysis. Always be accurate and helpful."},
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
             max_tokens=1000,
-            temperature=0.2
+            temperature=OPENAI_TEMPERATURE
         )
         
         # Extract the response text
@@ -63,4 +90,83 @@ def get_openai_response(prompt):
         
     except Exception as e:
         logger.error(f"Error calling OpenAI API: {str(e)}")
-        return None
\ No newline at end of file
+        if is_quota_error(e):
+            llm_scheduler.penalize(retry_after_seconds(e))
+        return None
+
+def stream_openai_response(prompt, data_fingerprint=None, use_cache=True):
+    """
+    Stream a response from the OpenAI API as it is generated
+    
+    A cached answer is yielded whole. Otherwise the completion is requested
+    with stream=True and each text delta is yielded as soon as it arrives;
+    the complete answer is cached at the end.
+    
+    Args:
+        prompt (str): The prompt to send to the API
+        data_fingerprint (str, optional): Fingerprint of the financial data the
+            question is about, from llm_cache.data_fingerprint
+        use_cache (bool): Look the answer up in and store it in the LLM response cache
+        
+    Yields:
+        str: Consecutive pieces of the response; nothing if the API is unavailable
+            or fails before the first piece
+        
+    Raises:
+        QuotaWaitTooLong: If a cache miss would wait too long for the API quota
+        Exception: The API error, if the stream breaks off after pieces were yielded
+    """
+    if not client:
+        logger.warning("OpenAI client not initialized. Check your API key.")
+        return
+    
+    cache_key = llm_cache.key_for(prompt, OPENAI_MODEL, OPENAI_TEMPERATURE, data_fingerprint) if use_cache else None
+    if cache_key:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            logger.info("LLM cache hit")
+            yield cached
+            return
+    
+    # Wait for quota before the first byte; raises QuotaWaitTooLong if it would take too long
+    llm_scheduler.acquire(call_tokens(prompt))
+    
+    pieces = []
+    start = time.perf_counter()
+    try:
+        logger.info(f"Streaming request to OpenAI API with prompt length: {len(prompt)}")
+        stream = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=1000,
+            temperature=OPENAI_TEMPERATURE,
+            stream=True
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if not pieces:
+                    logger.info(f"First token from OpenAI API after {(time.perf_counter() - start) * 1000:.0f} ms")
+                pieces.append(delta)
+                yield delta
+    except Exception as e:
+        logger.error(f"Error streaming from OpenAI API: {str(e)}")
+        if is_quota_error(e):
+            llm_scheduler.penalize(retry_after_seconds(e))
+        if pieces:
+            # The caller already has part of an answer; it must not pass for the whole one
+            raise
+        return
+    
+    response_text = "".join(pieces)
+    logger.info(f"Streamed response from OpenAI API of length: {len(response_text)}")
+    if cache_key and response_text:
+        try:
+            llm_cache.put(cache_key, response_text, OPENAI_MODEL, (time.perf_counter() - start) * 1000)
+        except Exception as e:
+            logger.warning(f"Could not cache LLM response: {str(e)}")
@@ -0,0 +1,180 @@
+"""
+Parallel Ingestion
+Aggregates large CSV files across a process pool by splitting them on line boundaries
+"""
+
+import io
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from compressed_files import detect_compression, open_csv_source
+from financial_data_processor import (
+    STREAMING_CHUNK_ROWS,
+    aggregate_frames,
+    aggregate_ledger_frame,
+    detect_date_format,
+    merge_financial_data,
+)
+
+logger = logging.getLogger('fintelligence')
+
+# Worker processes used when none are requested; defaults to one per CPU core
+DEFAULT_INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 0)) or os.cpu_count() or 1
+
+# Files smaller than this are aggregated in a single process
+MIN_PARALLEL_BYTES = 8 * 1024 * 1024
+
+
+def analyze_csv_parallel(file_path, workers=None, keep_transactions=False):
+    """
+    Analyze a CSV file by aggregating line-aligned byte ranges in parallel.
+
+    Each worker parses its own range and returns partial aggregates, which are
+    merged in file order so the result matches the serial analyze_csv_data.
+    The date format is detected once from the head of the file and shared by
+    every worker. Ranges are cut at newlines, so quoted fields must not
+    contain line breaks. Compressed files cannot be split by byte offset and
+    are aggregated in a single streaming pass instead.
+
+    Args:
+        file_path: Path to the CSV file
+        workers: Number of worker processes, DEFAULT_INGEST_WORKERS if None
+        keep_transactions: Also return the transaction table and bucket rows
+
+    Returns:
+        dict: Structured financial data for reports
+    """
+    try:
+        workers = workers or DEFAULT_INGEST_WORKERS
+
+        if detect_compression(file_path):
+            with open_csv_source(file_path) as source:
+                try:
+                    chunks = pd.read_csv(source, dtype=str, keep_default_na=False, encoding='utf-8',
+                                         chunksize=STREAMING_CHUNK_ROWS)
+                    financial_data = aggregate_frames(chunks, keep_transactions=keep_transactions)
+                except pd.errors.EmptyDataError:
+                    financial_data = None
+            if financial_data is None:
+                logger.error(f"No data found in CSV file: {file_path}")
+            elif not keep_transactions:
+                financial_data['transactions_path'] = file_path
+            return financial_data
+
+        try:
+            head = pd.read_csv(file_path, dtype=str, keep_default_na=False, encoding='utf-8',
+                               nrows=STREAMING_CHUNK_ROWS)
+        except pd.errors.EmptyDataError:
+            head = pd.DataFrame()
+
+        if head.empty:
+            logger.error(f"No data found in CSV file: {file_path}")
+            return None
+
+        columns = list(head.columns)
+        date_format = detect_date_format(head['Date']) if 'Date' in head.columns else None
+
+        file_size = os.path.getsize(file_path)
+        if file_size < MIN_PARALLEL_BYTES:
+            workers = 1
+        byte_ranges = split_byte_ranges(file_path, workers)
+        logger.info(f"Aggregating {file_path} in {len(byte_ranges)} ranges with {workers} workers")
+
+        tasks = [(file_path, start, end, columns, date_format, keep_transactions) for start, end in byte_ranges]
+        if workers == 1:
+            partials = [_aggregate_range(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                partials = list(pool.map(_aggregate_range, *zip(*tasks)))
+
+        financial_data = None
+        for partial in partials:
+            if partial is None:
+                continue
+            if financial_data is None:
+                financial_data = partial
+            else:
+                merge_financial_data(financial_data, partial)
+
+        if financial_data is not None and not keep_transactions:
+            financial_data['transactions_path'] = file_path
+        return financial_data
+
+    except Exception as e:
+        logger.error(f"Error analyzing CSV data in parallel: {str(e)}")
+        return None
+
+
+def split_byte_ranges(file_path, parts):
+    """
+    Split the data rows of a CSV file into byte ranges that start and end on
+    line boundaries
+
+    Args:
+        file_path: Path to the CSV file
+        parts: Number of ranges wanted
+
+    Returns:
+        list: (start, end) byte offsets covering every row after the header
+    """
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as csv_file:
+        csv_file.readline()
+        data_start = csv_file.tell()
+
+        boundaries = [data_start]
+        step = max(1, (file_size - data_start) // max(1, parts))
+        for index in range(1, parts):
+            csv_file.seek(max(data_start + index * step - 1, boundaries[-1]))
+            csv_file.readline()
+            boundary = csv_file.tell()
+            if boundary >= file_size:
+                break
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+        boundaries.append(file_size)
+
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+
+class _ByteRangeReader(io.RawIOBase):
+    """Raw reader that stops at the end of a byte range"""
+
+    def __init__(self, raw_file, end):
+        self._file = raw_file
+        self._end = end
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        remaining = self._end - self._file.tell()
+        if remaining <= 0:
+            return 0
+        data = self._file.read(min(len(buffer), remaining))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _aggregate_range(file_path, start, end, columns, date_format, keep_transactions):
+    """Aggregate the rows in one byte range of a CSV file"""
+    financial_data = None
+    with open(file_path, 'rb') as raw_file:
+        raw_file.seek(start)
+        reader = io.BufferedReader(_ByteRangeReader(raw_file, end))
+        try:
+            chunks = pd.read_csv(reader, header=None, names=columns, dtype=str, keep_default_na=False,
+                                 encoding='utf-8', chunksize=STREAMING_CHUNK_ROWS)
+            for chunk in chunks:
+                partial = aggregate_ledger_frame(chunk, keep_transactions=keep_transactions,
+                                                 date_format=date_format)
+                if financial_data is None:
+                    financial_data = partial
+                else:
+                    merge_financial_data(financial_data, partial)
+        except pd.errors.EmptyDataError:
+            pass
+    return financial_data
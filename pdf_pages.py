@@ -0,0 +1,166 @@
+"""
+PDF Pages
+Extracts PDF page text across a process pool, yielding pages in order and caching each one by file hash
+"""
+
+import os
+import logging
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import PyPDF2
+
+from result_cache import file_sha256
+
+logger = logging.getLogger('fintelligence')
+
+# Directory holding extracted page text, one subdirectory per file hash
+PDF_PAGE_CACHE_DIR = os.environ.get(
+    'PDF_PAGE_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'pdf_pages')
+)
+
+# Worker processes used when none are requested; defaults to one per CPU core
+DEFAULT_PDF_WORKERS = int(os.environ.get('PDF_WORKERS', 0)) or os.cpu_count() or 1
+
+# Pages extracted by one worker task
+PDF_PAGES_PER_TASK = 8
+
+# Documents with fewer uncached pages than this are extracted in-process
+MIN_PARALLEL_PAGES = 16
+
+
+def count_pdf_pages(file_path):
+    """
+    Count the pages of a PDF file
+
+    Args:
+        file_path: Path to the PDF file
+
+    Returns:
+        int: Number of pages
+    """
+    with open(file_path, 'rb') as pdf_file:
+        return len(PyPDF2.PdfReader(pdf_file).pages)
+
+
+def iter_pdf_pages(file_path, workers=None, use_cache=True):
+    """
+    Yield the text of every page of a PDF file, in page order, as it is extracted.
+
+    Pages already in the page cache are read back instead of being extracted
+    again. The rest are split into runs of PDF_PAGES_PER_TASK pages and
+    extracted across a process pool; at most two runs per worker are in flight,
+    so memory stays bounded however long the document is.
+
+    Args:
+        file_path: Path to the PDF file
+        workers: Number of worker processes, DEFAULT_PDF_WORKERS if None
+        use_cache: Read and store page text in the page cache
+
+    Yields:
+        tuple: (page number starting at 0, page text)
+    """
+    num_pages = count_pdf_pages(file_path)
+    cache_dir = os.path.join(PDF_PAGE_CACHE_DIR, file_sha256(file_path)) if use_cache else None
+
+    # Consecutive runs of pages that still need extracting
+    cached = set()
+    if cache_dir and os.path.isdir(cache_dir):
+        cached = {page for page in range(num_pages) if os.path.exists(_page_path(cache_dir, page))}
+    missing = [page for page in range(num_pages) if page not in cached]
+    runs = _page_runs(missing, PDF_PAGES_PER_TASK)
+
+    workers = workers or DEFAULT_PDF_WORKERS
+    if len(missing) < MIN_PARALLEL_PAGES:
+        workers = 1
+    if missing:
+        logger.info(f"Extracting {len(missing)} of {num_pages} PDF pages from {file_path} with {workers} workers")
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    pending = deque()
+    submitted = 0
+
+    def submit_runs():
+        # Keep up to two runs per worker queued ahead of the page being yielded
+        nonlocal submitted
+        while pool is not None and len(pending) < workers * 2 and submitted < len(runs):
+            start, end = runs[submitted]
+            pending.append((start, pool.submit(_extract_page_range, file_path, start, end)))
+            submitted += 1
+
+    try:
+        submit_runs()
+        page = 0
+        while page < num_pages:
+            if page in cached:
+                text = _read_page(cache_dir, page)
+                if text is None:
+                    # Unreadable cache entry; extract the page again
+                    text = _extract_page_range(file_path, page, page + 1)[0]
+                    _write_page(cache_dir, page, text)
+                yield page, text
+                page += 1
+                continue
+
+            if pool is None:
+                start, end = runs[submitted]
+                submitted += 1
+                texts = _extract_page_range(file_path, start, end)
+            else:
+                start, future = pending.popleft()
+                submit_runs()
+                texts = future.result()
+
+            for offset, text in enumerate(texts):
+                if cache_dir:
+                    _write_page(cache_dir, start + offset, text)
+                yield start + offset, text
+            page = start + len(texts)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def _page_runs(pages, size):
+    """Group sorted page numbers into consecutive (start, end) runs of at most size pages"""
+    runs = []
+    for page in pages:
+        if runs and runs[-1][1] == page and runs[-1][1] - runs[-1][0] < size:
+            runs[-1] = (runs[-1][0], page + 1)
+        else:
+            runs.append((page, page + 1))
+    return runs
+
+
+def _extract_page_range(file_path, start, end):
+    """Extract the text of pages start to end - 1"""
+    with open(file_path, 'rb') as pdf_file:
+        pdf_reader = PyPDF2.PdfReader(pdf_file)
+        return [pdf_reader.pages[page].extract_text() or '' for page in range(start, end)]
+
+
+def _page_path(cache_dir, page):
+    return os.path.join(cache_dir, f"{page:06d}.txt")
+
+
+def _read_page(cache_dir, page):
+    """Return cached page text, or None if it cannot be read"""
+    try:
+        with open(_page_path(cache_dir, page), 'r', encoding='utf-8', newline='') as page_file:
+            return page_file.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def _write_page(cache_dir, page, text):
+    """Store page text atomically, logging rather than failing on errors"""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(handle, 'w', encoding='utf-8', newline='') as page_file:
+            page_file.write(text)
+        os.replace(temp_path, _page_path(cache_dir, page))
+    except OSError as e:
+        logger.warning(f"Could not cache PDF page {page}: {str(e)}")
@@ -0,0 +1,304 @@
+"""
+PDF Statements
+Turns the text of PDF statement pages into the Date/Account/Category/Description/Amount/Type rows of a CSV ledger
+"""
+
+import re
+import logging
+from datetime import datetime
+
+import pandas as pd
+
+from pdf_pages import iter_pdf_pages
+
+logger = logging.getLogger('fintelligence')
+
+# Columns of the rows produced, matching an uploaded CSV ledger
+STATEMENT_COLUMNS = ('Date', 'Account', 'Category', 'Description', 'Amount', 'Type')
+
+# Rows per DataFrame yielded by iter_pdf_frames
+PDF_FRAME_ROWS = 10000
+
+# Account and category used when the statement does not name one
+DEFAULT_ACCOUNT = 'Statement'
+DEFAULT_CATEGORY = 'Uncategorized'
+
+# Header words recognised as table columns
+HEADER_ALIASES = {
+    'date': 'Date', 'posted': 'Date', 'posting date': 'Date', 'transaction date': 'Date', 'value date': 'Date',
+    'account': 'Account',
+    'category': 'Category',
+    'description': 'Description', 'details': 'Description', 'memo': 'Description',
+    'narration': 'Description', 'particulars': 'Description', 'payee': 'Description',
+    'amount': 'Amount',
+    'debit': 'Debit', 'debits': 'Debit', 'withdrawal': 'Debit', 'withdrawals': 'Debit', 'paid out': 'Debit',
+    'credit': 'Credit', 'credits': 'Credit', 'deposit': 'Credit', 'deposits': 'Credit', 'paid in': 'Credit',
+    'type': 'Type',
+    'balance': 'Balance',
+}
+
+# Words that state a row's type outright
+TYPE_WORDS = {
+    'income': 'Income', 'credit': 'Income', 'deposit': 'Income', 'cr': 'Income',
+    'expense': 'Expense', 'debit': 'Expense', 'withdrawal': 'Expense', 'dr': 'Expense',
+}
+
+# Header columns an amount can sit under, and the type implied by the separate money-out and money-in ones
+AMOUNT_COLUMNS = ('Amount', 'Debit', 'Credit')
+COLUMN_TYPES = {'Debit': 'Expense', 'Credit': 'Income'}
+
+# Month-name dates are rewritten as ISO dates; numeric dates are kept as
+# printed so the ledger's day/month order is detected across the whole file
+TEXT_DATE_FORMATS = ('%b %d, %Y', '%b %d %Y', '%B %d, %Y', '%B %d %Y', '%d %b %Y', '%d %B %Y', '%d-%b-%Y', '%d-%b-%y')
+
+_DATE_PATTERN = re.compile(
+    r'^\s*(\d{4}-\d{1,2}-\d{1,2}|\d{1,2}/\d{1,2}/\d{4}'
+    r'|[A-Za-z]{3,9}\.? \d{1,2},? \d{4}|\d{1,2}[ -][A-Za-z]{3,9}[ -]\d{2,4})\b'
+)
+_AMOUNT_PATTERN = re.compile(
+    r'^(?P<open>\()?(?P<sign>[-+])?[$€£]?(?P<number>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)(?P<close>\))?$'
+)
+_ACCOUNT_PATTERN = re.compile(r'^\s*account(?: name)?\s*[:#-]\s*(?P<name>.+?)\s*$', re.IGNORECASE)
+_SUMMARY_PATTERN = re.compile(
+    r'\b(?:opening|closing|beginning|ending|previous|new|available)\s+balance\b'
+    r'|\bbalance\s+(?:forward|brought|carried)\b|^(?:sub)?totals?\b',
+    re.IGNORECASE
+)
+_FIELD_SEPARATOR = re.compile(r'\t|\s{2,}|\s*\|\s*')
+
+
+class StatementParser:
+    """
+    Extracts ledger rows from statement text one page at a time.
+
+    A row is a line that starts with a date and ends with an amount. The most
+    recent table header tells which columns the line holds and whether a
+    running balance follows the amount; it carries over to later pages, as
+    does the account named by an 'Account:' line. When cells are separated by
+    tabs, pipes or runs of spaces they are mapped onto the header, otherwise
+    the text between the date and the amount is the description.
+
+    A row's type comes from an explicit type word (Income, Expense, Debit,
+    Credit, DR, CR), then the sign of the amount (minus or parentheses mean
+    expense), then the header column the amount is printed under when the
+    table has separate Debit and Credit (or Withdrawal and Deposit) columns,
+    then the movement of the running balance; unsigned amounts with no other
+    hint count as income. As in the CSV ledgers, expense
+    amounts are negative and income amounts positive, whatever sign the
+    statement printed.
+    """
+
+    def __init__(self, account=DEFAULT_ACCOUNT):
+        """
+        Start a parser for one document
+
+        Args:
+            account: Account used until the statement names one
+        """
+        self.account = account
+        self.header = None
+        self.balance = None
+        self.rows = 0
+
+    def parse_page(self, text):
+        """
+        Extract the rows on one page
+
+        Args:
+            text: Page text
+
+        Returns:
+            list: One dict per row, keyed by STATEMENT_COLUMNS
+        """
+        rows = []
+        for line in (text or '').splitlines():
+            line = line.strip()
+            if not line:
+                continue
+
+            match = _DATE_PATTERN.match(line)
+            if match is None:
+                self._parse_context(line)
+                continue
+
+            row = self._parse_row(match.group(1), line[match.end():], match.end())
+            if row is not None:
+                rows.append(row)
+
+        self.rows += len(rows)
+        return rows
+
+    def _parse_context(self, line):
+        """Pick up a table header or account name from a non-row line"""
+        account = _ACCOUNT_PATTERN.match(line)
+        if account:
+            self.account = account.group('name')
+            self.balance = None
+            return
+
+        header = _header_columns(line)
+        if header and 'Date' in header and any(column in header for column in AMOUNT_COLUMNS):
+            self.header = header
+            self.balance = None
+
+    def _parse_row(self, date_text, rest, offset=0):
+        """Build a row from the text after a leading date, found at offset in the line, or None if it has no amount"""
+        spans = [(token.start() + offset, token.end() + offset) for token in re.finditer(r'\S+', rest)]
+        tokens = rest.split()
+        type_word = None
+        if tokens and tokens[-1].lower() in TYPE_WORDS:
+            type_word = TYPE_WORDS[tokens.pop().lower()]
+
+        # Trailing numbers: the amount, then a running balance if the table has one
+        amounts = []
+        while tokens and len(amounts) < 2:
+            amount = _parse_amount(tokens[-1])
+            if amount is None:
+                break
+            amounts.insert(0, amount)
+            tokens.pop()
+        if not amounts:
+            return None
+        if tokens and type_word is None and tokens[-1].lower() in TYPE_WORDS:
+            # A type word just before the amount, e.g. 'ATM withdrawal 40.00'
+            type_word = TYPE_WORDS[tokens[-1].lower()]
+
+        has_balance = self.header is not None and 'Balance' in self.header
+        if len(amounts) == 2 and not has_balance:
+            # The first number belongs to the description, e.g. an invoice number
+            tokens.append(rest.split()[len(tokens)])
+            amounts = amounts[1:]
+        amount = amounts[0]
+        balance = amounts[1] if len(amounts) == 2 else None
+        amount_span = spans[len(tokens)]
+
+        if _SUMMARY_PATTERN.search(' '.join(tokens)):
+            # Opening and closing balance lines carry the balance, not a transaction
+            self.balance = amounts[-1]
+            return None
+
+        if type_word is None:
+            column = self._amount_column(amount_span)
+            if amount < 0:
+                type_word = 'Expense'
+            elif column in COLUMN_TYPES:
+                type_word = COLUMN_TYPES[column]
+            elif balance is not None and self.balance is not None:
+                type_word = 'Income' if balance > self.balance else 'Expense'
+            else:
+                type_word = 'Income'
+        # Give every row the sign a ledger export would print
+        amount = -abs(amount) if type_word == 'Expense' else abs(amount)
+        if balance is not None:
+            self.balance = balance
+
+        fields = self._fields(' '.join(tokens), rest)
+        return {
+            'Date': _normalize_date(date_text),
+            'Account': fields.get('Account') or self.account,
+            'Category': fields.get('Category') or DEFAULT_CATEGORY,
+            'Description': fields.get('Description', ''),
+            'Amount': _format_amount(amount),
+            'Type': type_word,
+        }
+
+    def _amount_column(self, span):
+        """Name the header's amount column nearest to where an amount is printed on its line"""
+        candidates = [(column, start, end) for column, (start, end) in (self.header or {}).items()
+                      if column in AMOUNT_COLUMNS]
+        if not candidates:
+            return None
+        column, _, _ = min(candidates, key=lambda found: max(found[1] - span[1], span[0] - found[2], 0))
+        return column
+
+    def _fields(self, middle, rest):
+        """Map the text between the date and the amount onto the header's text columns"""
+        columns = [column for column in (self.header or ()) if column in ('Account', 'Category', 'Description')]
+        cells = [cell for cell in _FIELD_SEPARATOR.split(rest.strip()) if cell]
+        if len(columns) > 1 and len(cells) > len(columns):
+            # Cells are separated on the line; keep the text ones in header order
+            return dict(zip(columns, cells[:len(columns)]))
+        return {'Description': middle.strip()}
+
+
+def iter_statement_rows(pages, account=DEFAULT_ACCOUNT):
+    """
+    Extract ledger rows from a stream of page texts
+
+    Args:
+        pages: Iterable of (page number, text), as yielded by iter_pdf_pages
+        account: Account used until the statement names one
+
+    Yields:
+        dict: One row per transaction, keyed by STATEMENT_COLUMNS
+    """
+    parser = StatementParser(account)
+    for _, text in pages:
+        yield from parser.parse_page(text)
+
+
+def iter_pdf_frames(file_path, chunk_size=PDF_FRAME_ROWS, workers=None):
+    """
+    Stream the statement rows of a PDF file as string-typed DataFrames
+
+    Args:
+        file_path: Path to the PDF file
+        chunk_size: Rows per DataFrame
+        workers: Number of page extraction processes
+
+    Yields:
+        DataFrame: Consecutive rows with STATEMENT_COLUMNS
+    """
+    chunk = []
+    for row in iter_statement_rows(iter_pdf_pages(file_path, workers=workers)):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield pd.DataFrame(chunk, columns=list(STATEMENT_COLUMNS))
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=list(STATEMENT_COLUMNS))
+
+
+def _header_columns(line):
+    """Return the columns named by a header line in order, with their (start, end) positions, or None"""
+    # Replaced character for character so positions still match the line
+    text = ' ' + re.sub(r'[^a-z ]', ' ', line.lower()) + ' '
+    found = []
+    for alias, column in HEADER_ALIASES.items():
+        position = text.find(f' {alias} ')
+        if position >= 0:
+            found.append((position, position + len(alias), column))
+    columns = {}
+    for start, end, column in sorted(found):
+        if column not in columns:
+            columns[column] = (start, end)
+    return columns or None
+
+
+def _parse_amount(token):
+    """Parse an amount token such as 1,234.50, -$12.00 or (45.00); None if it is not one"""
+    match = _AMOUNT_PATTERN.match(token)
+    if match is None or bool(match.group('open')) != bool(match.group('close')):
+        return None
+    amount = float(match.group('number').replace(',', ''))
+    if match.group('sign') == '-' or match.group('open'):
+        amount = -amount
+    return amount
+
+
+def _format_amount(amount):
+    """Format an amount the way a CSV ledger prints it"""
+    return str(int(amount)) if amount == int(amount) else f"{amount:.2f}"
+
+
+def _normalize_date(date_text):
+    """Rewrite month-name dates as ISO dates, keeping numeric dates as printed"""
+    if date_text[0].isdigit() and not any(char.isalpha() for char in date_text):
+        return date_text
+    cleaned = date_text.replace('.', '')
+    for date_format in TEXT_DATE_FORMATS:
+        try:
+            return datetime.strptime(cleaned, date_format).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return date_text
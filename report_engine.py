@@ -0,0 +1,65 @@
+"""
+Report Engine
+Generates every financial statement for a file in one call, sharing a single classification pass
+"""
+
+import time
+import logging
+
+from financial_data_processor import (
+    classify_ledger,
+    generate_balance_sheet,
+    generate_cash_flow,
+    generate_financial_analysis,
+    generate_income_statement,
+)
+
+logger = logging.getLogger('fintelligence')
+
+# Report types in the order they are generated, keyed as Report.report_type
+REPORT_GENERATORS = (
+    ('balance_sheet', generate_balance_sheet),
+    ('income_statement', generate_income_statement),
+    ('cash_flow', generate_cash_flow),
+    ('analysis', generate_financial_analysis),
+)
+
+
+def generate_all_reports(financial_data):
+    """
+    Generate the balance sheet, income statement, cash flow statement and
+    financial analysis together.
+
+    Every account and category is classified once and the result is shared by
+    all four generators, so producing all reports costs about as much as
+    producing one.
+
+    Args:
+        financial_data: Structured financial data
+
+    Returns:
+        dict: One report per type in REPORT_GENERATORS, plus 'timings' with
+            the milliseconds spent classifying and on each statement
+    """
+    if not financial_data:
+        logger.error("No financial data provided for report generation")
+        return None
+
+    timings = {}
+    start = time.perf_counter()
+    classification = classify_ledger(financial_data)
+    timings['classification'] = (time.perf_counter() - start) * 1000
+
+    reports = {}
+    for report_type, generator in REPORT_GENERATORS:
+        start = time.perf_counter()
+        reports[report_type] = generator(financial_data, classification=classification)
+        timings[report_type] = (time.perf_counter() - start) * 1000
+
+    timings['total'] = sum(timings.values())
+    logger.info("Generated all reports in {:.1f} ms ({})".format(
+        timings['total'], ", ".join(f"{name}: {value:.1f} ms" for name, value in timings.items() if name != 'total')
+    ))
+
+    reports['timings'] = timings
+    return reports
@@ -0,0 +1,232 @@
+"""
+Result Cache
+Content-addressed cache of processed upload results, keyed on the SHA-256 of the file bytes
+"""
+
+import os
+import pickle
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('fintelligence')
+
+# Bump whenever parsing or aggregation output changes, so stale entries stop matching
+PROCESSOR_VERSION = '2'
+
+# Directory holding cached results and the total size it may grow to
+RESULT_CACHE_DIR = os.environ.get(
+    'RESULT_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'result_cache')
+)
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_MB', 512)) * 1024 * 1024
+
+# Bytes read at a time while hashing a file
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Content hashes remembered in memory, by file path, size and modification time
+HASH_MEMORY_ENTRIES = 16
+
+
+def file_sha256(file_path):
+    """
+    Compute the SHA-256 of a file without loading it into memory
+
+    Args:
+        file_path: Path to the file
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as source:
+        for block in iter(lambda: source.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of structured results stored as pickles on disk.
+
+    Entries are keyed on the content hash of the uploaded file, the kind of
+    result and PROCESSOR_VERSION, so byte-identical uploads reuse the stored
+    result without being parsed again.
+    """
+
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES):
+        """
+        Open a cache directory, indexing any entries already in it
+
+        Args:
+            cache_dir: Directory for cached results
+            max_bytes: Total size of entries kept before the least recently used are evicted
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hashes = OrderedDict()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        existing = []
+        for name in os.listdir(cache_dir):
+            if name.endswith('.pkl'):
+                stat = os.stat(os.path.join(cache_dir, name))
+                existing.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(existing):
+            self._entries[key] = size
+
+    def key_for(self, file_path, kind):
+        """
+        Build the cache key for a file and result kind
+
+        Args:
+            file_path: Path to the uploaded file
+            kind: Name of the result, e.g. 'upload:csv' or 'analysis:full'
+
+        Returns:
+            str: Cache key
+        """
+        stat = os.stat(file_path)
+        signature = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            content_hash = self._hashes.get(signature)
+            if content_hash is not None:
+                self._hashes.move_to_end(signature)
+        if content_hash is None:
+            content_hash = file_sha256(file_path)
+            self._remember(signature, content_hash)
+        return hashlib.sha256(f"{content_hash}:{kind}:{PROCESSOR_VERSION}".encode('utf-8')).hexdigest()
+
+    def remember_hash(self, file_path, content_hash):
+        """
+        Record the content hash of a file whose bytes were already hashed,
+        so key_for does not read it again
+
+        Args:
+            file_path: Path to the file
+            content_hash: Hex SHA-256 of its contents
+        """
+        stat = os.stat(file_path)
+        self._remember((os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns), content_hash)
+
+    def _remember(self, signature, content_hash):
+        with self._lock:
+            self._hashes[signature] = content_hash
+            self._hashes.move_to_end(signature)
+            while len(self._hashes) > HASH_MEMORY_ENTRIES:
+                self._hashes.popitem(last=False)
+
+    def get(self, key):
+        """
+        Return a cached result, or None on a miss
+
+        Args:
+            key: Cache key from key_for
+
+        Returns:
+            object: The stored result, or None
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as entry:
+                result = pickle.load(entry)
+        except (OSError, pickle.PickleError, EOFError):
+            with self._lock:
+                self.misses += 1
+                self._entries.pop(key, None)
+            return None
+
+        with self._lock:
+            self.hits += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, result):
+        """
+        Store a result and evict least recently used entries over the size limit
+
+        Args:
+            key: Cache key from key_for
+            result: Picklable result to store
+        """
+        handle, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as entry:
+                pickle.dump(result, entry, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._path(key))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with self._lock:
+            self._entries[key] = os.path.getsize(self._path(key))
+            self._entries.move_to_end(key)
+            total = sum(self._entries.values())
+            while total > self.max_bytes and len(self._entries) > 1:
+                evicted, size = self._entries.popitem(last=False)
+                total -= size
+                try:
+                    os.remove(self._path(evicted))
+                except OSError:
+                    pass
+                logger.debug(f"Evicted cached result {evicted}")
+
+    def get_or_compute(self, file_path, kind, compute):
+        """
+        Return the cached result for a file, computing and storing it on a miss
+
+        Args:
+            file_path: Path to the uploaded file
+            kind: Name of the result
+            compute: Function producing the result when it is not cached
+
+        Returns:
+            object: The cached or freshly computed result; None results are not stored
+        """
+        key = self.key_for(file_path, kind)
+        result = self.get(key)
+        if result is not None:
+            logger.info(f"Result cache hit for {kind} of {file_path}")
+            return result
+
+        result = compute()
+        if result is not None:
+            try:
+                self.put(key, result)
+            except Exception as e:
+                logger.warning(f"Could not cache {kind} of {file_path}: {str(e)}")
+        return result
+
+    def stats(self):
+        """
+        Return cache counters
+
+        Returns:
+            dict: Hits, misses, stored entries and their total size in bytes
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': sum(self._entries.values())
+            }
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+
+# Shared cache used by the upload and analysis entry points
+result_cache = ResultCache()
@@ -47,22 +47,7 @@ document.addEventListener('DOMContentLoaded', function() {
             : 'chat-message chat-message-ai';
         
         // Format message content
-        if (!isUser) {
-            // Process links in AI messages
-            message = message.replace(
-                /(https?:\/\/[^\s]+)/g, 
-                '<a href="$1" target="_blank" rel="noopener noreferrer">$1</a>'
-            );
-            
-            // Convert markdown-style formatting
-            message = message
-                .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>')
-                .replace(/\*(.*?)\*/g, '<em>$1</em>')
-                .replace(/```([\s\S]*?)```/g, '<pre><code>$1</code></pre>')
-                .replace(/`([^`]+)`/g, '<code>$1</code>');
-        }
-        
-        messageElement.innerHTML = message;
+        messageElement.innerHTML = isUser ? message : formatAiMessage(message);
         chatContainer.appendChild(messageElement);
         
         // Scroll to bottom
@@ -71,6 +56,26 @@ document.addEventListener('DOMContentLoaded', function() {
         return messageElement;
     }
     
+    /**
+     * Format an AI message for display
+     * @param {string} message - Message text
+     * @return {string} HTML with links and markdown-style formatting applied
+     */
+    function formatAiMessage(message) {
+        // Process links in AI messages
+        message = message.replace(
+            /(https?:\/\/[^\s]+)/g, 
+            '<a href="$1" target="_blank" rel="noopener noreferrer">$1</a>'
+        );
+        
+        // Convert markdown-style formatting
+        return message
+            .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>')
+            .replace(/\*(.*?)\*/g, '<em>$1</em>')
+            .replace(/```([\s\S]*?)```/g, '<pre><code>$1</code></pre>')
+            .replace(/`([^`]+)`/g, '<code>$1</code>');
+    }
+    
     /**
      * Add loading indicator while waiting for AI response
      * @return {HTMLElement} The loading indicator element
@@ -88,12 +93,133 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     /**
-     * Send chat message to server
+     * Send chat message to server, rendering the answer as it streams in.
+     * Falls back to a single request when streaming is unavailable.
      * @param {string} message - User message
      * @param {string} sessionId - Chat session ID
      * @param {HTMLElement} loadingElement - Loading indicator element to replace
      */
     function sendChatMessage(message, sessionId, loadingElement) {
+        if (!window.ReadableStream || !window.TextDecoder) {
+            sendChatMessageWhole(message, sessionId, loadingElement);
+            return;
+        }
+        
+        const formData = new FormData();
+        formData.append('message', message);
+        formData.append('session_id', sessionId);
+        
+        let answer = '';
+        let messageElement = null;
+        
+        function handleEvent(event, data) {
+            if (event === 'token') {
+                answer += data.text;
+                if (!messageElement) {
+                    // First token: swap the loading indicator for the answer
+                    if (loadingElement) {
+                        chatContainer.removeChild(loadingElement);
+                        loadingElement = null;
+                    }
+                    messageElement = addMessageToChat('', false);
+                }
+                messageElement.innerHTML = formatAiMessage(answer);
+                scrollChatToBottom();
+            } else if (event === 'queued') {
+                if (loadingElement) {
+                    loadingElement.innerHTML = '<div class="typing-indicator"><span></span><span></span><span></span></div>' +
+                        '<small class="text-muted">High demand, answering in about ' +
+                        Math.ceil(data.wait_seconds) + 's</small>';
+                }
+            } else if (event === 'done') {
+                if (messageElement && data.ai_message) {
+                    messageElement.innerHTML = formatAiMessage(data.ai_message.content);
+                }
+            } else if (event === 'error') {
+                if (!messageElement && data.fallback) {
+                    throw new Error(data.error);
+                }
+                if (loadingElement) {
+                    chatContainer.removeChild(loadingElement);
+                    loadingElement = null;
+                }
+                addMessageToChat('Sorry, I encountered an error: ' + data.error, false);
+            }
+        }
+        
+        fetch('/send_message/stream', {
+            method: 'POST',
+            body: formData,
+            headers: {'Accept': 'text/event-stream'}
+        })
+        .then(response => {
+            if (!response.ok || !response.body) {
+                throw new Error('Streaming is not available');
+            }
+            return readEventStream(response.body.getReader(), handleEvent);
+        })
+        .catch(error => {
+            if (!messageElement) {
+                // Nothing was shown or saved yet; ask again without streaming
+                console.warn('Streaming failed, retrying without streaming:', error);
+                sendChatMessageWhole(message, sessionId, loadingElement);
+            } else {
+                console.error('Error streaming message:', error);
+                addMessageToChat('Sorry, the response was interrupted. Please try again.', false);
+            }
+        });
+    }
+    
+    /**
+     * Read server-sent events from a fetch response body
+     * @param {ReadableStreamDefaultReader} reader - Reader of the response body
+     * @param {Function} onEvent - Called with the event name and parsed data
+     * @return {Promise} Resolves when the stream ends
+     */
+    function readEventStream(reader, onEvent) {
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        function pump() {
+            return reader.read().then(({done, value}) => {
+                buffer += decoder.decode(value || new Uint8Array(), {stream: !done});
+                
+                // Events are separated by a blank line
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const block = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    
+                    let event = 'message';
+                    let data = '';
+                    block.split('\n').forEach(line => {
+                        if (line.startsWith('event:')) {
+                            event = line.slice(6).trim();
+                        } else if (line.startsWith('data:')) {
+                            data += line.slice(5).trim();
+                        }
+                    });
+                    if (data) {
+                        onEvent(event, JSON.parse(data));
+                    }
+                }
+                
+                if (!done) {
+                    return pump();
+                }
+            });
+        }
+        
+        return pump();
+    }
+    
+    /**
+     * Send chat message to server and show the complete answer at once
+     * @param {string} message - User message
+     * @param {string} sessionId - Chat session ID
+     * @param {HTMLElement} loadingElement - Loading indicator element to replace
+     */
+    function sendChatMessageWhole(message, sessionId, loadingElement) {
         // Create form data
         const formData = new FormData();
         formData.append('message', message);
@@ -114,6 +240,7 @@ document.addEventListener('DOMContentLoaded', function() {
             // Remove loading indicator
             if (loadingElement) {
                 chatContainer.removeChild(loadingElement);
+                loadingElement = null;
             }
             
             // Add AI response to chat
@@ -126,9 +253,10 @@ document.addEventListener('DOMContentLoaded', function() {
         .catch(error => {
             console.error('Error sending message:', error);
             
-            // Remove loading indicator
+            // Remove loading indicator, unless the response handler already did
             if (loadingElement) {
                 chatContainer.removeChild(loadingElement);
+                loadingElement = null;
             }
             
             // Add error message
@@ -0,0 +1,583 @@
+"""
+Transaction Index
+Per-upload BM25 retrieval index over transaction descriptions, categories and accounts, for grounded chat answers
+"""
+
+import os
+import re
+import csv
+import json
+import math
+import time
+import shutil
+import logging
+import calendar
+import threading
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('fintelligence')
+
+# Columns whose words are indexed
+INDEXED_COLUMNS = ('Description', 'Category', 'Account')
+
+# Columns kept for each row returned by a search
+STORED_COLUMNS = ('Date', 'Account', 'Category', 'Description', 'Amount', 'Type')
+
+# Rows read and indexed per segment while building
+INDEX_SEGMENT_ROWS = int(os.environ.get('INDEX_SEGMENT_ROWS', 200000))
+
+# Segments allowed before they are merged into one
+INDEX_MAX_SEGMENTS = 16
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Query terms found in more than this share of rows are ignored when rarer terms are present
+COMMON_TERM_SHARE = 0.5
+
+# Indexes kept loaded in memory, by upload path
+INDEX_MEMORY_ENTRIES = 8
+
+# Seconds without progress after which an unfinished build is taken to have stopped
+INDEX_BUILD_STALE_SECONDS = int(os.environ.get('INDEX_BUILD_STALE_SECONDS', 300))
+
+# Bumped whenever the on-disk layout changes, so old indexes are rebuilt
+INDEX_VERSION = 2
+
+_TOKEN = re.compile(r'[a-z0-9]+(?:-[a-z0-9]+)*')
+_STOPWORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'did', 'do', 'does', 'for', 'from', 'how', 'i',
+    'in', 'is', 'it', 'me', 'my', 'of', 'on', 'or', 'our', 'show', 'so', 'the', 'to', 'was', 'we',
+    'were', 'what', 'when', 'which', 'who', 'why', 'with'
+))
+
+_loaded = OrderedDict()
+_loaded_lock = threading.Lock()
+_building = set()
+_building_lock = threading.Lock()
+
+
+def tokenize(text):
+    """
+    Split text into index terms
+
+    Args:
+        text: Text to split
+
+    Returns:
+        list: Lowercase terms without stopwords
+    """
+    return [term for term in _TOKEN.findall(str(text).lower()) if term not in _STOPWORDS]
+
+
+def index_dir_for(file_path):
+    """Directory holding the index of an upload, next to the file"""
+    return f"{file_path}.index"
+
+
+class TransactionIndex:
+    """
+    BM25 index over the transactions of one upload.
+
+    The index is a list of immutable segments, one per batch of rows added.
+    Each segment holds its postings as NumPy arrays sorted by term, the
+    length of every row and the rows themselves as CSV lines with their
+    byte offsets, so a search reads only the rows it returns. Adding rows
+    writes a new segment and never rewrites old ones; once there are more
+    than INDEX_MAX_SEGMENTS they are merged.
+
+    Searching looks up each query term with a binary search per segment and
+    sums BM25 scores over the matching rows only, so its cost depends on how
+    many rows contain the query terms, not on the size of the upload.
+    """
+
+    def __init__(self, directory):
+        """
+        Open or create the index stored in a directory
+
+        Args:
+            directory: Folder of the index
+        """
+        self.directory = directory
+        self.vocabulary = {}
+        self.segments = []
+        self.rows = 0
+        self.total_length = 0
+        self.complete = False
+        self._lock = threading.Lock()
+
+        meta_path = os.path.join(directory, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+            if meta.get('version') == INDEX_VERSION:
+                self.rows = meta['rows']
+                self.total_length = meta['total_length']
+                self.complete = meta.get('complete', False) and meta.get('expected_rows') == self.rows
+                self.segments = [_Segment.load(directory, name, offset) for name, offset in meta['segments']]
+                with open(os.path.join(directory, 'vocabulary.json'), 'r', encoding='utf-8') as vocabulary_file:
+                    self.vocabulary = {term: term_id for term_id, term in enumerate(json.load(vocabulary_file))}
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def build(cls, file_path, file_type, chunk_size=INDEX_SEGMENT_ROWS):
+        """
+        Index an upload from scratch, a segment at a time
+
+        Args:
+            file_path: Path to the uploaded file
+            file_type: File extension (csv, xlsx, pdf or a compressed CSV type)
+            chunk_size: Rows per segment
+
+        Returns:
+            TransactionIndex: The index, saved next to the upload
+        """
+        directory = index_dir_for(file_path)
+        with _loaded_lock:
+            _loaded.pop(directory, None)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        index = cls(directory)
+        with index._lock:
+            # Claims the folder for this build before the first segment is written
+            index._save_meta()
+        date_format = None
+        for frame in iter_upload_frames(file_path, file_type, chunk_size):
+            if date_format is None and 'Date' in frame.columns and len(frame):
+                from financial_data_processor import detect_date_format
+                date_format = detect_date_format(frame['Date'].astype(str))
+            index.add_frame(frame, date_format)
+        index.finish()
+        logger.info(f"Indexed {index.rows} transactions of {file_path} in {len(index.segments)} segments")
+        return index
+
+    def add_frame(self, frame, date_format=None):
+        """
+        Index more rows as a new segment
+
+        Args:
+            frame: DataFrame of transactions; missing columns are left empty
+            date_format: Format of the Date column, detected if None
+        """
+        if frame is None or not len(frame):
+            return
+        frame = frame.reset_index(drop=True)
+        with self._lock:
+            term_ids, local_rows = [], []
+            for column in INDEXED_COLUMNS:
+                if column in frame.columns:
+                    codes, uniques = pd.factorize(frame[column].fillna('').astype(str).to_numpy())
+                    self._add_occurrences(codes, uniques, term_ids, local_rows)
+
+            # Month terms let "utilities in february" find February's rows
+            if 'Date' in frame.columns:
+                dates = pd.to_datetime(frame['Date'].astype(str), format=date_format, errors='coerce')
+                months = (dates.dt.year.fillna(0) * 100 + dates.dt.month.fillna(0)).astype(np.int64).to_numpy()
+                codes, uniques = pd.factorize(months)
+                labels = [f"{calendar.month_name[month % 100].lower()} {month // 100:04d}-{month % 100:02d}"
+                          if month else '' for month in uniques]
+                self._add_occurrences(codes, labels, term_ids, local_rows)
+
+            segment = _Segment.create(
+                self.directory, f"segment_{len(self.segments):05d}_{self.rows}", self.rows,
+                np.concatenate(term_ids), np.concatenate(local_rows), len(frame), _stored_lines(frame)
+            )
+            self.segments.append(segment)
+            self.rows += len(frame)
+            self.total_length += int(segment.lengths.sum())
+            replaced = self._merge_segments() if len(self.segments) > INDEX_MAX_SEGMENTS else []
+            # The new meta goes first, so a reader never finds it naming removed files
+            self._save_meta()
+            for old_segment in replaced:
+                old_segment.remove()
+
+    def finish(self):
+        """
+        Mark the index as holding every row of its upload
+
+        Only a finished index is served once its build has stopped; rows added
+        afterwards need another call before it counts as finished again
+        """
+        with self._lock:
+            self.complete = True
+            self._save_meta()
+
+    def _add_occurrences(self, codes, values, term_ids, local_rows):
+        """
+        Append the term occurrences of one column; caller holds the lock
+
+        Each distinct value is tokenized once, so repeated categories and
+        accounts cost a lookup per row rather than a parse.
+
+        Args:
+            codes: Position in values of each row's value
+            values: Distinct values of the column
+            term_ids: List collecting arrays of term ids
+            local_rows: List collecting arrays of row positions
+        """
+        value_terms = [[self.vocabulary.setdefault(term, len(self.vocabulary)) for term in tokenize(value)]
+                       for value in values]
+        value_lengths = np.fromiter((len(terms) for terms in value_terms), dtype=np.int64, count=len(value_terms))
+        flat_terms = np.fromiter(itertools.chain.from_iterable(value_terms), dtype=np.int64,
+                                 count=int(value_lengths.sum()))
+        value_starts = np.cumsum(value_lengths) - value_lengths
+
+        row_lengths = value_lengths[codes]
+        total = int(row_lengths.sum())
+        within = np.arange(total, dtype=np.int64) - np.repeat(np.cumsum(row_lengths) - row_lengths, row_lengths)
+        term_ids.append(flat_terms[np.repeat(value_starts[codes], row_lengths) + within])
+        local_rows.append(np.repeat(np.arange(len(codes), dtype=np.int64), row_lengths))
+
+    def search(self, query, k=8):
+        """
+        Find the rows most relevant to a query
+
+        Args:
+            query: Question or keywords
+            k: Rows to return at most
+
+        Returns:
+            list: (score, row) pairs, best first, each row a dict of STORED_COLUMNS as text
+        """
+        with self._lock:
+            term_ids = sorted({self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary})
+            segments = list(self.segments)
+            rows, total_length = self.rows, self.total_length
+        if not term_ids or not rows:
+            return []
+
+        # Document frequency of each query term across segments
+        frequencies = {term_id: sum(segment.frequency(term_id) for segment in segments) for term_id in term_ids}
+        rare = [term_id for term_id in term_ids if frequencies[term_id] <= COMMON_TERM_SHARE * rows]
+        if rare:
+            term_ids = rare
+        average_length = total_length / rows
+
+        matched_rows, matched_scores = [], []
+        for term_id in term_ids:
+            frequency = frequencies[term_id]
+            idf = math.log(1 + (rows - frequency + 0.5) / (frequency + 0.5))
+            for segment in segments:
+                local_rows, counts = segment.postings(term_id)
+                if not len(local_rows):
+                    continue
+                counts = counts.astype(np.float64)
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * segment.lengths[local_rows] / average_length)
+                matched_rows.append(local_rows + segment.offset)
+                matched_scores.append(idf * counts * (BM25_K1 + 1) / (counts + norm))
+        if not matched_rows:
+            return []
+
+        candidates = np.concatenate(matched_rows)
+        scores = np.bincount(candidates, weights=np.concatenate(matched_scores))
+        # A row appears once per matching term, so the best k * terms entries hold the best k rows
+        keep = k * len(term_ids)
+        if len(candidates) > keep:
+            candidates = candidates[np.argpartition(-scores[candidates], keep - 1)[:keep]]
+        candidates = np.unique(candidates)
+        top = candidates[np.argsort(-scores[candidates], kind='stable')[:k]]
+        return [(float(scores[row]), self._row(int(row), segments)) for row in top]
+
+    def _row(self, row, segments):
+        """Read one stored row by its position in the upload"""
+        for segment in reversed(segments):
+            if row >= segment.offset:
+                return segment.row(row - segment.offset)
+        raise IndexError(row)
+
+    def _merge_segments(self):
+        """
+        Merge every segment into one; caller holds the lock
+
+        Returns:
+            list: The replaced segments, whose files the caller removes once
+                the meta no longer names them
+        """
+        term_ids, local_rows, stored = [], [], []
+        for segment in self.segments:
+            segment_terms, segment_rows = segment.all_postings()
+            term_ids.append(segment_terms)
+            local_rows.append(segment_rows + segment.offset)
+            stored.append(segment.stored_bytes())
+        old_segments = self.segments
+        merged = _Segment.create(
+            self.directory, f"segment_merged_{self.rows}", 0,
+            np.concatenate(term_ids), np.concatenate(local_rows), self.rows, b''.join(stored)
+        )
+        self.segments = [merged]
+        return old_segments
+
+    def _save_meta(self):
+        """Write the vocabulary and segment list; caller holds the lock"""
+        vocabulary = sorted(self.vocabulary, key=self.vocabulary.get)
+        _write_json(os.path.join(self.directory, 'vocabulary.json'), vocabulary)
+        _write_json(os.path.join(self.directory, 'meta.json'), {
+            'version': INDEX_VERSION,
+            'rows': self.rows,
+            'total_length': self.total_length,
+            'segments': [[segment.name, segment.offset] for segment in self.segments],
+            'complete': self.complete,
+            'expected_rows': self.rows if self.complete else None
+        })
+
+
+class _Segment:
+    """Immutable postings and stored rows for a run of consecutive rows"""
+
+    def __init__(self, directory, name, offset, terms, starts, rows, counts, lengths, line_offsets):
+        self.directory = directory
+        self.name = name
+        self.offset = offset
+        self.terms = terms
+        self.starts = starts
+        self.rows = rows
+        self.counts = counts
+        self.lengths = lengths
+        self.line_offsets = line_offsets
+
+    @classmethod
+    def create(cls, directory, name, offset, term_ids, local_rows, row_count, stored):
+        """
+        Write a segment from one (term, row) pair per term occurrence
+
+        Args:
+            directory: Folder of the index
+            name: Segment name
+            offset: Position of the segment's first row in the upload
+            term_ids: Term of each occurrence
+            local_rows: Row of each occurrence, counted from the segment start
+            row_count: Rows in the segment
+            stored: CSV bytes of the rows' STORED_COLUMNS, one line per row
+
+        Returns:
+            _Segment: The segment
+        """
+        lengths = np.bincount(local_rows, minlength=row_count).astype(np.int32)
+        # One key per (term, row) pair, so a single sort groups postings by term then row
+        pairs, counts = np.unique(term_ids * row_count + local_rows, return_counts=True)
+        pair_terms = pairs // row_count
+        terms, starts = np.unique(pair_terms, return_index=True)
+
+        with open(os.path.join(directory, f"{name}.csv"), 'wb') as rows_file:
+            rows_file.write(stored)
+        line_ends = np.flatnonzero(np.frombuffer(stored, dtype=np.uint8) == ord('\n')) + 1
+        line_offsets = np.concatenate([[0], line_ends]).astype(np.int64)
+
+        segment = cls(directory, name, offset, terms, starts.astype(np.int64), (pairs % row_count).astype(np.int32),
+                      np.minimum(counts, np.iinfo(np.uint16).max).astype(np.uint16), lengths, line_offsets)
+        np.savez(os.path.join(directory, f"{name}.npz"), terms=segment.terms, starts=segment.starts,
+                 rows=segment.rows, counts=segment.counts, lengths=segment.lengths, line_offsets=line_offsets)
+        return segment
+
+    @classmethod
+    def load(cls, directory, name, offset):
+        with np.load(os.path.join(directory, f"{name}.npz")) as arrays:
+            return cls(directory, name, offset, arrays['terms'], arrays['starts'], arrays['rows'],
+                       arrays['counts'], arrays['lengths'], arrays['line_offsets'])
+
+    def _bounds(self, term_id):
+        position = int(np.searchsorted(self.terms, term_id))
+        if position == len(self.terms) or self.terms[position] != term_id:
+            return 0, 0
+        end = int(self.starts[position + 1]) if position + 1 < len(self.starts) else len(self.rows)
+        return int(self.starts[position]), end
+
+    def frequency(self, term_id):
+        """Rows of the segment containing a term"""
+        start, end = self._bounds(term_id)
+        return end - start
+
+    def postings(self, term_id):
+        """Rows containing a term and its count in each"""
+        start, end = self._bounds(term_id)
+        return self.rows[start:end], self.counts[start:end]
+
+    def all_postings(self):
+        """Term and row of every posting, with counts expanded back to occurrences"""
+        terms = np.repeat(self.terms, np.diff(np.append(self.starts, len(self.rows))))
+        return np.repeat(terms, self.counts), np.repeat(self.rows.astype(np.int64), self.counts)
+
+    def row(self, position):
+        """Read one stored row"""
+        with open(os.path.join(self.directory, f"{self.name}.csv"), 'rb') as rows_file:
+            rows_file.seek(int(self.line_offsets[position]))
+            values = next(csv.reader([rows_file.readline().decode('utf-8')]))
+        return dict(zip(STORED_COLUMNS, values))
+
+    def stored_bytes(self):
+        with open(os.path.join(self.directory, f"{self.name}.csv"), 'rb') as rows_file:
+            return rows_file.read()
+
+    def remove(self):
+        for extension in ('npz', 'csv'):
+            path = os.path.join(self.directory, f"{self.name}.{extension}")
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _stored_lines(frame):
+    """CSV bytes of each row's STORED_COLUMNS, with line breaks inside values flattened"""
+    stored = frame.reindex(columns=list(STORED_COLUMNS)).fillna('').astype(str)
+    stored = stored.replace(to_replace=r'[\r\n]+', value=' ', regex=True)
+    return stored.to_csv(header=False, index=False, lineterminator='\n').encode('utf-8')
+
+
+def _write_json(path, payload):
+    """Write JSON through a temporary file so readers never see half a file"""
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as output:
+        json.dump(payload, output)
+    os.replace(temporary_path, path)
+
+
+def iter_upload_frames(file_path, file_type, chunk_size=INDEX_SEGMENT_ROWS):
+    """
+    Read an upload as DataFrames of at most chunk_size transactions
+
+    Args:
+        file_path: Path to the uploaded file
+        file_type: File extension (csv, xlsx, pdf or a compressed CSV type)
+        chunk_size: Rows per DataFrame
+
+    Yields:
+        DataFrame: Consecutive transactions
+    """
+    if file_type == 'xlsx':
+        from file_processor import iter_xlsx_frames
+        yield from iter_xlsx_frames(file_path, chunk_size=chunk_size)
+        return
+    if file_type == 'pdf':
+        from pdf_statements import iter_pdf_frames
+        yield from iter_pdf_frames(file_path, chunk_size=chunk_size)
+        return
+
+    from compressed_files import open_csv_source
+    with open_csv_source(file_path) as source:
+        try:
+            yield from pd.read_csv(source, dtype=str, keep_default_na=False, encoding='utf-8', chunksize=chunk_size)
+        except pd.errors.EmptyDataError:
+            return
+
+
+def load_index(file_path):
+    """
+    Return the index of an upload if it has been built
+
+    Args:
+        file_path: Path to the uploaded file
+
+    Returns:
+        TransactionIndex: The index, or None if it is missing or its build stopped unfinished
+    """
+    directory = index_dir_for(file_path)
+    with _loaded_lock:
+        index = _loaded.get(directory)
+        if index is not None:
+            _loaded.move_to_end(directory)
+            return index
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        return None
+
+    try:
+        index = TransactionIndex(directory)
+    except FileNotFoundError:
+        # A merge replaced the segments between reading the meta and opening them
+        index = TransactionIndex(directory)
+    if not index.complete:
+        # A running build serves the rows indexed so far, and caches its own index when done;
+        # one that stopped partway is treated as missing so it gets rebuilt
+        if index.segments and _build_running(file_path, directory):
+            return index
+        return None
+    with _loaded_lock:
+        _loaded[directory] = index
+        while len(_loaded) > INDEX_MEMORY_ENTRIES:
+            _loaded.popitem(last=False)
+    return index
+
+
+def build_index_in_background(file_path, file_type):
+    """
+    Start indexing an upload in a background thread unless it is indexed or being indexed
+
+    Args:
+        file_path: Path to the uploaded file
+        file_type: File extension (csv, xlsx, pdf or a compressed CSV type)
+
+    Returns:
+        bool: True if a build was started
+    """
+    if load_index(file_path) is not None or _build_running(file_path, index_dir_for(file_path)):
+        return False
+    with _building_lock:
+        if file_path in _building:
+            return False
+        _building.add(file_path)
+
+    def build():
+        try:
+            index = TransactionIndex.build(file_path, file_type)
+            with _loaded_lock:
+                _loaded[index.directory] = index
+        except Exception as e:
+            logger.error(f"Error indexing transactions of {file_path}: {str(e)}")
+        finally:
+            with _building_lock:
+                _building.discard(file_path)
+
+    threading.Thread(target=build, name='transaction-index', daemon=True).start()
+    return True
+
+
+def _build_running(file_path, directory):
+    """
+    Whether an index is being built, here or by another worker that saved progress recently
+
+    Args:
+        file_path: Path to the uploaded file
+        directory: Folder of its index
+
+    Returns:
+        bool: True if a build is under way
+    """
+    with _building_lock:
+        if file_path in _building:
+            return True
+    try:
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+        saved_at = os.path.getmtime(os.path.join(directory, 'meta.json'))
+    except (OSError, ValueError):
+        return False
+    return not meta.get('complete', False) and time.time() - saved_at < INDEX_BUILD_STALE_SECONDS
+
+
+def relevant_transactions(file_path, question, k=8):
+    """
+    Format the rows of an upload most relevant to a question for a chat prompt
+
+    Args:
+        file_path: Path to the uploaded file
+        question: The user's question
+        k: Rows to include at most
+
+    Returns:
+        str: One line per row, or an empty string if there is no index or match
+    """
+    try:
+        index = load_index(file_path)
+        if index is None:
+            return ""
+        matches = index.search(question, k)
+    except Exception as e:
+        logger.error(f"Error searching transactions of {file_path}: {str(e)}")
+        return ""
+    return "\n".join(
+        " | ".join(str(row.get(column, '')) for column in STORED_COLUMNS if column in row)
+        for _, row in matches
+    )